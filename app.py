@@ -1,7 +1,7 @@
 import os
 import json
 import time
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import threading
 
@@ -11,15 +11,21 @@ from memory.memory_manager import MemoryManager
 from media.multimedia_manager import MultimediaManager
 from workspace.workspace_manager import WorkspaceManager
 
+from inference.batcher import MicroBatcher, QueueFull
+from inference.response_cache import ResponseCache
+from storage.pagination import encode_cursor, paginate
+
 # Import existing AI service
 from ai_service import AIService
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
+# Behind nginx/Apache, let the front server send media files (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
 
 # Initialize managers
-training_manager = TrainingManager(model_dir="models", logs_dir="logs")
-memory_manager = MemoryManager(memory_dir="memory")
+memory_manager = MemoryManager(memory_dir="memory", workspace_dir="workspace")
+training_manager = TrainingManager(model_dir="models", logs_dir="logs", memory_manager=memory_manager)
 multimedia_manager = MultimediaManager(media_dir="media")
 workspace_manager = WorkspaceManager(workspace_dir="workspace")
 
@@ -29,6 +35,40 @@ ai_service.training_manager = training_manager
 ai_service.memory_manager = memory_manager
 ai_service.multimedia_manager = multimedia_manager
 ai_service.workspace_manager = workspace_manager
+# Loaded models are shared, so inference never reloads weights per request
+ai_service.model_registry = training_manager.registry
+
+# Batching only pays off when the model answers many prompts in one call
+CHAT_BATCHED = hasattr(ai_service, 'generate_responses')
+
+def _generate_batch(requests: list) -> list:
+    """Generate responses for a batch of (message, history) pairs."""
+    if CHAT_BATCHED:
+        # One vectorised call for the whole batch
+        return ai_service.generate_responses([message for message, _ in requests],
+                                             [history for _, history in requests])
+    # Batches hold a single request, so a failure only fails that request
+    return [ai_service.generate_response(message, history) for message, history in requests]
+
+# Chat requests arriving within a few milliseconds are answered as one batch
+chat_batcher = MicroBatcher(
+    "chat", _generate_batch,
+    max_batch_size=int(os.environ.get('CHAT_BATCH_SIZE', 16)) if CHAT_BATCHED else 1,
+    max_wait=float(os.environ.get('CHAT_BATCH_WAIT_MS', 5)) / 1000,
+    max_queue=int(os.environ.get('CHAT_QUEUE_DEPTH', 256)),
+    # Without a batch API each worker answers one request at a time
+    workers=int(os.environ.get('CHAT_BATCH_WORKERS', 1 if CHAT_BATCHED else 8))
+)
+
+# Repeated prompts in the same recent context are answered from cache until
+# another model is promoted; RESPONSE_CACHE_DIR adds a tier that survives restarts
+response_cache = ResponseCache(
+    cache_dir=os.environ.get('RESPONSE_CACHE_DIR') or None,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+    history_window=int(os.environ.get('RESPONSE_CACHE_HISTORY', 4))
+)
+training_manager.registry.add_listener(response_cache.invalidate)
 
 # Setup GitHub backup thread
 def github_backup_thread():
@@ -78,6 +118,29 @@ def workspace():
     
     return render_template('workspace.html', workspace=workspace)
 
+def _conversation_history(conversation_id: str, user_message: str) -> list:
+    """Load a conversation's history with the new user message appended."""
+    conversation = memory_manager.get_conversation(conversation_id)
+    # Copy so the cached conversation is not mutated before it is saved
+    messages = list(conversation.get('messages', [])) if conversation else []
+    
+    messages.append({
+        "role": "user",
+        "content": user_message,
+        "timestamp": time.time()
+    })
+    return messages
+
+def _sse_event(data: dict, event: str = None, event_id: int = None) -> str:
+    """Format a Server-Sent Events message."""
+    return _sse_message(json.dumps(data), event, event_id)
+
+def _sse_message(payload: str, event: str = None, event_id: int = None) -> str:
+    """Format a Server-Sent Events message from an already serialised payload."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    prefix += f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat messages."""
@@ -86,19 +149,21 @@ def chat():
     conversation_id = data.get('conversation_id', 'default')
     user_id = data.get('user_id', 'anonymous')
     
-    # Get conversation history
-    conversation = memory_manager.get_conversation(conversation_id)
-    messages = conversation.get('messages', []) if conversation else []
+    # Get conversation history and add the user message
+    messages = _conversation_history(conversation_id, user_message)
     
-    # Add user message to history
-    messages.append({
-        "role": "user",
-        "content": user_message,
-        "timestamp": time.time()
-    })
+    # Only the messages that fit the context budget are sent to the model
+    context, _ = memory_manager.build_context(conversation_id, messages)
     
-    # Get AI response
-    ai_response = ai_service.generate_response(user_message, messages)
+    # Get AI response from cache, or batched with concurrent requests
+    cache_key = response_cache.key(user_message, context[:-1], training_manager.registry.version_tag())
+    ai_response = response_cache.get(cache_key)
+    if ai_response is None:
+        try:
+            ai_response = chat_batcher.submit((user_message, context))
+        except QueueFull as e:
+            return jsonify({"status": "error", "message": str(e)}), 503, {'Retry-After': '1'}
+        response_cache.set(cache_key, ai_response)
     
     # Add AI response to history
     messages.append({
@@ -107,7 +172,7 @@ def chat():
         "timestamp": time.time()
     })
     
-    # Save conversation
+    # Save conversation; the write-behind writer keeps disk I/O off this request
     memory_manager.save_conversation(conversation_id, messages)
     
     return jsonify({
@@ -115,23 +180,181 @@ def chat():
         "conversation_id": conversation_id
     })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream a chat response token by token as Server-Sent Events.
+    
+    Emits ``data: {"token": ...}`` events while the response is generated,
+    then a ``done`` event with the full response. The conversation is saved
+    by the background writer after the last token has been sent.
+    """
+    data = request.json
+    user_message = data.get('message', '')
+    conversation_id = data.get('conversation_id', 'default')
+    
+    messages = _conversation_history(conversation_id, user_message)
+    context, _ = memory_manager.build_context(conversation_id, messages)
+    
+    def generate():
+        tokens = []
+        try:
+            if hasattr(ai_service, 'generate_response_stream'):
+                chunks = ai_service.generate_response_stream(user_message, context)
+            else:
+                # Services without a streaming API send the whole response at once
+                chunks = [ai_service.generate_response(user_message, context)]
+            
+            for token in chunks:
+                tokens.append(token)
+                yield _sse_event({"token": token})
+        except Exception as e:
+            yield _sse_event({"message": str(e)}, event="error")
+            return
+        
+        ai_response = "".join(tokens)
+        messages.append({
+            "role": "assistant",
+            "content": ai_response,
+            "timestamp": time.time()
+        })
+        memory_manager.save_conversation(conversation_id, messages)
+        
+        yield _sse_event({"response": ai_response, "conversation_id": conversation_id}, event="done")
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/training/start', methods=['POST'])
 def start_training():
-    """Start model training."""
+    """Queue a model training job."""
     data = request.json
     model_name = data.get('model_name', 'default_model')
     dataset_path = data.get('dataset_path', 'data/default')
     params = data.get('params', {})
+    priority = data.get('priority', 0)
     
-    result = training_manager.start_training(model_name, dataset_path, params)
+    result = training_manager.start_training(model_name, dataset_path, params, priority=priority)
     return jsonify(result)
 
 @app.route('/api/training/progress', methods=['GET'])
 def get_training_progress():
-    """Get current training progress."""
-    progress = training_manager.get_progress()
+    """Get training progress for a job, or for the most recent job."""
+    job_id = request.args.get('job_id')
+    progress = training_manager.get_progress(job_id)
+    if progress is None:
+        return jsonify({"status": "error", "message": f"Unknown training job: {job_id}"}), 404
     return jsonify(progress)
 
+@app.route('/api/training/events', methods=['GET'])
+def training_events():
+    """Push training progress changes as Server-Sent Events.
+    
+    A new watcher first gets a ``snapshot`` event, then ``progress`` deltas,
+    ``stage`` transitions and ``job`` status changes. Reconnecting with
+    ``Last-Event-ID`` replays what was missed, or sends a fresh snapshot if
+    that is no longer buffered.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    bus = training_manager.events
+    
+    def generate():
+        try:
+            cursor = int(last_event_id)
+            events = bus.since(cursor)
+        except (TypeError, ValueError):
+            events = None
+        
+        while True:
+            if events is None:
+                cursor = bus.last_id()
+                yield _sse_event(training_manager.get_progress(), event="snapshot", event_id=cursor)
+                events = []
+            
+            for event_id, event, payload in events:
+                yield _sse_message(payload, event, event_id)
+                cursor = event_id
+            
+            events = bus.wait(cursor, timeout=15)
+            if events == []:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/training/jobs', methods=['GET'])
+def list_training_jobs():
+    """List training jobs, newest first."""
+    status = request.args.get('status')
+    return jsonify({"status": "success", "jobs": training_manager.list_jobs(status)})
+
+@app.route('/api/training/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_training_job(job_id):
+    """Cancel a queued or running training job."""
+    result = training_manager.cancel_training(job_id)
+    return jsonify(result)
+
+@app.route('/api/training/continuous-learning', methods=['POST'])
+def start_continuous_learning():
+    """Start learning from new conversation turns with the in-use model."""
+    data = request.json or {}
+    model_name = data.get('model_name', 'alpha_ai_model')
+    result = training_manager.start_continuous_learning(model_name, data.get('params'))
+    return jsonify(result)
+
+@app.route('/api/training/continuous-learning/stop', methods=['POST'])
+def stop_continuous_learning():
+    """Stop continuous learning."""
+    return jsonify(training_manager.stop_continuous_learning())
+
+@app.route('/api/training/history', methods=['GET'])
+def get_training_history():
+    """Most recent training runs, newest first, optionally for one model."""
+    model_name = request.args.get('model')
+    runs = training_manager.get_training_history(model_name, limit=_parse_limit(10))
+    return jsonify({"status": "success", "runs": runs})
+
+@app.route('/api/training/history/best', methods=['GET'])
+def get_best_training_runs():
+    """Best accuracy reached by each model."""
+    return jsonify({"status": "success", "models": training_manager.get_best_runs()})
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """List registered models, their versions and the version in use."""
+    return jsonify({"status": "success", "models": training_manager.list_models()})
+
+@app.route('/api/models/<model_name>/versions', methods=['GET'])
+def get_model_versions(model_name):
+    """Metadata of every stored version of a model."""
+    return jsonify({"status": "success", "versions": training_manager.get_model_versions(model_name)})
+
+@app.route('/api/models/<model_name>/promote', methods=['POST'])
+def promote_model(model_name):
+    """Put a stored version of a model in use."""
+    data = request.json or {}
+    if 'version' not in data:
+        return jsonify({"status": "error", "message": "version is required"}), 400
+    result = training_manager.promote_model(model_name, data['version'])
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
+@app.route('/api/models/predict', methods=['POST'])
+def predict():
+    """Classify texts with the in-use version of a model."""
+    data = request.json or {}
+    texts = data.get('texts') or [data.get('text', '')]
+    try:
+        labels = training_manager.predict(texts, data.get('model_name'))
+    except QueueFull as e:
+        return jsonify({"status": "error", "message": str(e)}), 503, {'Retry-After': '1'}
+    if labels is None:
+        return jsonify({"status": "error", "message": "No model is in use"}), 404
+    return jsonify({"status": "success", "labels": labels})
+
 @app.route('/api/workspace/create', methods=['POST'])
 def create_workspace():
     """Create a new workspace."""
@@ -140,11 +363,38 @@ def create_workspace():
     template_id = data.get('template_id', 'default')
     
     result = workspace_manager.create_workspace(workspace_id, template_id)
-    return jsonify(result)
+    return _workspace_response(result)
+
+def _expected_revision(data: dict = None):
+    """Revision a conditional update expects, from If-Match or ``expected_revision``."""
+    value = request.headers.get('If-Match')
+    if value and value.strip() != '*':
+        try:
+            return int(value.strip().replace('W/', '', 1).strip('"'))
+        except ValueError:
+            # Not one of our ETags, so it cannot match
+            return -1
+    if data and data.get('expected_revision') is not None:
+        try:
+            return int(data['expected_revision'])
+        except (TypeError, ValueError):
+            return -1
+    return None
+
+def _workspace_response(result: dict):
+    """JSON response for a workspace result, with its revision as the ETag."""
+    statuses = {"not_found": 404, "conflict": 412, "invalid_patch": 400}
+    status = 200 if result["status"] == "success" else statuses.get(result.get("error"), 400)
+    response = jsonify(result)
+    response.status_code = status
+    revision = result.get("revision", result.get("workspace", {}).get("revision"))
+    if revision is not None:
+        response.headers['ETag'] = f'"{revision}"'
+    return response
 
 @app.route('/api/workspace/update', methods=['POST'])
 def update_workspace():
-    """Update workspace configuration."""
+    """Update workspace configuration; honours If-Match for conditional updates."""
     data = request.json
     workspace_id = data.get('workspace_id')
     updates = data.get('updates', {})
@@ -152,15 +402,40 @@ def update_workspace():
     if not workspace_id:
         return jsonify({"status": "error", "message": "Workspace ID is required"})
     
-    result = workspace_manager.update_workspace(workspace_id, updates)
-    return jsonify(result)
+    result = workspace_manager.update_workspace(workspace_id, updates, _expected_revision(data))
+    return _workspace_response(result)
+
+@app.route('/api/workspace/<workspace_id>', methods=['GET'])
+def get_workspace(workspace_id):
+    """Get a workspace; the ETag is its revision."""
+    workspace = workspace_manager.get_workspace(workspace_id)
+    if workspace is None:
+        return jsonify({"status": "error", "message": f"Workspace not found: {workspace_id}"}), 404
+    return _workspace_response({"status": "success", "workspace": workspace})
+
+@app.route('/api/workspace/<workspace_id>', methods=['PATCH'])
+def patch_workspace(workspace_id):
+    """Apply a JSON Patch (RFC 6902) to a workspace; send If-Match to reject stale writers."""
+    operations = request.get_json(silent=True)
+    if not isinstance(operations, list):
+        return jsonify({"status": "error", "message": "Body must be a JSON Patch array"}), 400
+    
+    result = workspace_manager.patch_workspace(workspace_id, operations, _expected_revision())
+    return _workspace_response(result)
 
 @app.route('/api/workspace/detect-template', methods=['POST'])
 def detect_template():
-    """Detect appropriate workspace template for a task."""
+    """Detect appropriate workspace template for a task, or for a list of ``tasks``."""
     data = request.json
     task_description = data.get('task', '')
     
+    tasks = data.get('tasks')
+    if tasks is not None:
+        if not isinstance(tasks, list):
+            return jsonify({"status": "error", "message": "Tasks must be a list"}), 400
+        template_ids = workspace_manager.detect_appropriate_templates([str(task) for task in tasks])
+        return jsonify({"status": "success", "template_ids": template_ids})
+    
     if not task_description:
         return jsonify({"status": "error", "message": "Task description is required"})
     
@@ -183,30 +458,188 @@ def register_media():
         return jsonify({"status": "error", "message": "Media type is required"})
     
     result = multimedia_manager.register_media(media_type, media_id, metadata)
-    return jsonify(result)
+    return jsonify(result), 400 if result["status"] == "error" else 200
+
+@app.route('/api/media/register-bulk', methods=['POST'])
+def register_media_bulk():
+    """Register many media files in one call."""
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "A non-empty list of items is required"}), 400
+    
+    result = multimedia_manager.register_media_bulk(items)
+    return jsonify(result), 400 if result["status"] == "error" else 200
+
+def _media_response(result: dict):
+    """JSON response for an upload result, with an HTTP status matching its error."""
+    statuses = {"not_found": 404, "too_large": 413, "invalid": 400}
+    status = 200 if result["status"] == "success" else statuses.get(result.get("error"), 400)
+    return jsonify(result), status
+
+@app.route('/api/media/file/<media_type>/<media_id>', methods=['PUT'])
+def put_media_file(media_type, media_id):
+    """Store a media item's file from the raw request body, streamed to disk."""
+    result = multimedia_manager.store_media_file(
+        media_type, media_id, request.stream,
+        content_type=request.mimetype or None,
+        filename=request.args.get('filename')
+    )
+    return _media_response(result)
+
+@app.route('/api/media/file/<media_type>/<media_id>', methods=['GET'])
+def get_media_file(media_type, media_id):
+    """Serve a media item's file with Range (206), ETag and If-None-Match (304) support."""
+    found = multimedia_manager.get_media_file(media_type, media_id)
+    if found is None:
+        return jsonify({"status": "error", "message": "Media file not found"}), 404
+    
+    path, file_info = found
+    response = send_file(path, mimetype=file_info["content_type"], conditional=True,
+                         etag=file_info["sha256"], download_name=file_info.get("filename") or None)
+    # The id can be given new content, so revalidate with the ETag on every use
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/media/uploads', methods=['POST'])
+def create_media_upload():
+    """Start a resumable multipart upload; pass ``sha256`` to have the content checked on completion."""
+    data = request.json
+    result = multimedia_manager.create_upload(
+        data.get('type'), data.get('id'),
+        content_type=data.get('content_type'),
+        filename=data.get('filename'),
+        metadata=data.get('metadata', {}),
+        sha256=data.get('sha256')
+    )
+    return _media_response(result)
+
+@app.route('/api/media/uploads/<upload_id>', methods=['GET'])
+def get_media_upload(upload_id):
+    """Get the parts received so far, to resume an interrupted upload."""
+    return _media_response(multimedia_manager.get_upload(upload_id))
+
+@app.route('/api/media/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+def put_media_upload_part(upload_id, part_number):
+    """Upload one part (numbered from 1) as the raw request body."""
+    return _media_response(multimedia_manager.upload_part(upload_id, part_number, request.stream))
+
+@app.route('/api/media/uploads/<upload_id>/complete', methods=['POST'])
+def complete_media_upload(upload_id):
+    """Join the uploaded parts and attach the file to its media item."""
+    return _media_response(multimedia_manager.complete_upload(upload_id))
+
+@app.route('/api/media/uploads/<upload_id>', methods=['DELETE'])
+def abort_media_upload(upload_id):
+    """Discard an unfinished upload."""
+    return _media_response(multimedia_manager.abort_upload(upload_id))
+
+def _parse_limit(default, maximum=1000):
+    """Read the ``limit`` query parameter, clamped to ``maximum``."""
+    try:
+        limit = int(request.args.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+def _wants_ndjson() -> bool:
+    """Whether the client asked for a streamed NDJSON response."""
+    return (request.args.get('format') == 'ndjson' or
+            'application/x-ndjson' in request.headers.get('Accept', ''))
+
+def _search_response(keyed_results, limit):
+    """Return one page of keyed search results as JSON, or stream them as NDJSON.
+    
+    NDJSON responses write one result per line as they are produced. Without
+    an explicit ``limit`` they stream every result; with one, a final
+    ``{"next_cursor": ...}`` line is written when more results remain.
+    """
+    if _wants_ndjson():
+        def generate():
+            last_key = None
+            count = 0
+            for key, item in keyed_results:
+                if limit is not None and count == limit:
+                    yield json.dumps({"next_cursor": encode_cursor(last_key)}) + "\n"
+                    return
+                yield json.dumps(item) + "\n"
+                last_key = key
+                count += 1
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    results, next_cursor = paginate(keyed_results, limit)
+    return jsonify({
+        "status": "success",
+        "results": results,
+        "next_cursor": next_cursor
+    })
 
 @app.route('/api/media/search', methods=['GET'])
 def search_media():
-    """Search for media files."""
+    """Search for media files, one page at a time (``limit`` and ``after`` cursor)."""
     query = request.args.get('query', '')
     media_type = request.args.get('type')
+    tags = request.args.getlist('tag')
+    after = request.args.get('after')
     
-    results = multimedia_manager.search_media(query, media_type)
-    return jsonify({
-        "status": "success",
-        "results": results
-    })
+    if _wants_ndjson() and 'limit' not in request.args:
+        limit = None
+    else:
+        limit = _parse_limit(50)
+    
+    try:
+        results = multimedia_manager.iter_search_media(query, media_type, tags, after)
+        return _search_response(results, limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
 @app.route('/api/memory/search', methods=['GET'])
 def search_memory():
-    """Search conversation memory."""
+    """Search conversation memory, one page at a time (``limit`` and ``after`` cursor)."""
+    query = request.args.get('query', '')
+    order = request.args.get('order', 'relevance')
+    after = request.args.get('after')
+    
+    if _wants_ndjson() and 'limit' not in request.args:
+        limit = None
+    else:
+        limit = _parse_limit(10)
+    
+    try:
+        results = memory_manager.iter_search_conversations(query, order, after)
+        return _search_response(results, limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/api/memory/semantic-search', methods=['GET'])
+def semantic_search_memory():
+    """Find the saved messages most similar to ``query`` (``limit`` results, default 10)."""
     query = request.args.get('query', '')
-    limit = int(request.args.get('limit', 10))
+    if not query.strip():
+        return jsonify({"status": "error", "message": "Query is required"}), 400
     
-    results = memory_manager.search_conversations(query, limit)
+    results = memory_manager.semantic_search(query, _parse_limit(10))
+    return jsonify({"status": "success", "results": results, "index": memory_manager.semantic_index.stats()})
+
+@app.route('/api/inference/stats', methods=['GET'])
+def inference_stats():
+    """Get queue depth and batch-size/queue-wait histograms for batched inference."""
+    return jsonify({
+        "status": "success",
+        "batchers": [chat_batcher.stats(), training_manager.predictions.stats()]
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Get hit/miss/eviction counters for the in-memory caches."""
     return jsonify({
         "status": "success",
-        "results": results
+        "caches": memory_manager.cache_stats() + [workspace_manager.state_store.cache.stats(),
+                                                  training_manager.registry.stats(),
+                                                  response_cache.stats()],
+        "writer": memory_manager.writer_stats()
     })
 
 if __name__ == '__main__':
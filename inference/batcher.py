@@ -0,0 +1,165 @@
+import time
+import queue
+import bisect
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class QueueFull(Exception):
+    """Raised when a request arrives while the inference queue is at its depth limit."""
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``le`` is each bucket's inclusive upper bound."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict:
+        buckets = [{"le": bound, "count": count} for bound, count in zip(self.bounds, self.counts)]
+        buckets.append({"le": "inf", "count": self.counts[-1]})
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else 0.0,
+            "max": round(self.max, 4)
+        }
+
+
+class _Request:
+    __slots__ = ("item", "future", "enqueued")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """Groups concurrent inference requests into batches for one vectorised call.
+
+    ``submit`` queues an item and blocks until its result is ready. Worker
+    threads take the oldest request, wait up to ``max_wait`` seconds from
+    when it arrived for more, up to ``max_batch_size``, then call
+    ``batch_fn(items)``, which must return one result per item in order. An
+    exception raised by ``batch_fn`` fails every request in that batch; an
+    exception returned in an item's place fails only that request. At most
+    ``max_queue`` requests may wait; beyond that ``submit`` raises QueueFull
+    at once so callers can shed load instead of queueing without bound.
+    """
+
+    BATCH_SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128)
+    WAIT_MS_BOUNDS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16,
+                 max_wait: float = 0.005, max_queue: int = 256, workers: int = 1):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.max_queue = max(1, int(max_queue))
+        self.workers = max(1, int(workers))
+
+        self._queue: "queue.Queue[_Request]" = queue.Queue(maxsize=self.max_queue)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+        self.batch_sizes = Histogram(self.BATCH_SIZE_BOUNDS)
+        self.queue_wait_ms = Histogram(self.WAIT_MS_BOUNDS)
+        self.run_ms = Histogram(self.WAIT_MS_BOUNDS)
+        self.submitted = 0
+        self.rejected = 0
+        self.failed_batches = 0
+
+    def _start(self):
+        # Threads start on first use, so importing the app in a worker process starts none
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"{self.name}-batcher-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Run ``item`` in the next batch and return its result."""
+        if not self._threads:
+            self._start()
+
+        request = _Request(item)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull(f"{self.name} inference queue is full ({self.max_queue} waiting)")
+        with self._lock:
+            self.submitted += 1
+        return request.future.result(timeout)
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                results = self.batch_fn([request.item for request in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                with self._lock:
+                    self.failed_batches += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self.batch_sizes.observe(len(batch))
+                    self.run_ms.observe((finished - started) * 1000)
+                    for request in batch:
+                        self.queue_wait_ms.observe((started - request.enqueued) * 1000)
+
+            for request, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_queue": self.max_queue,
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "failed_batches": self.failed_batches,
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_wait_ms": self.queue_wait_ms.snapshot(),
+                "run_ms": self.run_ms.snapshot()
+            }
@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from storage.cache import BoundedCache
+from storage.file_utils import atomic_write_json
+from storage.write_behind import get_writer
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt."""
+    return WHITESPACE.sub(" ", str(text or "")).strip().lower()
+
+
+class ResponseCache:
+    """Caches chat responses by prompt, recent context and model version.
+
+    The key hashes the normalised message, the last ``history_window``
+    messages before it and the model version in use, so the same question in
+    the same context is answered once per model. Entries live in an LRU with
+    a TTL and, if ``cache_dir`` is set, in one JSON file each on disk, which
+    survives restarts and is shared by workers. ``invalidate`` drops the
+    memory tier and bumps a generation that disk entries must match; it is
+    called whenever a model is promoted.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 ttl: float = 3600, history_window: int = 4, max_disk_entries: int = 10000):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.history_window = history_window
+        self.max_disk_entries = max_disk_entries
+
+        self.memory = BoundedCache("responses", max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.writer = get_writer()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+        self.generation = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.generation = self._read_generation()
+
+    def _generation_path(self) -> str:
+        return os.path.join(self.cache_dir, "generation.json")
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self._generation_path(), 'r') as f:
+                return json.load(f)["generation"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def key(self, message: str, history: List[Dict], model_version: str) -> str:
+        """Hash of the normalised message, the recent history before it and the model version."""
+        context = history[-self.history_window:] if self.history_window > 0 else []
+        parts = [model_version or "", normalize(message)]
+        parts.extend(f"{item.get('role', '')}:{normalize(item.get('content', ''))}" for item in context)
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+            return response
+
+        if self.cache_dir:
+            # Another worker may have invalidated since we last looked
+            self.generation = max(self.generation, self._read_generation())
+            entry = self.writer.pending((self.cache_dir, key))
+            if entry is None:
+                try:
+                    with open(self._path(key), 'r') as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    entry = None
+            if entry and entry["generation"] == self.generation and time.time() - entry["stored"] <= self.ttl:
+                self.memory.set(key, entry["response"])
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry["response"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, response: str):
+        if not response:
+            return
+        self.memory.set(key, response)
+        with self._lock:
+            self.stores += 1
+
+        if self.cache_dir:
+            entry = {"response": response, "stored": time.time(), "generation": self.generation}
+            path = self._path(key)
+
+            def persist():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                atomic_write_json(path, entry)
+
+            self.writer.submit((self.cache_dir, key), persist, entry)
+            with self._lock:
+                self._disk_writes += 1
+                sweep = self._disk_writes % 500 == 0
+            if sweep:
+                self.writer.submit((self.cache_dir, "sweep"), self.sweep)
+
+    def invalidate(self, *args):
+        """Forget every cached response, e.g. because another model was promoted."""
+        self.memory.clear()
+        with self._lock:
+            self.invalidations += 1
+        if self.cache_dir:
+            self.generation = max(self.generation, self._read_generation()) + 1
+            atomic_write_json(self._generation_path(), {"generation": self.generation})
+
+    def sweep(self):
+        """Delete expired disk entries and the oldest beyond ``max_disk_entries``."""
+        entries = []
+        now = time.time()
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith('.json') or entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                    if now - mtime > self.ttl:
+                        os.remove(entry.path)
+                    else:
+                        entries.append((mtime, entry.path))
+                except FileNotFoundError:
+                    # Swept by another worker
+                    pass
+
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": "response_cache",
+                "entries": len(self.memory),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "generation": self.generation,
+                "ttl": self.ttl,
+                "disk": bool(self.cache_dir)
+            }
@@ -0,0 +1,239 @@
+import os
+import json
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from storage.file_utils import append_jsonl, atomic_write_text, file_lock, read_jsonl
+from storage.text import tokenize
+from storage.write_behind import get_writer
+
+MEDIA_TYPES = ["videos", "audio", "images", "documents"]
+
+
+class MediaIndex:
+    """Per-type token and tag indexes over media metadata with prefix lookup."""
+
+    def __init__(self):
+        # media type -> token -> media ids
+        self.tokens: Dict[str, Dict[str, Set[str]]] = {mtype: {} for mtype in MEDIA_TYPES}
+        # media type -> lowercase tag -> media ids
+        self.tags: Dict[str, Dict[str, Set[str]]] = {mtype: {} for mtype in MEDIA_TYPES}
+        # media type -> media id -> tokens it was indexed under, for removal
+        self._indexed: Dict[str, Dict[str, Tuple[Set[str], Set[str]]]] = {mtype: {} for mtype in MEDIA_TYPES}
+        # Sorted vocabulary per type, rebuilt lazily after new tokens appear
+        self._vocabulary: Dict[str, Optional[List[str]]] = {mtype: None for mtype in MEDIA_TYPES}
+
+    def add(self, media_type: str, media_id: str, metadata: Dict):
+        self.remove(media_type, media_id)
+
+        tags = {str(tag).lower() for tag in metadata.get("tags", [])}
+        tokens = set(tokenize(metadata.get("title", "")))
+        tokens.update(tokenize(metadata.get("description", "")))
+        for tag in tags:
+            tokens.update(tokenize(tag))
+
+        by_token = self.tokens[media_type]
+        for token in tokens:
+            if token not in by_token:
+                by_token[token] = set()
+                self._vocabulary[media_type] = None
+            by_token[token].add(media_id)
+        for tag in tags:
+            self.tags[media_type].setdefault(tag, set()).add(media_id)
+
+        self._indexed[media_type][media_id] = (tokens, tags)
+
+    def remove(self, media_type: str, media_id: str):
+        tokens, tags = self._indexed[media_type].pop(media_id, (set(), set()))
+        for index, keys in ((self.tokens[media_type], tokens), (self.tags[media_type], tags)):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(media_id)
+                    if not ids:
+                        del index[key]
+                        self._vocabulary[media_type] = None
+
+    def _prefix_matches(self, media_type: str, prefix: str) -> Set[str]:
+        vocabulary = self._vocabulary[media_type]
+        if vocabulary is None:
+            vocabulary = self._vocabulary[media_type] = sorted(self.tokens[media_type])
+
+        ids = set()
+        start = bisect.bisect_left(vocabulary, prefix)
+        for token in vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            ids.update(self.tokens[media_type][token])
+        return ids
+
+    def search(self, media_type: str, query: str, tags: Iterable[str] = None, prefix: bool = True) -> Set[str]:
+        """Return IDs whose text matches every query token and carry every tag.
+
+        With ``prefix`` each query token also matches longer words starting
+        with it, so partially typed queries still find results.
+        """
+        result = None
+
+        for tag in tags or []:
+            ids = self.tags[media_type].get(str(tag).lower(), set())
+            result = set(ids) if result is None else result & ids
+            if not result:
+                return set()
+
+        for token in dict.fromkeys(tokenize(query)):
+            if prefix:
+                ids = self._prefix_matches(media_type, token)
+            else:
+                ids = self.tokens[media_type].get(token, set())
+            result = set(ids) if result is None else result & ids
+            if not result:
+                return set()
+
+        # An empty query matches everything of this type
+        if result is None:
+            return set(self._indexed[media_type])
+        return result
+
+
+class MediaRegistry:
+    """Media metadata persisted as a snapshot plus an append-only change journal.
+
+    ``registry.json`` keeps its original format. Registrations are buffered and
+    appended to ``registry.journal`` by the write-behind writer, so a burst of
+    registrations costs one append. Once the journal is long enough it is folded
+    into a new snapshot. Journal records are idempotent upserts, and other
+    workers' registrations are picked up by replaying the journal tail.
+    """
+
+    def __init__(self, media_dir: str, compact_every: int = 5000):
+        self.snapshot_path = os.path.join(media_dir, "registry.json")
+        self.journal_path = os.path.join(media_dir, "registry.journal")
+        self.lock_path = os.path.join(media_dir, "registry.lock")
+        self.compact_every = compact_every
+
+        self.data: Dict[str, Dict[str, Dict]] = {mtype: {} for mtype in MEDIA_TYPES}
+        self.index = MediaIndex()
+        self.lock = threading.RLock()
+        self.writer = get_writer()
+
+        self._buffer: List[Dict] = []
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._snapshot_stamp = None
+
+        self._load()
+
+    def _snapshot_signature(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+            return (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """Load the snapshot, replay the journal and rebuild the indexes."""
+        self.data = {mtype: {} for mtype in MEDIA_TYPES}
+        self.index = MediaIndex()
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._snapshot_stamp = self._snapshot_signature()
+
+        if self._snapshot_stamp:
+            try:
+                with open(self.snapshot_path, 'r') as f:
+                    snapshot = json.load(f)
+                for mtype in MEDIA_TYPES:
+                    self.data[mtype] = snapshot.get(mtype, {})
+            except Exception as e:
+                print(f"Error loading media registry: {e}")
+
+        for mtype, items in self.data.items():
+            for media_id, metadata in items.items():
+                self.index.add(mtype, media_id, metadata)
+
+        self._catch_up()
+        self._apply_buffer()
+
+    def _apply_buffer(self):
+        # Registrations still waiting for the writer are not on disk yet, and
+        # are newer than anything read from it
+        for record in self._buffer:
+            self._apply(record["type"], record["id"], record["metadata"])
+
+    def _catch_up(self):
+        """Apply journal records appended since we last looked, by any process."""
+        if self._snapshot_signature() != self._snapshot_stamp:
+            # Another worker compacted the registry
+            self._load()
+            return
+
+        records, self._journal_offset = read_jsonl(self.journal_path, self._journal_offset)
+        for record in records:
+            self._apply(record["type"], record["id"], record["metadata"])
+        self._journal_records += len(records)
+        if records:
+            self._apply_buffer()
+
+    def refresh(self):
+        """Pick up registrations made by other workers."""
+        with self.lock:
+            self._catch_up()
+
+    def _apply(self, media_type: str, media_id: str, metadata: Dict):
+        self.data[media_type][media_id] = metadata
+        self.index.add(media_type, media_id, metadata)
+
+    def register_many(self, items: List[Tuple[str, str, Dict]]):
+        """Add or replace items and queue a single journal append for all of them."""
+        with self.lock:
+            for media_type, media_id, metadata in items:
+                self._apply(media_type, media_id, metadata)
+                self._buffer.append({"type": media_type, "id": media_id, "metadata": metadata})
+
+        self.writer.submit(self.journal_path, self._persist)
+
+    def _persist(self):
+        """Append buffered records, or fold everything into a new snapshot."""
+        with self.lock:
+            # Records stay buffered until they are on disk (writer thread only)
+            records = list(self._buffer)
+            if not records:
+                return
+
+        with file_lock(self.lock_path):
+            with self.lock:
+                self._catch_up()
+            append_jsonl(self.journal_path, records, sync=True)
+            with self.lock:
+                # Already applied; replaying our own append could undo newer registrations
+                self._journal_offset = os.path.getsize(self.journal_path)
+                self._journal_records += len(records)
+                del self._buffer[:len(records)]
+
+            if self._journal_records >= self.compact_every:
+                self._compact_locked()
+
+    def _compact_locked(self):
+        """Write a new snapshot and drop the journal (file lock held)."""
+        with self.lock:
+            self._catch_up()
+            payload = json.dumps(self.data, indent=2)
+
+        atomic_write_text(self.snapshot_path, payload)
+        # Replaying the journal over the new snapshot is harmless, so a crash
+        # before this removal loses nothing
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+        with self.lock:
+            self._snapshot_stamp = self._snapshot_signature()
+            self._journal_offset = 0
+            self._journal_records = 0
+
+    def compact(self):
+        """Force the journal to be folded into the snapshot."""
+        self.writer.flush()
+        with file_lock(self.lock_path):
+            self._compact_locked()
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from storage.file_utils import atomic_write_json
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+PART_FILE_PATTERN = re.compile(r"^(\d+)\.part$")
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a request body exceeds the configured size limit."""
+
+
+class MediaStore:
+    """Content-addressed media files plus resumable multipart uploads.
+
+    Files are stored once per content as ``blobs/<sha[:2]>/<sha256>``, so
+    uploading the same bytes again (under any type or id) keeps a single
+    copy. Request bodies are streamed to disk ``chunk_size`` bytes at a time
+    and hashed on the way, never held in memory.
+
+    A multipart upload lives in ``uploads/<upload_id>/`` until completed:
+    each numbered part is written to a temp file and renamed into place, so
+    a part interrupted mid-transfer is simply missing and can be sent again.
+    Completing concatenates the parts in order into a blob. An upload may
+    have at most ``max_parts`` parts and ``max_upload_size`` bytes in
+    total. Uploads left untouched for ``upload_ttl`` seconds are removed,
+    checked at most every ``expire_interval`` seconds as uploads are created.
+    """
+
+    def __init__(self, media_dir: str, chunk_size: int = 1024 * 1024,
+                 max_part_size: int = None, upload_ttl: float = 24 * 3600,
+                 max_upload_size: int = None, max_parts: int = None, expire_interval: float = 600):
+        self.blobs_dir = os.path.join(media_dir, "blobs")
+        self.uploads_dir = os.path.join(media_dir, "uploads")
+        self.chunk_size = chunk_size
+        self.max_part_size = (int(os.environ.get("MEDIA_MAX_PART_BYTES", 256 * 1024 * 1024))
+                              if max_part_size is None else max_part_size)
+        self.max_upload_size = (int(os.environ.get("MEDIA_MAX_UPLOAD_BYTES", 4 * 1024 * 1024 * 1024))
+                                if max_upload_size is None else max_upload_size)
+        self.max_parts = int(os.environ.get("MEDIA_MAX_PARTS", 10000)) if max_parts is None else max_parts
+        self.upload_ttl = upload_ttl
+        self.expire_interval = expire_interval
+        self._expired_at = 0.0
+
+        for directory in (self.blobs_dir, self.uploads_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self.expire_uploads()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def has_blob(self, sha256: str) -> bool:
+        return bool(SHA256_PATTERN.match(sha256 or "")) and os.path.exists(self.blob_path(sha256))
+
+    def _copy(self, source: BinaryIO, target: BinaryIO, digest=None, limit: int = None) -> int:
+        """Copy a stream in chunks, updating ``digest``; returns the bytes copied."""
+        size = 0
+        while True:
+            chunk = source.read(self.chunk_size)
+            if not chunk:
+                return size
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise UploadTooLarge(f"Upload exceeds {limit} bytes")
+            if digest is not None:
+                digest.update(chunk)
+            target.write(chunk)
+
+    def _commit(self, tmp_path: str, sha256: str) -> bool:
+        """Move a finished temp file into the blob store; True if the content was already there."""
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        # Two writers racing on the same content both produce identical bytes
+        os.replace(tmp_path, path)
+        return False
+
+    def _write_blob(self, copy, expected_sha256: str = None) -> Tuple[str, int, bool]:
+        """Run ``copy(file, digest)`` into a temp file and commit it as a blob.
+
+        Raises ValueError, storing nothing, if the content does not hash to
+        ``expected_sha256``.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.uploads_dir, prefix=".tmp-")
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                size = copy(f, digest)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            if expected_sha256 and sha256 != expected_sha256:
+                raise ValueError(f"Content hash {sha256} does not match the declared {expected_sha256}")
+            return sha256, size, self._commit(tmp_path, sha256)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_stream(self, stream: BinaryIO) -> Tuple[str, int, bool]:
+        """Store a whole file from a stream; returns ``(sha256, size, deduplicated)``."""
+        return self._write_blob(lambda f, digest: self._copy(stream, f, digest, self.max_part_size))
+
+    def _upload_dir(self, upload_id: str) -> Optional[str]:
+        if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+            return None
+        directory = os.path.join(self.uploads_dir, upload_id)
+        return directory if os.path.isdir(directory) else None
+
+    def create_upload(self, info: Dict) -> str:
+        """Start a multipart upload; ``info`` is kept with it until it completes."""
+        if time.monotonic() - self._expired_at >= self.expire_interval:
+            self.expire_uploads()
+
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.uploads_dir, upload_id)
+        os.makedirs(os.path.join(directory, "parts"))
+        atomic_write_json(os.path.join(directory, "upload.json"), dict(info, created=time.time()))
+        return upload_id
+
+    def get_upload(self, upload_id: str) -> Optional[Dict]:
+        """An upload's info and the parts received so far, or None if unknown."""
+        directory = self._upload_dir(upload_id)
+        if directory is None:
+            return None
+        try:
+            with open(os.path.join(directory, "upload.json"), 'r') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        info["id"] = upload_id
+        info["parts"] = self._parts(directory)
+        return info
+
+    def _parts(self, directory: str) -> List[Dict]:
+        parts = []
+        for entry in os.scandir(os.path.join(directory, "parts")):
+            match = PART_FILE_PATTERN.match(entry.name)
+            if match:
+                parts.append({"part": int(match.group(1)), "size": entry.stat().st_size})
+        return sorted(parts, key=lambda part: part["part"])
+
+    def put_part(self, upload_id: str, part_number: int, stream: BinaryIO) -> Optional[int]:
+        """Store (or replace) one part of an upload; returns its size, or None if the upload is unknown.
+
+        Raises UploadTooLarge if the part is too large, would take the
+        upload past ``max_upload_size`` or is numbered above ``max_parts``.
+        """
+        if part_number < 1:
+            raise ValueError("Part numbers start at 1")
+        if part_number > self.max_parts:
+            raise UploadTooLarge(f"Uploads have at most {self.max_parts} parts")
+        directory = self._upload_dir(upload_id)
+        if directory is None:
+            return None
+        # Parts sent concurrently can each pass this check; complete_upload checks the total again
+        remaining = self.max_upload_size - sum(part["size"] for part in self._parts(directory)
+                                               if part["part"] != part_number)
+        parts_dir = os.path.join(directory, "parts")
+        fd, tmp_path = tempfile.mkstemp(dir=parts_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                try:
+                    size = self._copy(stream, f, limit=min(self.max_part_size, remaining))
+                except UploadTooLarge:
+                    if remaining < self.max_part_size:
+                        raise UploadTooLarge(f"Upload exceeds {self.max_upload_size} bytes in total")
+                    raise
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(parts_dir, f"{part_number:06d}.part"))
+            return size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def complete_upload(self, upload_id: str) -> Optional[Tuple[Dict, str, int, bool]]:
+        """Join an upload's parts into a blob.
+
+        Returns ``(info, sha256, size, deduplicated)``, or None if the upload
+        is unknown. Raises ValueError if no parts were received, part
+        numbers are not contiguous from 1 or the content does not match the
+        declared hash, and UploadTooLarge if the parts exceed
+        ``max_upload_size``; the upload is kept so bad parts can be sent again.
+        """
+        info = self.get_upload(upload_id)
+        if info is None:
+            return None
+        numbers = [part["part"] for part in info["parts"]]
+        if not numbers:
+            raise ValueError("No parts were uploaded")
+        if numbers != list(range(1, len(numbers) + 1)):
+            missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+            raise ValueError(f"Missing parts: {missing}")
+        if sum(part["size"] for part in info["parts"]) > self.max_upload_size:
+            raise UploadTooLarge(f"Upload exceeds {self.max_upload_size} bytes in total")
+
+        parts_dir = os.path.join(self.uploads_dir, upload_id, "parts")
+
+        def join(f, digest):
+            size = 0
+            for number in numbers:
+                with open(os.path.join(parts_dir, f"{number:06d}.part"), 'rb') as part:
+                    size += self._copy(part, f, digest)
+            return size
+
+        sha256, size, deduplicated = self._write_blob(join, info.get("sha256"))
+        self.abort_upload(upload_id)
+        return info, sha256, size, deduplicated
+
+    def abort_upload(self, upload_id: str) -> bool:
+        directory = self._upload_dir(upload_id)
+        if directory is None:
+            return False
+        shutil.rmtree(directory, ignore_errors=True)
+        return True
+
+    def expire_uploads(self):
+        """Remove multipart uploads with no activity for ``upload_ttl`` seconds."""
+        self._expired_at = time.monotonic()
+        cutoff = time.time() - self.upload_ttl
+        for entry in os.scandir(self.uploads_dir):
+            try:
+                if entry.name.startswith(".tmp-"):
+                    # Left behind by a crash mid-write
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                    continue
+                if not entry.is_dir() or not UPLOAD_ID_PATTERN.match(entry.name):
+                    continue
+                try:
+                    last_active = max(os.stat(os.path.join(entry.path, "parts")).st_mtime, entry.stat().st_mtime)
+                except FileNotFoundError:
+                    last_active = entry.stat().st_mtime
+                if last_active < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                # Completed, aborted or expired by another worker meanwhile
+                continue
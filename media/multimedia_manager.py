@@ -1,12 +1,18 @@
 import os
-import json
-from typing import Dict, List, Optional, Any
+import mimetypes
+from itertools import islice
+from typing import BinaryIO, Dict, Iterator, List, Optional, Any, Tuple
+
+from media.media_registry import MEDIA_TYPES, MediaRegistry
+from media.media_store import SHA256_PATTERN, MediaStore, UploadTooLarge
+from storage.pagination import decode_cursor
 
 class MultimediaManager:
     """Manages multimedia content display and playback."""
     
-    def __init__(self, media_dir: str = "media"):
+    def __init__(self, media_dir: str = "media", file_url: str = "/api/media/file"):
         self.media_dir = media_dir
+        self.file_url = file_url
         self.videos_dir = os.path.join(media_dir, "videos")
         self.audio_dir = os.path.join(media_dir, "audio")
         self.images_dir = os.path.join(media_dir, "images")
@@ -17,50 +23,85 @@ class MultimediaManager:
                          self.audio_dir, self.images_dir, self.documents_dir]:
             os.makedirs(directory, exist_ok=True)
         
-        # Media registry
-        self.media_registry = self._load_registry()
-    
-    def _load_registry(self) -> Dict:
-        """Load media registry from file."""
-        registry_path = os.path.join(self.media_dir, "registry.json")
-        if os.path.exists(registry_path):
-            try:
-                with open(registry_path, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading media registry: {e}")
+        # Indexed media registry, persisted as snapshot plus change journal
+        self.registry = MediaRegistry(media_dir)
         
-        # Initialize empty registry if not found
-        return {
-            "videos": {},
-            "audio": {},
-            "images": {},
-            "documents": {}
-        }
+        # Uploaded file contents, stored once per distinct content
+        self.store = MediaStore(media_dir)
     
-    def _save_registry(self):
-        """Save media registry to file."""
-        registry_path = os.path.join(self.media_dir, "registry.json")
-        try:
-            with open(registry_path, 'w') as f:
-                json.dump(self.media_registry, f, indent=2)
-        except Exception as e:
-            print(f"Error saving media registry: {e}")
+    @property
+    def media_registry(self) -> Dict:
+        """Registered media metadata by type and ID."""
+        return self.registry.data
+    
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until queued registry writes have reached disk."""
+        return self.registry.writer.flush(timeout)
+    
+    def _metadata_error(self, metadata: Any) -> Optional[str]:
+        """Why ``metadata`` cannot be registered, or None if it can."""
+        if not isinstance(metadata, dict):
+            return "Metadata must be an object"
+        for field in ("title", "description"):
+            if metadata.get(field) is not None and not isinstance(metadata[field], str):
+                return f"Metadata {field} must be a string"
+        tags = metadata.get("tags", [])
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            return "Metadata tags must be a list of strings"
+        return None
     
     def register_media(self, media_type: str, media_id: str, metadata: Dict):
         """Register a media file in the registry."""
-        if media_type not in ["videos", "audio", "images", "documents"]:
+        if media_type not in MEDIA_TYPES:
             return {"status": "error", "message": f"Invalid media type: {media_type}"}
+        error = self._metadata_error(metadata)
+        if error:
+            return {"status": "error", "message": error}
         
         # Add to registry
-        self.media_registry[media_type][media_id] = metadata
-        self._save_registry()
+        self.registry.register_many([(media_type, media_id, metadata)])
         
         return {"status": "success", "message": f"{media_type.capitalize()} registered successfully"}
     
+    def register_media_bulk(self, items: List[Dict]) -> Dict:
+        """Register many media files with a single persistence step.
+        
+        Each item is a dict with ``type``, ``id`` and ``metadata``. Invalid
+        items are skipped and reported; the rest are registered together.
+        If no item is valid the status is ``"error"``.
+        """
+        valid = []
+        errors = []
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({"index": position, "message": "Item must be an object"})
+                continue
+            media_type = item.get("type")
+            media_id = item.get("id")
+            metadata = item.get("metadata", {})
+            metadata_error = self._metadata_error(metadata)
+            if not isinstance(media_type, str) or media_type not in MEDIA_TYPES:
+                errors.append({"index": position, "message": f"Invalid media type: {media_type}"})
+            elif not media_id or not isinstance(media_id, str):
+                errors.append({"index": position, "message": "Media ID is required"})
+            elif metadata_error:
+                errors.append({"index": position, "message": metadata_error})
+            else:
+                valid.append((media_type, media_id, metadata))
+        
+        if valid:
+            self.registry.register_many(valid)
+        
+        return {
+            "status": "success" if not errors else "partial" if valid else "error",
+            "message": f"{len(valid)} media items registered",
+            "registered": len(valid),
+            "errors": errors
+        }
+    
     def get_media_info(self, media_type: str, media_id: str) -> Optional[Dict]:
         """Get information about a media file."""
-        if media_type not in ["videos", "audio", "images", "documents"]:
+        if media_type not in MEDIA_TYPES:
             return None
         
         return self.media_registry[media_type].get(media_id)
@@ -73,36 +114,178 @@ class MultimediaManager:
         
         return media_info.get("url")
     
-    def search_media(self, query: str, media_type: Optional[str] = None) -> List[Dict]:
-        """Search for media files by query."""
-        results = []
+    def _attach_file(self, media_type: str, media_id: str, metadata: Optional[Dict], sha256: str, size: int,
+                     content_type: Optional[str], filename: Optional[str]) -> Dict:
+        """Register a stored file as the content of a media item, keeping its other metadata."""
+        existing = self.get_media_info(media_type, media_id) or {}
+        content_type = content_type or mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+        
+        record = dict(existing, **(metadata or {}))
+        record["url"] = f"{self.file_url}/{media_type}/{media_id}"
+        record["file"] = {"sha256": sha256, "size": size, "content_type": content_type, "filename": filename}
+        self.registry.register_many([(media_type, media_id, record)])
+        return record
+    
+    def store_media_file(self, media_type: str, media_id: str, stream: BinaryIO, content_type: str = None,
+                         filename: str = None, metadata: Dict = None) -> Dict:
+        """Store a whole file streamed from ``stream`` as a media item's content."""
+        if media_type not in MEDIA_TYPES:
+            return {"status": "error", "error": "invalid", "message": f"Invalid media type: {media_type}"}
+        
+        try:
+            sha256, size, deduplicated = self.store.put_stream(stream)
+        except UploadTooLarge as e:
+            return {"status": "error", "error": "too_large", "message": str(e)}
+        
+        record = self._attach_file(media_type, media_id, metadata, sha256, size, content_type, filename)
+        return {"status": "success", "message": "File stored", "deduplicated": deduplicated,
+                "url": record["url"], "file": record["file"]}
+    
+    def create_upload(self, media_type: str, media_id: str, content_type: str = None, filename: str = None,
+                      metadata: Dict = None, sha256: str = None) -> Dict:
+        """Start a resumable multipart upload for a media item.
+        
+        If ``sha256`` is given, completing the upload fails unless the
+        received content has that hash. Content already stored is still
+        kept once, but only after it has been received in full: a hash
+        alone never attaches a file.
+        """
+        if media_type not in MEDIA_TYPES:
+            return {"status": "error", "error": "invalid", "message": f"Invalid media type: {media_type}"}
+        if not media_id:
+            return {"status": "error", "error": "invalid", "message": "Media ID is required"}
+        
+        sha256 = sha256.lower() if sha256 else None
+        if sha256 and not SHA256_PATTERN.match(sha256):
+            return {"status": "error", "error": "invalid", "message": "sha256 must be 64 hex digits"}
+        error = self._metadata_error(metadata or {})
+        if error:
+            return {"status": "error", "error": "invalid", "message": error}
         
+        upload_id = self.store.create_upload({
+            "type": media_type,
+            "media_id": media_id,
+            "content_type": content_type,
+            "filename": filename,
+            "metadata": metadata or {},
+            "sha256": sha256
+        })
+        # "complete" stays in the response for clients of the old hash-only shortcut
+        return {"status": "success", "complete": False, "upload_id": upload_id,
+                "max_part_size": self.store.max_part_size, "max_parts": self.store.max_parts,
+                "max_upload_size": self.store.max_upload_size}
+    
+    def upload_part(self, upload_id: str, part_number: int, stream: BinaryIO) -> Dict:
+        """Store one numbered part (from 1) of an upload; resending a part replaces it."""
+        if part_number < 1:
+            return {"status": "error", "error": "invalid", "message": "Part numbers start at 1"}
+        
+        try:
+            size = self.store.put_part(upload_id, part_number, stream)
+        except UploadTooLarge as e:
+            return {"status": "error", "error": "too_large", "message": str(e)}
+        if size is None:
+            return {"status": "error", "error": "not_found", "message": f"Upload not found: {upload_id}"}
+        
+        return {"status": "success", "part": part_number, "size": size}
+    
+    def get_upload(self, upload_id: str) -> Dict:
+        """An upload's progress, so an interrupted client knows which parts to resend."""
+        info = self.store.get_upload(upload_id)
+        if info is None:
+            return {"status": "error", "error": "not_found", "message": f"Upload not found: {upload_id}"}
+        
+        return {
+            "status": "success",
+            "upload_id": upload_id,
+            "type": info["type"],
+            "media_id": info["media_id"],
+            "parts": info["parts"],
+            "received": sum(part["size"] for part in info["parts"])
+        }
+    
+    def complete_upload(self, upload_id: str) -> Dict:
+        """Join an upload's parts and attach the file to its media item."""
+        try:
+            completed = self.store.complete_upload(upload_id)
+        except UploadTooLarge as e:
+            return {"status": "error", "error": "too_large", "message": str(e)}
+        except ValueError as e:
+            return {"status": "error", "error": "invalid", "message": str(e)}
+        if completed is None:
+            return {"status": "error", "error": "not_found", "message": f"Upload not found: {upload_id}"}
+        
+        info, sha256, size, deduplicated = completed
+        record = self._attach_file(info["type"], info["media_id"], info.get("metadata"), sha256, size,
+                                   info.get("content_type"), info.get("filename"))
+        return {"status": "success", "message": "Upload complete", "deduplicated": deduplicated,
+                "url": record["url"], "file": record["file"]}
+    
+    def abort_upload(self, upload_id: str) -> Dict:
+        if not self.store.abort_upload(upload_id):
+            return {"status": "error", "error": "not_found", "message": f"Upload not found: {upload_id}"}
+        return {"status": "success", "message": "Upload aborted"}
+    
+    def get_media_file(self, media_type: str, media_id: str) -> Optional[Tuple[str, Dict]]:
+        """The stored file of a media item as ``(path, file info)``, or None if it has none."""
+        media_info = self.get_media_info(media_type, media_id)
+        file_info = (media_info or {}).get("file")
+        if not file_info:
+            return None
+        
+        # Absolute, as web frameworks resolve relative paths against the app root
+        path = os.path.abspath(self.store.blob_path(file_info["sha256"]))
+        if not os.path.exists(path):
+            return None
+        return path, file_info
+    
+    def iter_search_media(self, query: str, media_type: Optional[str] = None, tags: List[str] = None,
+                          after: str = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(sort_key, result)`` pairs for matching media, ordered by type and ID.
+        
+        Every word of the query must prefix-match a word of the title,
+        description or tags; ``tags`` further restricts results to items
+        carrying all of the given tags. ``after`` is a cursor from a previous
+        page (see storage.pagination) and raises ValueError if malformed.
+        """
+        # Decoded before the generator starts, so a bad cursor fails the call itself
+        return self._iter_search_media(query, media_type, tags, decode_cursor(after, (str, str)))
+    
+    def _iter_search_media(self, query: str, media_type: Optional[str], tags: Optional[List[str]],
+                           after_key: Optional[Tuple]) -> Iterator[Tuple[Tuple, Dict]]:
         # Determine which media types to search
-        media_types = [media_type] if media_type else ["videos", "audio", "images", "documents"]
+        media_types = [media_type] if media_type else MEDIA_TYPES
         
-        for mtype in media_types:
+        for mtype in sorted(media_types):
             if mtype not in self.media_registry:
                 continue
-                
-            for media_id, metadata in self.media_registry[mtype].items():
-                # Search in title, description, and tags
-                title = metadata.get("title", "").lower()
-                description = metadata.get("description", "").lower()
-                tags = metadata.get("tags", [])
-                
-                if (query.lower() in title or 
-                    query.lower() in description or 
-                    query.lower() in " ".join(tags).lower()):
-                    
-                    results.append({
-                        "id": media_id,
-                        "type": mtype,
-                        "title": metadata.get("title", "Untitled"),
-                        "thumbnail": metadata.get("thumbnail"),
-                        "duration": metadata.get("duration")
-                    })
-        
-        return results
+            if after_key and mtype < after_key[0]:
+                continue
+            
+            with self.registry.lock:
+                self.registry.refresh()
+                matches = self.registry.index.search(mtype, query, tags)
+            
+            if after_key and mtype == after_key[0]:
+                matches = [media_id for media_id in matches if media_id > after_key[1]]
+            
+            for media_id in sorted(matches):
+                metadata = self.media_registry[mtype].get(media_id)
+                if metadata is None:
+                    continue
+                yield (mtype, media_id), {
+                    "id": media_id,
+                    "type": mtype,
+                    "title": metadata.get("title", "Untitled"),
+                    "thumbnail": metadata.get("thumbnail"),
+                    "duration": metadata.get("duration")
+                }
+    
+    def search_media(self, query: str, media_type: Optional[str] = None, tags: List[str] = None,
+                     limit: Optional[int] = None) -> List[Dict]:
+        """Search for media files by query."""
+        results = self.iter_search_media(query, media_type, tags)
+        return [result for _, result in islice(results, limit)]
     
     def get_media_player_config(self, media_type: str, media_id: str) -> Dict:
         """Get configuration for media player."""
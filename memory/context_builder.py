@@ -0,0 +1,193 @@
+import os
+import re
+import math
+import threading
+from collections import deque
+from typing import Dict, List, Tuple
+
+from memory.conversation_log import message_digest
+from storage.cache import BoundedCache
+from storage.file_utils import append_jsonl, read_jsonl
+from storage.text import tokenize
+
+# Words and individual punctuation marks; close enough to model tokens for budgeting
+TOKEN_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+# Tokens added per message for its role and separators
+MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text: str) -> int:
+    """Estimate how many model tokens a text takes."""
+    return len(TOKEN_ESTIMATE_PATTERN.findall(text)) if text else 0
+
+
+class ConversationContext:
+    """Token counts and a small message index for one conversation.
+
+    Mirrors the conversation's context journal: one record per message with
+    its token count, the running total and its distinct terms. Postings keep
+    only the ``max_postings`` most recent messages per term, so recalling
+    older messages costs the same however long the conversation is.
+    """
+
+    def __init__(self, max_postings: int = 256):
+        self.max_postings = max_postings
+        self.tokens: List[int] = []
+        self.total = 0
+        self.tail = None
+        self.postings: Dict[str, deque] = {}
+        self.doc_freq: Dict[str, int] = {}
+        self.journal_size = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def apply(self, record: Dict):
+        seq = record["seq"]
+        if seq != len(self.tokens):
+            # Already applied (another worker journaled it too) or out of order
+            return
+        self.tokens.append(record["tokens"])
+        self.total = record["total"]
+        self.tail = record["digest"]
+        for term in record["terms"]:
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = deque(maxlen=self.max_postings)
+            postings.append(seq)
+            self.doc_freq[term] = self.doc_freq.get(term, 0) + 1
+        self.size += 64 + 48 * len(record["terms"])
+
+
+class ContextBuilder:
+    """Chooses which messages of a conversation to send to the model.
+
+    The most recent messages are taken newest first until ``budget`` tokens
+    minus a ``recall_share`` reserved for older messages that share terms
+    with the new one. Token counts and terms are computed once per message
+    when it first reaches the builder and appended to
+    ``<context_dir>/<conversation_id>.jsonl``, so each turn only touches the
+    new messages, the recent window and a bounded number of postings.
+    """
+
+    def __init__(self, context_dir: str, budget: int = 2048, recall_share: float = 0.25,
+                 recall_limit: int = 4, max_query_terms: int = 32):
+        self.context_dir = context_dir
+        self.budget = budget
+        self.recall_share = recall_share
+        self.recall_limit = recall_limit
+        self.max_query_terms = max_query_terms
+
+        self.contexts = BoundedCache("context", max_entries=512, max_bytes=64 * 1024 * 1024,
+                                     sizeof=lambda context: context.size)
+        self._lock = threading.Lock()
+        os.makedirs(context_dir, exist_ok=True)
+
+    def _journal_path(self, conversation_id: str) -> str:
+        return os.path.join(self.context_dir, f"{conversation_id}.jsonl")
+
+    def _load(self, conversation_id: str) -> ConversationContext:
+        """The conversation's context, caught up with records other workers appended."""
+        path = self._journal_path(conversation_id)
+        context = self.contexts.get(conversation_id)
+        if context is None:
+            context = ConversationContext()
+            self.contexts.set(conversation_id, context)
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size != context.journal_size:
+            if size < context.journal_size:
+                # The journal was rewritten; start over
+                context = ConversationContext()
+                self.contexts.set(conversation_id, context)
+            records, context.journal_size = read_jsonl(path, context.journal_size)
+            for record in records:
+                context.apply(record)
+            # Re-store so the cache accounts for the grown index
+            self.contexts.set(conversation_id, context)
+        return context
+
+    def _index(self, conversation_id: str, context: ConversationContext, messages: List[Dict]):
+        """Journal the messages the context has not seen yet."""
+        count = len(context)
+        if count > len(messages) or (count and message_digest(messages[count - 1]) != context.tail):
+            # History was rewritten; reindex from scratch
+            path = self._journal_path(conversation_id)
+            if os.path.exists(path):
+                os.remove(path)
+            context = ConversationContext()
+            self.contexts.set(conversation_id, context)
+            count = 0
+
+        records = []
+        total = context.total
+        for seq, message in enumerate(messages[count:], count):
+            tokens = count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD
+            total += tokens
+            records.append({
+                "seq": seq,
+                "tokens": tokens,
+                "total": total,
+                "digest": message_digest(message),
+                "terms": sorted(set(tokenize(message.get("content", ""))))
+            })
+        if records:
+            append_jsonl(self._journal_path(conversation_id), records)
+            for record in records:
+                context.apply(record)
+            context.journal_size = os.path.getsize(self._journal_path(conversation_id))
+            self.contexts.set(conversation_id, context)
+        return context
+
+    def build(self, conversation_id: str, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """Pick the messages to send for the latest turn; returns them and token accounting."""
+        if not messages:
+            return [], {"tokens": 0, "total_tokens": 0, "recent": 0, "recalled": 0}
+
+        with self._lock:
+            context = self._index(conversation_id, self._load(conversation_id), messages)
+
+            # Newest messages first, always including the latest one
+            recent_budget = int(self.budget * (1 - self.recall_share))
+            start = len(messages) - 1
+            used = context.tokens[start]
+            while start > 0 and used + context.tokens[start - 1] <= recent_budget:
+                start -= 1
+                used += context.tokens[start]
+
+            recalled = self._recall(context, messages[-1].get("content", ""), start, self.budget - used)
+
+        used += sum(context.tokens[seq] for seq in recalled)
+        selected = [messages[seq] for seq in recalled] + messages[start:]
+        return selected, {
+            "tokens": used,
+            "total_tokens": context.total,
+            "recent": len(messages) - start,
+            "recalled": len(recalled)
+        }
+
+    def _recall(self, context: ConversationContext, query: str, before: int, budget: int) -> List[int]:
+        """Older messages sharing the rarest terms with ``query``, in conversation order."""
+        if before == 0 or budget <= 0 or self.recall_limit <= 0:
+            return []
+
+        scores: Dict[int, float] = {}
+        n = len(context)
+        for term in list(dict.fromkeys(tokenize(query)))[:self.max_query_terms]:
+            postings = context.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + n / context.doc_freq[term])
+            for seq in postings:
+                if seq < before:
+                    scores[seq] = scores.get(seq, 0.0) + idf
+
+        chosen = []
+        for seq in sorted(scores, key=lambda seq: (-scores[seq], -seq)):
+            if context.tokens[seq] <= budget:
+                chosen.append(seq)
+                budget -= context.tokens[seq]
+                if len(chosen) >= self.recall_limit:
+                    break
+        return sorted(chosen)
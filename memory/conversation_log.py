@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from storage.file_utils import append_jsonl, atomic_write_json, file_lock, file_stamp, read_jsonl
+
+
+def message_digest(message: Dict) -> str:
+    """Fingerprint a message so rewritten history can be told from appended history."""
+    content = f"{message.get('role', '')}:{message.get('content', '')}"
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class ConversationLog:
+    """Stores conversations as a JSON snapshot plus an append-only turn log.
+
+    ``{id}.json`` keeps the original format and holds the compacted history.
+    ``{id}.log`` holds one JSONL record per save with only the messages added
+    since the previous save, so a turn costs an append instead of a rewrite.
+    Records carry the index of their first message, which makes replay
+    idempotent when a crash lands between compaction and log removal.
+    Writes hold ``{id}.lock`` so workers sharing the directory never append
+    the same message index twice or drop a log another worker appended to.
+    """
+
+    def __init__(self, conversations_dir: str, compact_every: int = 50):
+        self.conversations_dir = conversations_dir
+        self.compact_every = compact_every
+
+        # conversation id -> persisted message count, tail digest, log records, file stamp
+        self._state: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+
+    def snapshot_path(self, conversation_id: str) -> str:
+        return os.path.join(self.conversations_dir, f"{conversation_id}.json")
+
+    def log_path(self, conversation_id: str) -> str:
+        return os.path.join(self.conversations_dir, f"{conversation_id}.log")
+
+    def lock_path(self, conversation_id: str) -> str:
+        return os.path.join(self.conversations_dir, f"{conversation_id}.lock")
+
+    def read(self, conversation_id: str) -> Optional[Dict]:
+        """Rebuild a conversation from its snapshot and log."""
+        conversation, consistent = self._read(conversation_id)
+        if not consistent:
+            # Another worker wrote while we were reading; read again under its lock
+            with self._lock, file_lock(self.lock_path(conversation_id)):
+                conversation, _ = self._read(conversation_id)
+        return conversation
+
+    def _read(self, conversation_id: str):
+        """The conversation and whether its files stayed unchanged while being read."""
+        snapshot_path = self.snapshot_path(conversation_id)
+        log_path = self.log_path(conversation_id)
+        # Taken first, so a change made while reading shows up as a stale stamp
+        stamp = self.stamp(conversation_id)
+        if not os.path.exists(snapshot_path) and not os.path.exists(log_path):
+            return None, True
+
+        conversation = {"id": conversation_id, "messages": [], "metadata": {}}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                conversation = json.load(f)
+
+        messages = conversation.setdefault("messages", [])
+        records, _ = read_jsonl(log_path)
+        gap = None
+        for record in records:
+            start = record.get("seq", 0)
+            if start > len(messages):
+                gap = start
+                break
+            new_messages = record.get("messages", [])
+            # Stale records left behind by an interrupted compaction add nothing
+            if start + len(new_messages) >= len(messages) and "metadata" in record:
+                conversation["metadata"] = record["metadata"]
+            messages.extend(new_messages[len(messages) - start:])
+
+        if self.stamp(conversation_id) != stamp:
+            return conversation, False
+        if gap is not None:
+            print(f"Gap in conversation log {conversation_id} at message {gap}, ignoring the rest")
+
+        with self._lock:
+            self._state[conversation_id] = {
+                "count": len(messages),
+                "tail": message_digest(messages[-1]) if messages else None,
+                "records": len(records),
+                "stamp": stamp
+            }
+
+        return conversation, True
+
+    def write(self, conversation_id: str, messages: List[Dict], metadata: Dict) -> int:
+        """Persist a conversation, appending only the messages not yet on disk.
+
+        Returns the index of the first message that was not stored before:
+        after a rewrite, the length of the prefix the old and new histories
+        share.
+        """
+        with self._lock, file_lock(self.lock_path(conversation_id)):
+            state = self._state.get(conversation_id)
+
+            # Another worker may have appended or compacted since we last looked
+            if state is None or state["stamp"] != self.stamp(conversation_id):
+                self._read(conversation_id)
+                state = self._state.get(conversation_id)
+
+            count = state["count"] if state else 0
+            appendable = (
+                state is not None
+                and count <= len(messages)
+                and (count == 0 or message_digest(messages[count - 1]) == state["tail"])
+            )
+
+            if not appendable or state["records"] + 1 >= self.compact_every:
+                start = count if appendable else self._common_prefix(conversation_id, messages)
+                self._write_snapshot(conversation_id, messages, metadata)
+                return start
+
+            append_jsonl(self.log_path(conversation_id), [{
+                "seq": count,
+                "messages": messages[count:],
+                "metadata": metadata
+            }], sync=True)
+
+            self._state[conversation_id] = {
+                "count": len(messages),
+                "tail": message_digest(messages[-1]) if messages else None,
+                "records": state["records"] + 1,
+                "stamp": self.stamp(conversation_id)
+            }
+            return count
+
+    def _common_prefix(self, conversation_id: str, messages: List[Dict]) -> int:
+        """How many leading messages the stored history already has (file lock held)."""
+        stored, _ = self._read(conversation_id)
+        common = 0
+        for old, new in zip((stored or {}).get("messages", []), messages):
+            if message_digest(old) != message_digest(new):
+                break
+            common += 1
+        return common
+
+    def _write_snapshot(self, conversation_id: str, messages: List[Dict], metadata: Dict):
+        """Fold the whole history into the snapshot and drop the log (file lock held)."""
+        atomic_write_json(self.snapshot_path(conversation_id), {
+            "id": conversation_id,
+            "messages": messages,
+            "metadata": metadata
+        }, indent=2)
+
+        # The snapshot already covers everything in the log, so removing it
+        # late (or not at all, after a crash) is harmless
+        log_path = self.log_path(conversation_id)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+        with self._lock:
+            self._state[conversation_id] = {
+                "count": len(messages),
+                "tail": message_digest(messages[-1]) if messages else None,
+                "records": 0,
+                "stamp": self.stamp(conversation_id)
+            }
+
+    def compact(self, conversation_id: str):
+        """Fold a conversation's log into its snapshot."""
+        with self._lock, file_lock(self.lock_path(conversation_id)):
+            conversation, _ = self._read(conversation_id)
+            if conversation is not None:
+                self._write_snapshot(conversation_id, conversation["messages"], conversation.get("metadata", {}))
+
+    def mtimes(self) -> Dict[str, float]:
+        """Map conversation IDs to the latest modification time of their files."""
+        mtimes = {}
+        for entry in os.scandir(self.conversations_dir):
+            if not entry.is_file():
+                continue
+            name, ext = os.path.splitext(entry.name)
+            if ext in ('.json', '.log') and not name.startswith('.tmp-'):
+                mtimes[name] = max(mtimes.get(name, 0), entry.stat().st_mtime)
+        return mtimes
+
+    def mtime(self, conversation_id: str) -> float:
+        """Latest modification time of a single conversation's files."""
+        mtime = 0
+        for path in (self.snapshot_path(conversation_id), self.log_path(conversation_id)):
+            if os.path.exists(path):
+                mtime = max(mtime, os.path.getmtime(path))
+        return mtime
+
+    def stamp(self, conversation_id: str):
+        """Change detector covering both the snapshot and the log."""
+        return file_stamp(self.snapshot_path(conversation_id), self.log_path(conversation_id))
@@ -1,31 +1,61 @@
 import os
-import json
 import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+
+from memory.context_builder import ContextBuilder
+from memory.semantic_index import SemanticIndex
+from memory.storage_backend import MemoryBackend, create_backend
+from storage.cache import BoundedCache
+from storage.pagination import NUMBER, decode_cursor, encode_cursor, paginate
+from storage.text import tokenize
+from storage.write_behind import get_writer
+from workspace.state_store import get_state_store
 
 class MemoryManager:
     """Manages persistent memory for the AI, including conversations and user data."""
     
-    def __init__(self, memory_dir: str = "memory"):
+    def __init__(self, memory_dir: str = "memory", cache_ttl: float = 3600, backend: Any = None,
+                 workspace_dir: str = "workspace"):
         self.memory_dir = memory_dir
         self.conversations_dir = os.path.join(memory_dir, "conversations")
         self.users_dir = os.path.join(memory_dir, "users")
-        self.workspace_dir = os.path.join(memory_dir, "workspace")
+        # Workspace state lives with the workspaces (see WorkspaceStateStore);
+        # scripts/migrate_workspace_state.py merges the old memory/workspace tree
+        self.workspace_dir = workspace_dir
         self.projects_dir = os.path.join(memory_dir, "projects")
         
-        # Create directories if they don't exist
-        for directory in [self.memory_dir, self.conversations_dir, 
-                          self.users_dir, self.workspace_dir, self.projects_dir]:
-            os.makedirs(directory, exist_ok=True)
+        # Pluggable storage: JSON files by default, or SQLite ("sqlite" or
+        # MEMORY_BACKEND=sqlite) when several workers share one store
+        self.backend: MemoryBackend = create_backend(backend, memory_dir)
+        
+        # In-memory caches, bounded so long-running workers do not grow forever
+        self.conversation_cache = BoundedCache("conversations", max_entries=256,
+                                               max_bytes=64 * 1024 * 1024, ttl=cache_ttl)
+        self.user_cache = BoundedCache("users", max_entries=1024,
+                                       max_bytes=8 * 1024 * 1024, ttl=cache_ttl)
+        self.project_cache = BoundedCache("projects", max_entries=1024,
+                                          max_bytes=8 * 1024 * 1024, ttl=cache_ttl)
+        self.workspace_store = get_state_store(workspace_dir, cache_ttl=cache_ttl)
+        
+        # Picks the messages sent to the model each turn within a token budget
+        self.context_builder = ContextBuilder(os.path.join(memory_dir, "context"),
+                                              budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2048)))
         
-        # In-memory cache
-        self.conversation_cache = {}
-        self.user_cache = {}
-        self.project_cache = {}
+        # Message embeddings for similarity search, appended as messages are saved
+        self.semantic_index = SemanticIndex(os.path.join(memory_dir, "semantic"), self.backend,
+                                            ivf_threshold=int(os.environ.get("SEMANTIC_IVF_THRESHOLD", 50000)))
+        
+        # Saves are persisted off the request thread by the shared write-behind
+        # writer, which coalesces bursts of saves to the same object
+        self.writer = get_writer()
     
     def save_conversation(self, conversation_id: str, messages: List[Dict], metadata: Dict = None):
-        """Save a conversation to persistent storage."""
+        """Save a conversation to persistent storage.
+        
+        The write happens in the background; saves of the same conversation
+        that arrive close together cost a single append. Use flush() to wait.
+        """
         if not metadata:
             metadata = {}
         
@@ -33,71 +63,120 @@ class MemoryManager:
         if "timestamp" not in metadata:
             metadata["timestamp"] = datetime.now().isoformat()
         
+        # Copy so callers can keep appending to their list meanwhile
         conversation_data = {
             "id": conversation_id,
-            "messages": messages,
-            "metadata": metadata
+            "messages": list(messages),
+            "metadata": dict(metadata)
         }
         
-        # Save to cache
-        self.conversation_cache[conversation_id] = conversation_data
-        
-        # Save to file
-        conversation_path = os.path.join(self.conversations_dir, f"{conversation_id}.json")
-        with open(conversation_path, 'w') as f:
-            json.dump(conversation_data, f, indent=2)
+        self.writer.submit((self.memory_dir, "conversations", conversation_id),
+                           lambda: self._persist_conversation(conversation_data),
+                           conversation_data, batch=self.backend.batch)
         
         return {"status": "success", "message": "Conversation saved"}
     
+    def _persist_conversation(self, conversation_data: Dict):
+        """Write a conversation to the backend (runs on the writer thread)."""
+        conversation_id = conversation_data["id"]
+        
+        # Persist only the new turn; the backend also updates its search index
+        self.backend.write_conversation(conversation_id, conversation_data["messages"],
+                                        conversation_data["metadata"])
+        
+        # Save to cache
+        self.conversation_cache.set(conversation_id, conversation_data,
+                                    stamp=self.backend.conversation_stamp(conversation_id))
+        
+        # Embed the new messages once this write (and its batch) has committed
+        self.writer.submit((self.memory_dir, "semantic_index"), self._update_semantic_index)
+    
+    def _update_semantic_index(self):
+        try:
+            if self.semantic_index.ready:
+                self.semantic_index.update()
+            else:
+                # The first update embeds every stored conversation; keep it off the writer thread
+                self.semantic_index.update_in_background()
+        except Exception as e:
+            print(f"Error updating semantic index: {e}")
+    
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until all queued writes have reached storage."""
+        return self.writer.flush(timeout)
+    
     def get_conversation(self, conversation_id: str) -> Optional[Dict]:
         """Retrieve a conversation by ID."""
-        # Check cache first
-        if conversation_id in self.conversation_cache:
-            return self.conversation_cache[conversation_id]
-        
-        # Check file system
-        conversation_path = os.path.join(self.conversations_dir, f"{conversation_id}.json")
-        if os.path.exists(conversation_path):
-            with open(conversation_path, 'r') as f:
-                conversation_data = json.load(f)
-                # Update cache
-                self.conversation_cache[conversation_id] = conversation_data
-                return conversation_data
+        # A queued save is newer than anything in storage
+        pending = self.writer.pending((self.memory_dir, "conversations", conversation_id))
+        if pending is not None:
+            return pending
+        
+        # Check cache first, unless another worker changed it since
+        stamp = self.backend.conversation_stamp(conversation_id)
+        conversation_data = self.conversation_cache.get(conversation_id, stamp=stamp)
+        if conversation_data is not None:
+            return conversation_data
+        
+        # Check storage
+        conversation_data = self.backend.read_conversation(conversation_id)
+        if conversation_data is not None:
+            # Update cache
+            self.conversation_cache.set(conversation_id, conversation_data, stamp=stamp)
+            return conversation_data
         
         return None
     
+    def build_context(self, conversation_id: str, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """Choose the messages to send to the model for the latest turn.
+        
+        Returns the recent messages that fit the token budget, preceded by
+        older messages relevant to the latest one, plus token accounting:
+        ``tokens`` sent and the conversation's running ``total_tokens``.
+        """
+        return self.context_builder.build(conversation_id, messages)
+    
+    def _save_record(self, cache: Optional[BoundedCache], kind: str, record_id: str, data: Dict):
+        """Queue a record write and keep its cache entry current once it lands."""
+        def persist():
+            self.backend.write_record(kind, record_id, data)
+            if cache is not None:
+                cache.set(record_id, data, stamp=self.backend.record_stamp(kind, record_id))
+        
+        self.writer.submit((self.memory_dir, kind, record_id), persist, data, batch=self.backend.batch)
+    
+    def _get_record(self, cache: Optional[BoundedCache], kind: str, record_id: str) -> Optional[Dict]:
+        """Read a record through its cache, reloading it if storage changed."""
+        pending = self.writer.pending((self.memory_dir, kind, record_id))
+        if pending is not None:
+            return pending
+        
+        if cache is None:
+            return self.backend.read_record(kind, record_id)
+        
+        stamp = self.backend.record_stamp(kind, record_id)
+        data = cache.get(record_id, stamp=stamp)
+        if data is not None:
+            return data
+        
+        data = self.backend.read_record(kind, record_id)
+        if data is not None:
+            cache.set(record_id, data, stamp=stamp)
+        return data
+    
     def save_user_data(self, user_id: str, user_data: Dict):
         """Save user data to persistent storage."""
         # Add timestamp if not present
         if "last_updated" not in user_data:
             user_data["last_updated"] = datetime.now().isoformat()
         
-        # Save to cache
-        self.user_cache[user_id] = user_data
-        
-        # Save to file
-        user_path = os.path.join(self.users_dir, f"{user_id}.json")
-        with open(user_path, 'w') as f:
-            json.dump(user_data, f, indent=2)
+        self._save_record(self.user_cache, "users", user_id, user_data)
         
         return {"status": "success", "message": "User data saved"}
     
     def get_user_data(self, user_id: str) -> Optional[Dict]:
         """Retrieve user data by ID."""
-        # Check cache first
-        if user_id in self.user_cache:
-            return self.user_cache[user_id]
-        
-        # Check file system
-        user_path = os.path.join(self.users_dir, f"{user_id}.json")
-        if os.path.exists(user_path):
-            with open(user_path, 'r') as f:
-                user_data = json.load(f)
-                # Update cache
-                self.user_cache[user_id] = user_data
-                return user_data
-        
-        return None
+        return self._get_record(self.user_cache, "users", user_id)
     
     def save_project_data(self, project_id: str, project_data: Dict):
         """Save project data to persistent storage."""
@@ -105,97 +184,96 @@ class MemoryManager:
         if "last_updated" not in project_data:
             project_data["last_updated"] = datetime.now().isoformat()
         
-        # Create project directory if it doesn't exist
-        project_dir = os.path.join(self.projects_dir, project_id)
-        os.makedirs(project_dir, exist_ok=True)
-        
-        # Save metadata
-        metadata_path = os.path.join(project_dir, "metadata.json")
-        with open(metadata_path, 'w') as f:
-            json.dump(project_data, f, indent=2)
-        
-        # Save to cache
-        self.project_cache[project_id] = project_data
+        self._save_record(self.project_cache, "projects", project_id, project_data)
         
         return {"status": "success", "message": "Project data saved"}
     
     def get_project_data(self, project_id: str) -> Optional[Dict]:
         """Retrieve project data by ID."""
-        # Check cache first
-        if project_id in self.project_cache:
-            return self.project_cache[project_id]
-        
-        # Check file system
-        metadata_path = os.path.join(self.projects_dir, project_id, "metadata.json")
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'r') as f:
-                project_data = json.load(f)
-                # Update cache
-                self.project_cache[project_id] = project_data
-                return project_data
-        
-        return None
+        return self._get_record(self.project_cache, "projects", project_id)
     
     def save_workspace_state(self, workspace_id: str, state: Dict):
-        """Save workspace state to persistent storage."""
-        workspace_dir = os.path.join(self.workspace_dir, workspace_id)
-        os.makedirs(workspace_dir, exist_ok=True)
+        """Save workspace state to persistent storage.
         
-        state_path = os.path.join(workspace_dir, "state.json")
-        with open(state_path, 'w') as f:
-            json.dump(state, f, indent=2)
+        This is the same state WorkspaceManager serves for the workspace, so
+        both managers see each other's changes. The file write is queued on
+        the shared write-behind writer; use flush() to wait for it.
+        """
+        self.workspace_store.put_state(workspace_id, state)
         
         return {"status": "success", "message": "Workspace state saved"}
     
     def get_workspace_state(self, workspace_id: str) -> Optional[Dict]:
         """Retrieve workspace state by ID."""
-        state_path = os.path.join(self.workspace_dir, workspace_id, "state.json")
-        if os.path.exists(state_path):
-            with open(state_path, 'r') as f:
-                return json.load(f)
+        return self.workspace_store.get_state(workspace_id)
+    
+    def iter_search_conversations(self, query: str, order: str = "relevance",
+                                  after: str = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(sort_key, result)`` pairs for a search, lazily and in a stable order.
         
-        return None
+        ``after`` is a cursor from a previous page (see storage.pagination) and
+        raises ValueError if malformed. An empty query lists every
+        conversation, newest first.
+        """
+        # Both backends list everything by recency when the query has no words
+        if order == "recency" or not tokenize(query):
+            types = (NUMBER, str)
+        else:
+            types = (NUMBER, NUMBER, str)
+        return self.backend.iter_search_conversations(query, order, decode_cursor(after, types))
+    
+    def read_new_messages(self, cursor: str = None, limit: int = 500) -> Tuple[List[Dict], str]:
+        """Read messages saved since ``cursor``, oldest first, without rescanning conversations.
+        
+        Each message carries its ``conversation_id`` and ``seq``. Pass the
+        returned cursor to the next call; no cursor starts from the oldest
+        message still available. Messages still queued for writing appear
+        once they reach storage.
+        """
+        messages, key = self.backend.read_new_messages(decode_cursor(cursor, self.backend.message_cursor_types),
+                                                       limit)
+        return messages, encode_cursor(key)
+    
+    def search_conversations(self, query: str, limit: int = 10, order: str = "relevance") -> List[Dict]:
+        """Search conversations for a query string.
+        
+        Every word of the query must match the conversation. Results are
+        ranked by relevance or, with ``order="recency"``, newest first.
+        """
+        try:
+            results, _ = paginate(self.iter_search_conversations(query, order), limit)
+            return results
+        except Exception as e:
+            print(f"Error searching conversations: {e}")
+            return []
+    
+    def semantic_search(self, query: str, k: int = 10) -> List[Dict]:
+        """Find the saved messages most similar in wording to a query.
+        
+        Unlike search_conversations, messages need not contain every word;
+        each result has the message's ``conversation_id``, ``seq``, ``role``,
+        a ``preview`` of its content and a similarity ``score``. While the
+        index is still embedding stored conversations, keyword matches stand
+        in, with ``seq`` and ``role`` None and the keyword ``score``.
+        """
+        try:
+            results = self.semantic_index.search(query, k)
+            if results is None:
+                results = [{"conversation_id": result["id"], "seq": None, "role": None,
+                            "preview": result["preview"], "score": result["score"]}
+                           for result in self.search_conversations(query, k)]
+            return results
+        except Exception as e:
+            print(f"Error in semantic search: {e}")
+            return []
+    
+    def cache_stats(self) -> List[Dict]:
+        """Return hit/miss/eviction counters for the memory caches."""
+        return [cache.stats() for cache in (self.conversation_cache, self.user_cache, self.project_cache)]
     
-    def search_conversations(self, query: str, limit: int = 10) -> List[Dict]:
-        """Search conversations for a query string."""
-        results = []
-        
-        # List all conversation files
-        conversation_files = os.listdir(self.conversations_dir)
-        
-        for file_name in conversation_files:
-            if not file_name.endswith('.json'):
-                continue
-                
-            file_path = os.path.join(self.conversations_dir, file_name)
-            try:
-                with open(file_path, 'r') as f:
-                    conversation = json.load(f)
-                
-                # Simple search in messages
-                found = False
-                for message in conversation.get("messages", []):
-                    if query.lower() in message.get("content", "").lower():
-                        found = True
-                        break
-                
-                if found:
-                    results.append({
-                        "id": conversation.get("id"),
-                        "preview": conversation.get("messages", [])[0].get("content", "")[:100] if conversation.get("messages") else "",
-                        "timestamp": conversation.get("metadata", {}).get("timestamp")
-                    })
-                    
-                    if len(results) >= limit:
-                        break
-                        
-            except Exception as e:
-                print(f"Error searching conversation {file_name}: {e}")
-        
-        # Sort by timestamp, newest first
-        results.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        return results
+    def writer_stats(self) -> Dict:
+        """Return write and coalescing counters for the write-behind writer."""
+        return self.writer.stats()
     
     def backup_to_github(self, github_repo: str, github_token: str):
         """Backup all memory data to GitHub repository."""
@@ -0,0 +1,96 @@
+import os
+import json
+import re
+from typing import Dict, List, Tuple
+
+from storage.file_utils import append_jsonl, file_lock
+
+SEGMENT_PATTERN = re.compile(r"^messages-(\d+)\.jsonl$")
+
+
+class MessageFeed:
+    """Append-only feed of newly saved conversation messages.
+
+    Every save appends one record with the messages it added, so consumers
+    can follow new turns with a ``(segment, offset)`` cursor instead of
+    rescanning conversations. The feed starts a new segment every
+    ``rotate_bytes`` and keeps the newest ``keep_segments``; a consumer that
+    falls further behind resumes at the oldest segment still kept.
+    """
+
+    def __init__(self, feed_dir: str, rotate_bytes: int = 8 * 1024 * 1024, keep_segments: int = 8):
+        self.feed_dir = feed_dir
+        self.rotate_bytes = rotate_bytes
+        self.keep_segments = keep_segments
+        self.lock_path = os.path.join(feed_dir, ".lock")
+        os.makedirs(feed_dir, exist_ok=True)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.feed_dir, f"messages-{segment:06d}.jsonl")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(self.feed_dir))
+                      if match)
+
+    def append(self, conversation_id: str, seq: int, messages: List[Dict]):
+        """Record messages added to a conversation, the first at index ``seq``."""
+        if not messages:
+            return
+
+        with file_lock(self.lock_path):
+            segments = self._segments() or [1]
+            segment = segments[-1]
+            path = self._segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.rotate_bytes:
+                segment += 1
+                path = self._segment_path(segment)
+                for old in segments[:max(0, len(segments) + 1 - self.keep_segments)]:
+                    os.remove(self._segment_path(old))
+
+            append_jsonl(path, [{"conversation_id": conversation_id, "seq": seq, "messages": messages}])
+
+    def read(self, after: Tuple = None, limit: int = 500) -> Tuple[List[Dict], Tuple]:
+        """Read at least one and up to about ``limit`` messages saved after cursor ``after``.
+
+        Returns the messages, each with its ``conversation_id`` and ``seq``,
+        and the cursor to pass next time.
+        """
+        segments = self._segments()
+        if not segments:
+            return [], after or (1, 0)
+
+        segment, offset = after or (segments[0], 0)
+        if segment < segments[0]:
+            # Rotated away before it was read
+            segment, offset = segments[0], 0
+
+        messages = []
+        while len(messages) < limit:
+            path = self._segment_path(segment)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # A write still in progress
+                            break
+                        offset += len(line)
+                        if not line.strip():
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError as e:
+                            print(f"Skipping corrupt record in {path}: {e}")
+                            continue
+                        for seq, message in enumerate(record["messages"], record["seq"]):
+                            messages.append(dict(message, conversation_id=record["conversation_id"], seq=seq))
+                        if len(messages) >= limit:
+                            break
+
+            later = [number for number in segments if number > segment]
+            if len(messages) >= limit or not later:
+                break
+            # This segment is finished once a newer one exists
+            segment, offset = later[0], 0
+
+        return messages, (segment, offset)
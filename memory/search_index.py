@@ -0,0 +1,310 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import Counter
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from memory.conversation_log import message_digest
+from storage.file_utils import append_jsonl, atomic_write_json, file_lock, read_jsonl
+from storage.pagination import iter_sorted
+from storage.text import tokenize
+
+
+class SearchIndex:
+    """Persistent inverted index over conversation messages.
+
+    The index lives in a snapshot plus an append-only journal. Every process
+    appends to the journal and replays records written by other workers before
+    answering a query, so gunicorn workers share one index on disk.
+    """
+
+    def __init__(self, index_dir: str, compact_threshold: int = 50000):
+        self.index_dir = index_dir
+        self.snapshot_path = os.path.join(index_dir, "snapshot.json")
+        self.lock_path = os.path.join(index_dir, "index.lock")
+        self.compact_threshold = compact_threshold
+
+        os.makedirs(index_dir, exist_ok=True)
+
+        # token -> conversation id -> message index -> [term frequency, timestamp]
+        self.postings: Dict[str, Dict[str, Dict[int, List]]] = {}
+        # conversation id -> indexed message count, preview, timestamps, source mtime
+        self.conversations: Dict[str, Dict] = {}
+        self.conversation_tokens: Dict[str, set] = {}
+
+        self.generation = 0
+        self._offset = 0
+        self._journal_records = 0
+        self._snapshot_stamp = None
+        self._lock = threading.RLock()
+
+        self._load()
+
+    def _journal_path(self, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.index_dir, f"journal.{generation}.jsonl")
+
+    def _snapshot_signature(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+            return (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """Load the snapshot and replay the journal that belongs to it."""
+        self.postings = {}
+        self.conversations = {}
+        self.conversation_tokens = {}
+        self.generation = 0
+        self._offset = 0
+        self._journal_records = 0
+        self._snapshot_stamp = self._snapshot_signature()
+
+        if self._snapshot_stamp:
+            try:
+                with open(self.snapshot_path, 'r') as f:
+                    snapshot = json.load(f)
+                self.generation = snapshot.get("generation", 0)
+                self.conversations = snapshot.get("conversations", {})
+                for token, by_conversation in snapshot.get("postings", {}).items():
+                    self.postings[token] = {
+                        cid: {int(idx): entry for idx, entry in entries.items()}
+                        for cid, entries in by_conversation.items()
+                    }
+                    for cid in by_conversation:
+                        self.conversation_tokens.setdefault(cid, set()).add(token)
+            except Exception as e:
+                print(f"Error loading search index snapshot, rebuilding: {e}")
+                self.postings = {}
+                self.conversations = {}
+                self.conversation_tokens = {}
+
+        self._catch_up()
+
+    def _catch_up(self):
+        """Apply journal records appended since we last looked, by any process."""
+        if self._snapshot_signature() != self._snapshot_stamp:
+            # Another worker compacted the index; start over from its snapshot
+            self._load()
+            return
+
+        records, self._offset = read_jsonl(self._journal_path(), self._offset)
+        for record in records:
+            self._apply(record)
+        self._journal_records += len(records)
+
+    def _apply(self, record: Dict):
+        op = record.get("op")
+        cid = record.get("c")
+
+        if op == "add":
+            for token, tf in record["k"].items():
+                self.postings.setdefault(token, {}).setdefault(cid, {})[record["m"]] = [tf, record["t"]]
+                self.conversation_tokens.setdefault(cid, set()).add(token)
+        elif op == "meta":
+            self.conversations[cid] = {key: value for key, value in record.items() if key not in ("op", "c")}
+        elif op == "drop":
+            for token in self.conversation_tokens.pop(cid, set()):
+                by_conversation = self.postings.get(token)
+                if by_conversation is not None:
+                    by_conversation.pop(cid, None)
+                    if not by_conversation:
+                        del self.postings[token]
+            self.conversations.pop(cid, None)
+
+    def _write(self, records: List[Dict]):
+        """Persist records to the journal and apply them locally."""
+        if not records:
+            return
+
+        with file_lock(self.lock_path):
+            self._catch_up()
+            append_jsonl(self._journal_path(), records)
+            for record in records:
+                self._apply(record)
+
+            if self._journal_records + len(records) > self.compact_threshold:
+                self._compact_locked()
+
+    def _compact_locked(self):
+        """Fold the journal into a new snapshot generation (file lock held)."""
+        # Pick up our own appends so the snapshot is complete
+        self._catch_up()
+
+        old_journal = self._journal_path()
+        self.generation += 1
+        atomic_write_json(self.snapshot_path, {
+            "generation": self.generation,
+            "conversations": self.conversations,
+            "postings": self.postings
+        })
+        if os.path.exists(old_journal):
+            os.remove(old_journal)
+
+        self._snapshot_stamp = self._snapshot_signature()
+        self._offset = 0
+        self._journal_records = 0
+
+    def compact(self):
+        """Force a compaction of the journal into the snapshot."""
+        with self._lock, file_lock(self.lock_path):
+            self._compact_locked()
+
+    def index_conversation(self, conversation_id: str, messages: List[Dict],
+                           metadata: Dict = None, source_mtime: float = None):
+        """Index the messages of a conversation that are not indexed yet."""
+        metadata = metadata or {}
+
+        with self._lock:
+            self._catch_up()
+            info = self.conversations.get(conversation_id)
+            records = []
+
+            start = 0
+            if info:
+                count = info.get("count", 0)
+                if 0 < count <= len(messages) and message_digest(messages[count - 1]) == info.get("tail"):
+                    start = count
+                else:
+                    # History was rewritten; reindex from scratch
+                    records.append({"op": "drop", "c": conversation_id})
+
+            now = time.time()
+            updated = info.get("updated", 0) if info and start else 0
+            for idx in range(start, len(messages)):
+                message = messages[idx]
+                timestamp = message.get("timestamp")
+                if timestamp is None:
+                    timestamp = now
+                updated = max(updated, timestamp)
+                counts = Counter(tokenize(message.get("content", "")))
+                if counts:
+                    records.append({
+                        "op": "add", "c": conversation_id, "m": idx,
+                        "t": timestamp, "k": dict(counts)
+                    })
+
+            if start == len(messages) and info and info.get("mtime") == source_mtime \
+                    and info.get("timestamp") == metadata.get("timestamp"):
+                return
+
+            records.append({
+                "op": "meta", "c": conversation_id,
+                "count": len(messages),
+                "tail": message_digest(messages[-1]) if messages else None,
+                "preview": messages[0].get("content", "")[:100] if messages else "",
+                "timestamp": metadata.get("timestamp"),
+                "updated": updated or now,
+                "mtime": source_mtime
+            })
+            self._write(records)
+
+    def remove_conversation(self, conversation_id: str):
+        """Drop a conversation from the index."""
+        with self._lock:
+            self._write([{"op": "drop", "c": conversation_id}])
+
+    def refresh(self, source_mtimes: Dict[str, float], loader: Callable[[str], Optional[Dict]]):
+        """Reindex conversations whose files changed while we were not running.
+
+        ``source_mtimes`` maps conversation IDs to the modification time of their
+        files; only conversations whose mtime differs from the indexed one are
+        loaded and reindexed, and conversations that vanished are dropped.
+        """
+        with self._lock:
+            self._catch_up()
+
+            stale = [cid for cid, mtime in source_mtimes.items()
+                     if self.conversations.get(cid, {}).get("mtime") != mtime]
+            removed = [cid for cid in self.conversations if cid not in source_mtimes]
+
+            for cid in removed:
+                self.remove_conversation(cid)
+
+            for cid in stale:
+                try:
+                    conversation = loader(cid)
+                except Exception as e:
+                    print(f"Error indexing conversation {cid}: {e}")
+                    continue
+                if conversation is None:
+                    continue
+                self.index_conversation(cid, conversation.get("messages", []),
+                                        conversation.get("metadata", {}), source_mtimes[cid])
+
+            return {"reindexed": len(stale), "removed": len(removed)}
+
+    def iter_search(self, query: str, order: str = "relevance", after: Tuple = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(sort_key, result)`` for conversations containing every query token.
+
+        Results come ranked by TF-IDF score (``order="relevance"``) or by the
+        time of the latest message (``order="recency"``), with the conversation
+        ID as tie-breaker so the order is stable for cursors. ``after`` resumes
+        strictly after a previously returned sort key. An empty query lists all
+        conversations, newest first.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+
+        with self._lock:
+            self._catch_up()
+
+            if not tokens:
+                order = "recency"
+                scores = {cid: 0.0 for cid in self.conversations}
+            else:
+                scores = self._score(tokens)
+
+            keyed = []
+            for cid, score in scores.items():
+                info = self.conversations.get(cid, {})
+                result = {
+                    "id": cid,
+                    "preview": info.get("preview", ""),
+                    "timestamp": info.get("timestamp"),
+                    "updated": info.get("updated", 0),
+                    "score": round(score, 4)
+                }
+                if order == "recency":
+                    key = (result["updated"], cid)
+                else:
+                    key = (result["score"], result["updated"], cid)
+                keyed.append((key, result))
+
+        return iter_sorted(keyed, after)
+
+    def _score(self, tokens: List[str]) -> Dict[str, float]:
+        """Score conversations that contain every token (lock held)."""
+        posting_lists = []
+        for token in tokens:
+            by_conversation = self.postings.get(token)
+            if not by_conversation:
+                return {}
+            posting_lists.append(by_conversation)
+
+        # Intersect starting from the rarest token
+        posting_lists.sort(key=len)
+        candidates = set(posting_lists[0])
+        for by_conversation in posting_lists[1:]:
+            candidates.intersection_update(by_conversation)
+            if not candidates:
+                return {}
+
+        total = max(len(self.conversations), 1)
+        scores = {}
+        for cid in candidates:
+            score = 0.0
+            for by_conversation in posting_lists:
+                idf = math.log(1 + total / len(by_conversation))
+                score += idf * sum(1 + math.log(tf) for tf, _ in by_conversation[cid].values())
+            scores[cid] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10, order: str = "relevance") -> List[Dict]:
+        """Return the top ``limit`` results of iter_search."""
+        if limit <= 0:
+            return []
+        return [result for _, result in islice(self.iter_search(query, order), limit)]
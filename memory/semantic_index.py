@@ -0,0 +1,397 @@
+import os
+import json
+import zlib
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from storage.file_utils import atomic_open, atomic_write_json, file_lock, file_stamp
+from storage.text import tokenize
+
+
+def _terms(text: str) -> List[str]:
+    """Words, word pairs and character trigrams of each word."""
+    words = tokenize(text)
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        terms.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return terms
+
+
+def embed(text: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalised signed hashed term frequencies, and the buckets the text touched."""
+    vector = np.zeros(dim, dtype=np.float32)
+    terms = _terms(text)
+    if not terms:
+        return vector, np.zeros(0, dtype=np.int64)
+
+    hashes = np.array([zlib.crc32(term.encode("utf-8")) for term in terms], dtype=np.int64)
+    buckets = hashes % dim
+    # A second hash bit picks the sign so collisions cancel out on average
+    signs = np.where((hashes // dim) & 1, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, buckets, signs)
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector, np.unique(buckets)
+
+
+class SemanticIndex:
+    """Embeddings of every saved message for nearest-neighbour search.
+
+    Messages are embedded locally as hashed n-gram term frequencies of
+    ``dim`` dimensions and appended as rows of ``vectors.f32``, a contiguous
+    float32 matrix that is memory-mapped for search. Document frequencies
+    per bucket are kept alongside. Scores are cosine similarities of the
+    IDF-weighted query and rows. The IDF weights (``idf.npy``) are frozen,
+    together with each row's weighted norm (``norms.f32``), and recomputed
+    each time the matrix doubles, so stored rows never need rewriting. Row
+    metadata (conversation, message index, preview) is in ``rows.jsonl``
+    with a fixed-width offset table.
+
+    ``update`` follows the backend's feed of newly saved messages under a
+    file lock, so workers never embed a message twice. The first update
+    embeds the conversations that were already stored. Until it has
+    finished, ``search`` returns None and runs it in the background.
+
+    Below ``ivf_threshold`` rows search is one matrix-vector product. Above
+    it, the weighted rows are clustered with spherical k-means into about
+    sqrt(n) lists. A query then scores only the rows in its ``nprobe``
+    nearest lists. The clustering is redone with the IDF weights.
+    """
+
+    def __init__(self, index_dir: str, backend, dim: int = 384, ivf_threshold: int = 50000,
+                 nprobe: int = 8):
+        self.index_dir = index_dir
+        self.backend = backend
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        self.state_path = os.path.join(index_dir, "state.json")
+        self.lock_path = os.path.join(index_dir, ".lock")
+        self.paths = {name: os.path.join(index_dir, name) for name in
+                      ("vectors.f32", "rows.jsonl", "offsets.u64", "assign.i32", "df.npy", "centroids.npy",
+                       "idf.npy", "norms.f32")}
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.state = {"dim": dim, "count": 0, "cursor": None, "backfilled": False, "ivf_count": 0, "idf_count": 0}
+        self._stamp = None
+        self._vectors: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._assign: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._df = np.zeros(dim, dtype=np.int64)
+        self._lock = threading.RLock()
+        # Set while this process runs update(); its in-memory state is then the newest
+        self._updating = False
+        self._background: Optional[threading.Thread] = None
+        self._refresh()
+
+    @property
+    def dim(self) -> int:
+        return self.state["dim"]
+
+    def _refresh(self):
+        """Remap the files if another process (or this one) changed them."""
+        stamp = file_stamp(self.state_path)
+        if stamp == self._stamp or self._updating:
+            return
+        with self._lock:
+            if os.path.exists(self.state_path):
+                with open(self.state_path, 'r') as f:
+                    self.state = json.load(f)
+                self.state.setdefault("idf_count", 0)
+                self._df = np.load(self.paths["df.npy"])
+
+            count, dim = self.state["count"], self.dim
+            self._vectors = self._map("vectors.f32", np.float32, (count, dim))
+            self._offsets = self._map("offsets.u64", np.uint64, (count,))
+            if self._weights_complete():
+                self._idf = np.load(self.paths["idf.npy"])
+                self._norms = self._map("norms.f32", np.float32, (count,))
+            else:
+                self._idf = self._norms = None
+            if self.state["ivf_count"]:
+                self._assign = self._map("assign.i32", np.int32, (count,))
+                self._centroids = np.load(self.paths["centroids.npy"])
+            else:
+                self._assign = self._centroids = None
+            self._stamp = stamp
+
+    def _weights_complete(self) -> bool:
+        """Whether IDF weights exist and every row has its weighted norm."""
+        norms_path = self.paths["norms.f32"]
+        return (self.state["idf_count"] > 0 and os.path.exists(self.paths["idf.npy"])
+                and os.path.exists(norms_path) and os.path.getsize(norms_path) == self.state["count"] * 4)
+
+    @property
+    def ready(self) -> bool:
+        """Whether stored conversations have been embedded and rows can be scored."""
+        self._refresh()
+        return self.state["backfilled"] and (self.state["count"] == 0 or self._norms is not None)
+
+    def _map(self, name: str, dtype, shape: Tuple) -> Optional[np.ndarray]:
+        if shape[0] == 0:
+            return None
+        return np.memmap(self.paths[name], dtype=dtype, mode='r', shape=shape)
+
+    def _truncate(self, count: int):
+        """Drop rows beyond ``count`` left by a crash between appends."""
+        sizes = {"vectors.f32": count * self.dim * 4, "offsets.u64": count * 8, "norms.f32": count * 4,
+                 "assign.i32": count * 4 if self.state["ivf_count"] else 0}
+        for name, size in sizes.items():
+            path = self.paths[name]
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        rows_path = self.paths["rows.jsonl"]
+        if os.path.exists(rows_path):
+            end = int(self._offsets[-1]) if count else 0
+            if count:
+                with open(rows_path, 'rb') as f:
+                    f.seek(end)
+                    end += len(f.readline())
+            with open(rows_path, 'r+b') as f:
+                f.truncate(end)
+
+    def update(self, limit: int = 2000) -> int:
+        """Embed messages saved since the last update; returns how many were added."""
+        added = 0
+        with file_lock(self.lock_path):
+            self._refresh()
+            self._updating = True
+            try:
+                added = self._update_locked(limit)
+            finally:
+                self._updating = False
+        self._refresh()
+        return added
+
+    def _update_locked(self, limit: int) -> int:
+        added = 0
+        self._truncate(self.state["count"])
+
+        skip: Dict[str, int] = {}
+        if not self.state["backfilled"]:
+            added += self._backfill(skip)
+
+        while True:
+            after = tuple(self.state["cursor"]) if self.state["cursor"] else None
+            messages, cursor = self.backend.read_new_messages(after, limit)
+            # Skip messages the backfill already embedded
+            fresh = [m for m in messages if m["seq"] >= skip.get(m["conversation_id"], 0)]
+            self._append(fresh, list(cursor) if cursor else None)
+            added += len(fresh)
+            if len(messages) < limit:
+                break
+
+        count = self.state["count"]
+        if count and (not self._weights_complete() or count >= 2 * self.state["idf_count"]):
+            self._reweight()
+        elif count >= self.ivf_threshold and count >= 2 * self.state["ivf_count"]:
+            self._train_ivf()
+        return added
+
+    def update_in_background(self):
+        """Run update() on a background thread unless one is already running."""
+        with self._lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            self._background = threading.Thread(target=self._update_quietly, name="semantic-index", daemon=True)
+            self._background.start()
+
+    def _update_quietly(self):
+        try:
+            self.update()
+        except Exception as e:
+            print(f"Error updating semantic index: {e}")
+
+    def _backfill(self, skip: Dict[str, int]) -> int:
+        """Embed conversations stored before the index existed."""
+        added = 0
+        for conversation_id in self.backend.conversation_ids():
+            conversation = self.backend.read_conversation(conversation_id)
+            if not conversation:
+                continue
+            messages = [dict(message, conversation_id=conversation_id, seq=seq)
+                        for seq, message in enumerate(conversation.get("messages", []))]
+            skip[conversation_id] = len(messages)
+            self._append(messages, self.state["cursor"])
+            added += len(messages)
+        self.state["backfilled"] = True
+        self._save_state()
+        return added
+
+    def _append(self, messages: List[Dict], cursor):
+        """Append rows for ``messages`` and advance the cursor (file lock held)."""
+        if messages:
+            vectors = np.zeros((len(messages), self.dim), dtype=np.float32)
+            rows = []
+            for i, message in enumerate(messages):
+                content = str(message.get("content", ""))
+                vectors[i], buckets = embed(content, self.dim)
+                self._df[buckets] += 1
+                rows.append(json.dumps({
+                    "conversation_id": message["conversation_id"],
+                    "seq": message["seq"],
+                    "role": message.get("role"),
+                    "preview": content[:200]
+                }, separators=(",", ":")).encode("utf-8") + b"\n")
+
+            with open(self.paths["rows.jsonl"], 'ab') as f:
+                start = f.tell()
+                f.write(b"".join(rows))
+            offsets = start + np.cumsum([0] + [len(row) for row in rows[:-1]], dtype=np.uint64)
+
+            with open(self.paths["vectors.f32"], 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.paths["offsets.u64"], 'ab') as f:
+                f.write(offsets.astype(np.uint64).tobytes())
+            # Without complete weights update() recomputes every norm and list afterwards
+            if self._weights_complete():
+                weighted = vectors * self._idf
+                norms = np.linalg.norm(weighted, axis=1)
+                with open(self.paths["norms.f32"], 'ab') as f:
+                    f.write(norms.astype(np.float32).tobytes())
+                if self.state["ivf_count"]:
+                    centroids = np.load(self.paths["centroids.npy"])
+                    weighted /= np.where(norms > 0, norms, 1)[:, None]
+                    with open(self.paths["assign.i32"], 'ab') as f:
+                        f.write(np.argmax(weighted @ centroids.T, axis=1).astype(np.int32).tobytes())
+            self.state["count"] += len(messages)
+
+        self.state["cursor"] = cursor
+        self._save_state()
+
+    def _save_state(self):
+        # The state is written last, so readers never see rows that are not complete
+        with atomic_open(self.paths["df.npy"], 'wb') as f:
+            np.save(f, self._df)
+        atomic_write_json(self.state_path, self.state)
+
+    def _reweight(self):
+        """Freeze IDF weights from the current document frequencies and
+        recompute every row's weighted norm and IVF list (file lock held)."""
+        count = self.state["count"]
+        vectors = np.memmap(self.paths["vectors.f32"], dtype=np.float32, mode='r', shape=(count, self.dim))
+        idf = np.log((1 + count) / (1 + self._df)).astype(np.float32) + 1
+
+        with atomic_open(self.paths["norms.f32"], 'wb') as f:
+            for start in range(0, count, 65536):
+                chunk = np.asarray(vectors[start:start + 65536]) * idf
+                f.write(np.linalg.norm(chunk, axis=1).astype(np.float32).tobytes())
+        with atomic_open(self.paths["idf.npy"], 'wb') as f:
+            np.save(f, idf)
+        self._idf = idf
+        self.state["idf_count"] = count
+
+        # Lists assigned under the old weights no longer match the queries
+        if count >= self.ivf_threshold or self.state["ivf_count"]:
+            self._train_ivf()
+        else:
+            self._save_state()
+
+    def _weighted(self, vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """Rows as unit-length IDF-weighted vectors, the space queries are scored in."""
+        return vectors * self._idf / np.where(norms > 0, norms, 1)[:, None]
+
+    def _train_ivf(self, iterations: int = 10, sample_size: int = 20000):
+        """Cluster the weighted rows into about sqrt(n) lists with spherical k-means (file lock held)."""
+        count = self.state["count"]
+        vectors = np.memmap(self.paths["vectors.f32"], dtype=np.float32, mode='r', shape=(count, self.dim))
+        row_norms = np.memmap(self.paths["norms.f32"], dtype=np.float32, mode='r', shape=(count,))
+        n_lists = int(min(4096, max(16, math.sqrt(count))))
+
+        rng = np.random.default_rng(0)
+        picked = np.sort(rng.choice(count, min(count, sample_size), replace=False))
+        sample = self._weighted(np.asarray(vectors[picked]), np.asarray(row_norms[picked]))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            # Empty lists keep their old centroid
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        with atomic_open(self.paths["assign.i32"], 'wb') as f:
+            for start in range(0, count, 65536):
+                chunk = self._weighted(np.asarray(vectors[start:start + 65536]),
+                                       np.asarray(row_norms[start:start + 65536]))
+                f.write(np.argmax(chunk @ centroids.T, axis=1).astype(np.int32).tobytes())
+        with atomic_open(self.paths["centroids.npy"], 'wb') as f:
+            np.save(f, centroids)
+
+        self.state["ivf_count"] = count
+        self._save_state()
+
+    def _row(self, index: int) -> Dict:
+        with open(self.paths["rows.jsonl"], 'rb') as f:
+            f.seek(int(self._offsets[index]))
+            return json.loads(f.readline())
+
+    def search(self, query: str, k: int = 10) -> Optional[List[Dict]]:
+        """Return the ``k`` messages most similar to ``query``, best first.
+
+        Returns None, and starts the first update in the background, while
+        the conversations stored before the index existed are embedded.
+        """
+        if not self.ready:
+            self.update_in_background()
+            return None
+
+        with self._lock:
+            vectors, norms, idf = self._vectors, self._norms, self._idf
+            assign, centroids = self._assign, self._centroids
+            query_vector, _ = embed(query, self.dim)
+            if vectors is None or k <= 0 or not query_vector.any():
+                return []
+            count = len(vectors)
+
+            weighted = query_vector * idf
+            weighted /= np.linalg.norm(weighted)
+            # Rows are stored unweighted: (q*idf).(r*idf) = (q*idf*idf).r, and
+            # dividing by |r*idf| makes each score the cosine of the weighted vectors
+            target = weighted * idf
+
+            candidates = None
+            if centroids is not None and assign is not None:
+                probes = np.argsort(-(centroids @ weighted))[:self.nprobe]
+                candidates = np.flatnonzero(np.isin(assign, probes))
+                if len(candidates) < k:
+                    candidates = None
+
+            if candidates is None:
+                rows = np.arange(count)
+                scores = np.asarray(vectors @ target)
+            else:
+                rows = candidates
+                scores = np.asarray(vectors[candidates] @ target)
+            row_norms = np.asarray(norms[rows])
+            scores = scores / np.where(row_norms > 0, row_norms, 1)
+
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for i in top:
+                if scores[i] <= 0:
+                    break
+                results.append(dict(self._row(int(rows[i])), score=round(float(scores[i]), 4)))
+            return results
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "rows": self.state["count"],
+            "dim": self.dim,
+            "ivf_lists": len(self._centroids) if self._centroids is not None else 0,
+            "ivf_trained_at": self.state["ivf_count"]
+        }
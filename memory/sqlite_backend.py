@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from memory.conversation_log import message_digest
+from memory.storage_backend import MemoryBackend, RECORD_KINDS
+from storage.text import tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL,
+    timestamp TEXT,
+    updated REAL NOT NULL,
+    message_count INTEGER NOT NULL,
+    tail TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations(updated);
+
+-- AUTOINCREMENT so ids are never reused after a delete; the message feed
+-- follows them
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT,
+    content TEXT,
+    timestamp REAL,
+    data TEXT NOT NULL,
+    UNIQUE (conversation_id, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages(timestamp);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+
+CREATE TABLE IF NOT EXISTS records (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (kind, id)
+);
+"""
+
+# Databases created before messages had an id column; the implicit rowids
+# become the ids, so feed cursors stay valid, and the insert trigger
+# refills the FTS index as the rows are copied
+MIGRATE_MESSAGE_IDS = """
+BEGIN IMMEDIATE;
+DROP TRIGGER IF EXISTS messages_ai;
+DROP TRIGGER IF EXISTS messages_ad;
+DROP TABLE IF EXISTS messages_fts;
+DROP INDEX IF EXISTS messages_timestamp;
+ALTER TABLE messages RENAME TO messages_rowid;
+""" + SCHEMA + """
+INSERT INTO messages (id, conversation_id, seq, role, content, timestamp, data)
+    SELECT rowid, conversation_id, seq, role, content, timestamp, data FROM messages_rowid ORDER BY rowid;
+DROP TABLE messages_rowid;
+COMMIT;
+"""
+
+
+class SQLiteBackend(MemoryBackend):
+    """Stores memory in a single SQLite database in WAL mode.
+
+    WAL lets several gunicorn workers read while one writes, FTS5 serves
+    message search, and ``batch()`` groups writes into one transaction.
+    """
+
+    name = "sqlite"
+    # Id of the last message read
+    message_cursor_types = (int,)
+
+    def __init__(self, db_path: str, busy_timeout: float = 5.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+
+        conn = self._connection()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+        if columns and "id" not in columns:
+            conn.executescript(MIGRATE_MESSAGE_IDS)
+        conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def batch(self):
+        """Run the enclosed writes in a single transaction."""
+        conn = self._connection()
+        if self._local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield
+        except Exception:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        else:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("COMMIT")
+
+    def read_conversation(self, conversation_id: str) -> Optional[Dict]:
+        conn = self._connection()
+        row = conn.execute("SELECT metadata FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+
+        messages = [json.loads(data) for (data,) in conn.execute(
+            "SELECT data FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,))]
+        return {"id": conversation_id, "messages": messages, "metadata": json.loads(row[0])}
+
+    def write_conversation(self, conversation_id: str, messages: List[Dict], metadata: Dict):
+        with self.batch():
+            conn = self._connection()
+            row = conn.execute("SELECT message_count, tail FROM conversations WHERE id = ?",
+                               (conversation_id,)).fetchone()
+
+            start = 0
+            if row:
+                count, tail = row
+                if count <= len(messages) and (count == 0 or message_digest(messages[count - 1]) == tail):
+                    start = count
+                else:
+                    # History was rewritten; replace it from the first message that differs
+                    stored = conn.execute("SELECT data FROM messages WHERE conversation_id = ? ORDER BY seq",
+                                          (conversation_id,))
+                    for (data,), message in zip(stored, messages):
+                        if message_digest(json.loads(data)) != message_digest(message):
+                            break
+                        start += 1
+                    conn.execute("DELETE FROM messages WHERE conversation_id = ? AND seq >= ?",
+                                 (conversation_id, start))
+
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, seq, role, content, timestamp, data) VALUES (?, ?, ?, ?, ?, ?)",
+                [(conversation_id, seq, message.get("role"), message.get("content", ""),
+                  message.get("timestamp", now), json.dumps(message))
+                 for seq, message in enumerate(messages[start:], start)]
+            )
+
+            updated = max([m.get("timestamp", now) for m in messages[start:]] or [now])
+            conn.execute(
+                """INSERT INTO conversations (id, metadata, timestamp, updated, message_count, tail)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET
+                       metadata = excluded.metadata, timestamp = excluded.timestamp,
+                       updated = MAX(conversations.updated, excluded.updated),
+                       message_count = excluded.message_count, tail = excluded.tail,
+                       version = conversations.version + 1""",
+                (conversation_id, json.dumps(metadata), metadata.get("timestamp"), updated,
+                 len(messages), message_digest(messages[-1]) if messages else None)
+            )
+
+    def conversation_stamp(self, conversation_id: str) -> Any:
+        row = self._connection().execute("SELECT version FROM conversations WHERE id = ?",
+                                         (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def conversation_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT id FROM conversations ORDER BY id")]
+
+    def iter_search_conversations(self, query: str, order: str = "relevance",
+                                  after: Tuple = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(sort_key, result)`` for conversations containing every token.
+
+        Pages through the database with keyset pagination on the sort key, so
+        only ``page_size`` rows are held at a time. An empty query lists all
+        conversations, newest first.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            order = "recency"
+            source = "SELECT id AS conversation_id, 0.0 AS score FROM conversations"
+            params: list = []
+        else:
+            # Like the JSON index, every token must occur somewhere in the
+            # conversation, not necessarily in one message: take each token's
+            # best match per conversation and keep conversations that have all.
+            # Tokens are quoted so user input is never parsed as FTS5 syntax
+            per_token = """SELECT m.conversation_id, -MIN(matches.rank) AS score
+                           FROM (SELECT rowid AS id, rank FROM messages_fts
+                                 WHERE messages_fts MATCH ?) AS matches
+                           JOIN messages m ON m.id = matches.id
+                           GROUP BY m.conversation_id"""
+            source = f"""SELECT conversation_id, ROUND(SUM(score), 4) AS score
+                         FROM ({" UNION ALL ".join([per_token] * len(tokens))})
+                         GROUP BY conversation_id
+                         HAVING COUNT(*) = {len(tokens)}"""
+            params = ['"' + token.replace('"', '""') + '"' for token in tokens]
+
+        if order == "recency":
+            key_columns = "c.updated, c.id"
+            order_by = "c.updated DESC, c.id DESC"
+        else:
+            key_columns = "hits.score, c.updated, c.id"
+            order_by = "hits.score DESC, c.updated DESC, c.id DESC"
+
+        page_size = 200
+        while True:
+            where = f"WHERE ({key_columns}) < ({', '.join('?' * len(after))})" if after else ""
+            rows = self._connection().execute(
+                f"""SELECT c.id, hits.score, c.timestamp, c.updated,
+                           (SELECT content FROM messages WHERE conversation_id = c.id AND seq = 0)
+                    FROM ({source}) AS hits
+                    JOIN conversations c ON c.id = hits.conversation_id
+                    {where}
+                    ORDER BY {order_by}
+                    LIMIT ?""",
+                params + list(after or ()) + [page_size]
+            ).fetchall()
+
+            for cid, score, timestamp, updated, preview in rows:
+                result = {
+                    "id": cid,
+                    "preview": (preview or "")[:100],
+                    "timestamp": timestamp,
+                    "updated": updated,
+                    "score": score
+                }
+                after = (updated, cid) if order == "recency" else (score, updated, cid)
+                yield after, result
+
+            if len(rows) < page_size:
+                return
+
+    def read_new_messages(self, after: Tuple = None, limit: int = 500) -> Tuple[List[Dict], Tuple]:
+        """Follow new messages by id, which only grows as messages are inserted."""
+        last = after[0] if after else 0
+        rows = self._connection().execute(
+            "SELECT id, conversation_id, seq, data FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+            (last, limit)
+        ).fetchall()
+
+        messages = []
+        for message_id, conversation_id, seq, data in rows:
+            messages.append(dict(json.loads(data), conversation_id=conversation_id, seq=seq))
+            last = message_id
+        return messages, (last,)
+
+    def read_record(self, kind: str, record_id: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT data FROM records WHERE kind = ? AND id = ?",
+                                         (kind, record_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_record(self, kind: str, record_id: str, data: Dict):
+        if kind not in RECORD_KINDS:
+            raise ValueError(f"Unknown record kind: {kind}")
+        with self.batch():
+            self._connection().execute(
+                """INSERT INTO records (kind, id, data, updated) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(kind, id) DO UPDATE SET
+                       data = excluded.data, updated = excluded.updated,
+                       version = records.version + 1""",
+                (kind, record_id, json.dumps(data), time.time())
+            )
+
+    def record_stamp(self, kind: str, record_id: str) -> Any:
+        row = self._connection().execute("SELECT version FROM records WHERE kind = ? AND id = ?",
+                                         (kind, record_id)).fetchone()
+        return row[0] if row else None
+
+    def record_ids(self, kind: str) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT id FROM records WHERE kind = ? ORDER BY id", (kind,))]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
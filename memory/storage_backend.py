@@ -0,0 +1,177 @@
+import os
+import json
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from memory.conversation_log import ConversationLog
+from memory.message_feed import MessageFeed
+from memory.search_index import SearchIndex
+from storage.file_utils import atomic_write_json, file_stamp
+
+# Record kinds stored alongside conversations
+RECORD_KINDS = ("users", "projects", "workspace")
+
+
+class MemoryBackend(ABC):
+    """Storage interface used by MemoryManager.
+
+    Conversations are stored with their messages and metadata; users,
+    projects and workspace state are opaque JSON records keyed by kind and ID.
+    ``*_stamp`` methods return a cheap change detector so cached copies can be
+    validated without reading the data itself.
+    """
+
+    name = "base"
+    # Element types of the keys read_new_messages returns, for cursor validation
+    message_cursor_types: Tuple = None
+
+    @abstractmethod
+    def read_conversation(self, conversation_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def write_conversation(self, conversation_id: str, messages: List[Dict], metadata: Dict):
+        ...
+
+    @abstractmethod
+    def conversation_stamp(self, conversation_id: str) -> Any:
+        ...
+
+    @abstractmethod
+    def conversation_ids(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def iter_search_conversations(self, query: str, order: str = "relevance",
+                                  after: Tuple = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """Yield ``(sort_key, result)`` pairs in a stable order, resuming after ``after``."""
+
+    @abstractmethod
+    def read_new_messages(self, after: Tuple = None, limit: int = 500) -> Tuple[List[Dict], Tuple]:
+        """Messages saved after cursor key ``after``, oldest first, and the key to continue from."""
+
+    def search_conversations(self, query: str, limit: int = 10, order: str = "relevance") -> List[Dict]:
+        if limit <= 0:
+            return []
+        return [result for _, result in islice(self.iter_search_conversations(query, order), limit)]
+
+    @abstractmethod
+    def read_record(self, kind: str, record_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def write_record(self, kind: str, record_id: str, data: Dict):
+        ...
+
+    @abstractmethod
+    def record_stamp(self, kind: str, record_id: str) -> Any:
+        ...
+
+    @abstractmethod
+    def record_ids(self, kind: str) -> List[str]:
+        ...
+
+    @contextmanager
+    def batch(self):
+        """Group several writes; backends with transactions commit them once."""
+        yield
+
+    def close(self):
+        pass
+
+
+class JsonFileBackend(MemoryBackend):
+    """Stores memory as a tree of JSON files under the memory directory."""
+
+    name = "json"
+    # Message feed segment number and byte offset
+    message_cursor_types = (int, int)
+
+    def __init__(self, memory_dir: str):
+        self.memory_dir = memory_dir
+        self.conversations_dir = os.path.join(memory_dir, "conversations")
+        self.index_dir = os.path.join(memory_dir, "index")
+        self.record_dirs = {kind: os.path.join(memory_dir, kind) for kind in RECORD_KINDS}
+
+        for directory in [self.memory_dir, self.conversations_dir, *self.record_dirs.values()]:
+            os.makedirs(directory, exist_ok=True)
+
+        # Conversations are stored as a snapshot plus an append-only turn log
+        self.conversation_log = ConversationLog(self.conversations_dir)
+
+        # Full-text index over conversation messages, caught up with any
+        # conversation files that changed since it was last written
+        self.search_index = SearchIndex(self.index_dir)
+        self.search_index.refresh(self.conversation_log.mtimes(), self.conversation_log.read)
+
+        # Newly saved messages, for consumers that follow new turns
+        self.message_feed = MessageFeed(os.path.join(memory_dir, "feed"))
+
+    def read_conversation(self, conversation_id: str) -> Optional[Dict]:
+        return self.conversation_log.read(conversation_id)
+
+    def write_conversation(self, conversation_id: str, messages: List[Dict], metadata: Dict):
+        start = self.conversation_log.write(conversation_id, messages, metadata)
+        self.message_feed.append(conversation_id, start, messages[start:])
+
+        # Index only the messages added since the last save
+        self.search_index.index_conversation(conversation_id, messages, metadata,
+                                             self.conversation_log.mtime(conversation_id))
+
+    def conversation_stamp(self, conversation_id: str) -> Any:
+        return self.conversation_log.stamp(conversation_id)
+
+    def conversation_ids(self) -> List[str]:
+        return sorted(self.conversation_log.mtimes())
+
+    def iter_search_conversations(self, query: str, order: str = "relevance",
+                                  after: Tuple = None) -> Iterator[Tuple[Tuple, Dict]]:
+        return self.search_index.iter_search(query, order, after)
+
+    def read_new_messages(self, after: Tuple = None, limit: int = 500) -> Tuple[List[Dict], Tuple]:
+        return self.message_feed.read(after, limit)
+
+    def _record_path(self, kind: str, record_id: str) -> str:
+        # Projects and workspace state live in a directory per record
+        if kind == "users":
+            return os.path.join(self.record_dirs[kind], f"{record_id}.json")
+        filename = "metadata.json" if kind == "projects" else "state.json"
+        return os.path.join(self.record_dirs[kind], record_id, filename)
+
+    def read_record(self, kind: str, record_id: str) -> Optional[Dict]:
+        path = self._record_path(kind, record_id)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        return None
+
+    def write_record(self, kind: str, record_id: str, data: Dict):
+        atomic_write_json(self._record_path(kind, record_id), data, indent=2)
+
+    def record_stamp(self, kind: str, record_id: str) -> Any:
+        return file_stamp(self._record_path(kind, record_id))
+
+    def record_ids(self, kind: str) -> List[str]:
+        directory = self.record_dirs[kind]
+        if kind == "users":
+            return sorted(name[:-len('.json')] for name in os.listdir(directory)
+                          if name.endswith('.json') and not name.startswith('.tmp-'))
+        return sorted(name for name in os.listdir(directory)
+                      if os.path.exists(self._record_path(kind, name)))
+
+
+def create_backend(backend: Any, memory_dir: str) -> MemoryBackend:
+    """Build a backend from a name ("json" or "sqlite") or return an instance as is."""
+    if isinstance(backend, MemoryBackend):
+        return backend
+
+    backend = backend or os.environ.get("MEMORY_BACKEND", "json")
+    if backend == "json":
+        return JsonFileBackend(memory_dir)
+    if backend == "sqlite":
+        from memory.sqlite_backend import SQLiteBackend
+        return SQLiteBackend(os.path.join(memory_dir, "memory.db"))
+
+    raise ValueError(f"Unknown memory backend: {backend}")
@@ -0,0 +1,123 @@
+"""Compare the keyword template classifier with the old substring detector.
+
+Usage: python scripts/benchmark_template_detection.py [--tasks 20000] [--repeat 3]
+                                                       [--synthetic-templates 0]
+
+Generates task descriptions from the template keywords plus filler words,
+times the old chain of substring checks, the classifier one text at a time
+and in batch, and reports how often the two pick the same template. With
+--synthetic-templates, that many extra templates of ten made-up keywords
+are added and the old approach is generalised to scan every template's
+keywords, to show how each scales with the number of templates.
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workspace.workspace_manager import WorkspaceManager
+
+FILLER = ("please help me with the new project for my team this week and make it look good "
+          "quickly before friday using whatever tools you think are best").split()
+
+
+def legacy_detect(task_description: str) -> str:
+    """The substring detector the classifier replaced."""
+    task_lower = task_description.lower()
+
+    if any(keyword in task_lower for keyword in ["code", "program", "develop", "script", "debug"]):
+        return "coding"
+    elif any(keyword in task_lower for keyword in ["write", "blog", "article", "story", "script"]):
+        return "writing"
+    elif any(keyword in task_lower for keyword in ["animate", "animation", "motion", "video"]):
+        return "animation"
+    elif any(keyword in task_lower for keyword in ["music", "song", "audio", "sound", "compose"]):
+        return "music"
+
+    return "default"
+
+
+def substring_detect(templates, task_description: str) -> str:
+    """The old approach applied to every template's keywords, in template order."""
+    task_lower = task_description.lower()
+    for template_id, keywords in templates:
+        if any(keyword in task_lower for keyword in keywords):
+            return template_id
+    return "default"
+
+
+def add_synthetic_templates(templates_dir: str, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for index in range(count):
+        keywords = {"".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(4, 9))): rng.randint(1, 3)
+                    for _ in range(10)}
+        with open(os.path.join(templates_dir, f"synthetic_{index}.json"), 'w') as f:
+            json.dump({"name": f"Synthetic {index}", "keywords": keywords}, f)
+
+
+def make_tasks(manager: WorkspaceManager, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    keywords = [keyword.rstrip('*') for template in manager.templates.values()
+                for keyword in template.get("keywords", {})]
+    tasks = []
+    for _ in range(count):
+        words = rng.choices(FILLER, k=rng.randint(6, 30))
+        for _ in range(rng.randint(0, 2)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        tasks.append(" ".join(words))
+    return tasks
+
+
+def best_of(repeat: int, fn):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--synthetic-templates", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workspace_dir:
+        manager = WorkspaceManager(workspace_dir=workspace_dir)
+        if args.synthetic_templates:
+            add_synthetic_templates(manager.templates_dir, args.synthetic_templates)
+            manager = WorkspaceManager(workspace_dir=workspace_dir)
+        tasks = make_tasks(manager, args.tasks)
+        keyword_lists = [(template_id, [keyword.rstrip('*') for keyword in template.get("keywords", {})])
+                         for template_id, template in manager.templates.items()]
+
+        timings = []
+        legacy_time, legacy = best_of(args.repeat, lambda: [legacy_detect(task) for task in tasks])
+        timings.append(("legacy substring", legacy_time))
+        if args.synthetic_templates:
+            substring_time, _ = best_of(args.repeat, lambda: [substring_detect(keyword_lists, task)
+                                                              for task in tasks])
+            timings.append(("substring, all", substring_time))
+        single_time, single = best_of(args.repeat, lambda: [manager.detect_appropriate_template(task)
+                                                            for task in tasks])
+        batch_time, batch = best_of(args.repeat, lambda: manager.detect_appropriate_templates(tasks))
+        timings += [("classifier", single_time), ("classifier batch", batch_time)]
+
+    assert single == batch
+    agreement = sum(a == b for a, b in zip(legacy, batch)) / len(tasks)
+    print(f"{len(tasks)} tasks, {len(manager.templates)} templates, "
+          f"{manager.template_classifier.keyword_count} keywords, best of {args.repeat}")
+    for name, elapsed in timings:
+        print(f"  {name:<18} {elapsed * 1000:9.1f} ms  {elapsed / len(tasks) * 1e6:7.2f} us/task")
+    print(f"  agreement with legacy: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Import the JSON memory tree into a SQLite memory database.
+
+Usage: python scripts/migrate_memory_to_sqlite.py [--memory-dir memory] [--db memory/memory.db]
+
+Safe to re-run: conversations are appended or replaced by ID and records
+are upserted, so a second run only picks up what changed.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory.storage_backend import JsonFileBackend, RECORD_KINDS
+from memory.sqlite_backend import SQLiteBackend
+
+
+def migrate(memory_dir: str, db_path: str, batch_size: int = 500):
+    source = JsonFileBackend(memory_dir)
+    target = SQLiteBackend(db_path)
+
+    counts = {}
+
+    conversation_ids = source.conversation_ids()
+    for start in range(0, len(conversation_ids), batch_size):
+        # One transaction per batch keeps the import fast without holding
+        # the write lock for the whole run
+        with target.batch():
+            for conversation_id in conversation_ids[start:start + batch_size]:
+                try:
+                    conversation = source.read_conversation(conversation_id)
+                except Exception as e:
+                    print(f"Skipping conversation {conversation_id}: {e}")
+                    continue
+                if conversation is None:
+                    continue
+                target.write_conversation(conversation_id, conversation.get("messages", []),
+                                          conversation.get("metadata", {}))
+                counts["conversations"] = counts.get("conversations", 0) + 1
+        print(f"Imported {min(start + batch_size, len(conversation_ids))}/{len(conversation_ids)} conversations")
+
+    for kind in RECORD_KINDS:
+        record_ids = source.record_ids(kind)
+        for start in range(0, len(record_ids), batch_size):
+            with target.batch():
+                for record_id in record_ids[start:start + batch_size]:
+                    try:
+                        data = source.read_record(kind, record_id)
+                    except Exception as e:
+                        print(f"Skipping {kind} record {record_id}: {e}")
+                        continue
+                    if data is not None:
+                        target.write_record(kind, record_id, data)
+                        counts[kind] = counts.get(kind, 0) + 1
+        print(f"Imported {counts.get(kind, 0)} {kind} records")
+
+    target.close()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate JSON memory files to SQLite")
+    parser.add_argument("--memory-dir", default="memory")
+    parser.add_argument("--db", default=None, help="Defaults to <memory-dir>/memory.db")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(args.memory_dir, "memory.db")
+    print(f"Migrating {args.memory_dir} into {db_path}...")
+    counts = migrate(args.memory_dir, db_path, args.batch_size)
+    print(f"Migration complete: {counts}")
+    print("Start the app with MEMORY_BACKEND=sqlite to use the new store.")
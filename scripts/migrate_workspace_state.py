@@ -0,0 +1,87 @@
+"""Merge the two old workspace trees into the shared workspace state store.
+
+Usage: python scripts/migrate_workspace_state.py [--workspace-dir workspace] [--memory-dir memory]
+                                                 [--memory-backend json|sqlite]
+
+Workspaces used to be written twice: by WorkspaceManager as
+<workspace-dir>/<id>.json and by MemoryManager as workspace records in
+memory (memory/workspace/<id>/state.json with the JSON backend). Each
+workspace now lives once, as <workspace-dir>/workspaces/<id>/layout.json
+plus state.json. This script moves the first tree into that layout and
+merges the state saved through MemoryManager on top; where both set the
+same state key, the memory value wins.
+
+Safe to re-run: old workspace files are removed once written in the new
+layout, and memory records already merged are listed in
+<workspace-dir>/workspaces/.memory-migrated.json and skipped.
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory.storage_backend import create_backend
+from storage.file_utils import atomic_write_json
+from workspace.workspace_manager import WorkspaceManager
+
+
+def migrate(workspace_dir: str, memory_dir: str, memory_backend: str = None):
+    manager = WorkspaceManager(workspace_dir=workspace_dir)
+    store = manager.state_store
+    backend = create_backend(memory_backend, memory_dir)
+
+    marker_path = os.path.join(store.records_dir, ".memory-migrated.json")
+    try:
+        with open(marker_path, 'r') as f:
+            merged = set(json.load(f))
+    except (OSError, ValueError):
+        merged = set()
+
+    counts = {"workspaces": 0, "memory_states": 0}
+
+    # WorkspaceManager files: rewriting them moves them into the new layout
+    for name in sorted(os.listdir(workspace_dir)):
+        if not name.endswith('.json') or name.startswith('.'):
+            continue
+        workspace_id = name[:-len('.json')]
+        record = manager._get_record(workspace_id)
+        if record is None:
+            print(f"Skipping workspace {workspace_id}: could not be read")
+            continue
+        store.put(workspace_id, record)
+        counts["workspaces"] += 1
+
+    # MemoryManager state, merged over whatever the workspace already has
+    for workspace_id in backend.record_ids("workspace"):
+        if workspace_id in merged:
+            continue
+        try:
+            state = backend.read_record("workspace", workspace_id)
+        except Exception as e:
+            print(f"Skipping memory workspace state {workspace_id}: {e}")
+            continue
+        if state is None:
+            continue
+        current = store.get_state(workspace_id) or {}
+        store.put_state(workspace_id, dict(current, **state))
+        merged.add(workspace_id)
+        counts["memory_states"] += 1
+
+    store.flush()
+    atomic_write_json(marker_path, sorted(merged))
+    backend.close()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge workspace files and memory workspace state")
+    parser.add_argument("--workspace-dir", default="workspace")
+    parser.add_argument("--memory-dir", default="memory")
+    parser.add_argument("--memory-backend", default=None, help="json or sqlite; defaults to MEMORY_BACKEND or json")
+    args = parser.parse_args()
+
+    print(f"Merging {args.workspace_dir} and {args.memory_dir} workspace state...")
+    counts = migrate(args.workspace_dir, args.memory_dir, args.memory_backend)
+    print(f"Migration complete: {counts}")
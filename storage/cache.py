@@ -0,0 +1,147 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+def approximate_size(obj: Any, _depth: int = 0) -> int:
+    """Estimate the memory footprint of a JSON-like object in bytes."""
+    size = sys.getsizeof(obj)
+    if _depth > 32:
+        return size
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key, _depth + 1) + approximate_size(value, _depth + 1)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += approximate_size(item, _depth + 1)
+    return size
+
+
+class BoundedCache:
+    """Thread-safe LRU cache bounded by entry count and approximate bytes.
+
+    Entries can expire after ``ttl`` seconds and can carry a ``stamp`` (for
+    example a file's mtime and size). A lookup with a different stamp treats
+    the entry as stale, so data rewritten by another worker is reloaded.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = None, sizeof: Callable[[Any], int] = approximate_size):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+
+        # key -> (value, size, stamp, stored_at)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None, stamp: Any = _MISSING) -> Any:
+        """Return a cached value, or ``default`` if missing, expired or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, entry_stamp, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            if stamp is not _MISSING and stamp != entry_stamp:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, stamp: Any = None):
+        """Store a value, evicting least recently used entries to stay in bounds."""
+        size = self.sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            # An entry larger than the whole budget is not worth caching
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, stamp, time.time())
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop a single entry."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Return size and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,118 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; locking becomes a no-op there
+    fcntl = None
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'wb', sync: bool = True):
+    """Open a temp file that replaces ``path`` only once the block succeeds.
+
+    With ``sync=False`` the data is not fsynced: readers still never see a
+    partial file, but a machine crash may lose the write.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        # mkstemp creates files owner-only; match what open() would have made
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_text(path: str, text: str, sync: bool = True):
+    """Write text to a file atomically via a temp file and rename."""
+    with atomic_open(path, 'w', sync=sync) as f:
+        f.write(text)
+
+
+def atomic_write_json(path: str, data: Any, indent: int = None, sync: bool = True):
+    """Write JSON to a file atomically via a temp file and rename."""
+    atomic_write_text(path, json.dumps(data, indent=indent), sync=sync)
+
+
+def file_stamp(*paths: str) -> Tuple:
+    """Cheap change detector for files: (mtime_ns, size) per path, None if missing."""
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def append_jsonl(path: str, records: Iterable[Dict], sync: bool = False):
+    """Append records to a JSONL file with a single write call."""
+    payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+    if not payload:
+        return
+
+    with open(path, 'ab+') as f:
+        # A crash can leave a half-written last line; start a fresh line so the
+        # torn record is skipped on read instead of corrupting this one
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                payload = "\n" + payload
+        f.write(payload.encode("utf-8"))
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+
+
+def read_jsonl(path: str, offset: int = 0) -> Tuple[List[Dict], int]:
+    """Read complete JSONL records from an offset.
+
+    Returns the records and the offset just past the last complete line, so a
+    torn trailing write is skipped now and picked up once it is finished.
+    """
+    if not os.path.exists(path):
+        return [], 0
+
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as e:
+            print(f"Skipping corrupt record in {path}: {e}")
+
+    return records, offset + end
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive inter-process lock on a lock file."""
+    with open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,82 @@
+import json
+import heapq
+import base64
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# A search result paired with the sort key its cursor is built from
+Keyed = Tuple[Tuple, Any]
+
+# Expected type of a numeric sort-key element, for decode_cursor
+NUMBER = (int, float)
+
+
+def encode_cursor(key: Sequence) -> str:
+    """Turn a sort key into an opaque, URL-safe cursor."""
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], types: Sequence = None) -> Optional[Tuple]:
+    """Turn a cursor back into a sort key; raises ValueError if it is malformed.
+
+    ``types`` gives the expected type of each key element; a cursor with
+    another number of elements or other types is rejected too, so it can
+    never reach a sort-key comparison.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(key, list):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if types is not None and (len(key) != len(types) or not all(
+            isinstance(value, expected) and not isinstance(value, bool)
+            for value, expected in zip(key, types))):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(key)
+
+
+class _Descending:
+    __slots__ = ("key", "item")
+
+    def __init__(self, key: Tuple, item: Any):
+        self.key = key
+        self.item = item
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return self.key > other.key
+
+
+def iter_sorted(results: Iterable[Keyed], after: Tuple = None, descending: bool = True) -> Iterator[Keyed]:
+    """Yield results in key order, starting strictly after the ``after`` key.
+
+    Results are heapified rather than fully sorted, so taking the first page
+    of a large result set costs O(n + k log n).
+    """
+    if descending:
+        heap = [_Descending(key, item) for key, item in results if after is None or key < after]
+        heapq.heapify(heap)
+        while heap:
+            entry = heapq.heappop(heap)
+            yield entry.key, entry.item
+    else:
+        heap = [(key, index, item) for index, (key, item) in enumerate(results)
+                if after is None or key > after]
+        heapq.heapify(heap)
+        while heap:
+            key, _, item = heapq.heappop(heap)
+            yield key, item
+
+
+def paginate(results: Iterable[Keyed], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """Take one page of keyed results; the cursor is None on the last page."""
+    if limit < 1:
+        raise ValueError("A page must hold at least one result")
+    page = list(islice(results, limit + 1))
+    if len(page) > limit:
+        return [item for _, item in page[:limit]], encode_cursor(page[limit - 1][0])
+    return [item for _, item in page], None
@@ -0,0 +1,160 @@
+import time
+import atexit
+import threading
+from contextlib import ExitStack
+from typing import Any, Callable, ContextManager, Dict, Hashable, List, Optional, Tuple
+
+
+class WriteBehind:
+    """Persists dirty objects on a single background thread.
+
+    Managers mark a key dirty together with the function that writes it.
+    Writes to a key that is already waiting are coalesced: only the latest
+    function runs, at most ``delay`` seconds after the key first became
+    dirty, so a burst of updates to one object costs one write. Until the
+    write lands, ``pending(key)`` returns the latest value so readers never
+    see storage that lags behind memory.
+
+    Writes that share a ``batch`` context factory (for example a database
+    transaction) run inside one instance of it per pass.
+    """
+
+    def __init__(self, name: str = "write-behind", delay: float = 0.05):
+        self.name = name
+        self.delay = delay
+
+        # key -> (write, value, due, batch)
+        self._dirty: Dict[Hashable, Tuple] = {}
+        self._in_flight: Dict[Hashable, Any] = {}
+        self._flush_requested = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def _ensure_thread(self):
+        # Started lazily so importing a manager never spawns threads
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def submit(self, key: Hashable, write: Callable[[], Any], value: Any = None,
+               batch: Callable[[], ContextManager] = None, delay: float = None):
+        """Mark ``key`` dirty; ``write`` persists its latest ``value``.
+
+        ``delay`` overrides the writer's default for keys updated so often
+        that a longer window saves many writes.
+        """
+        with self._cond:
+            if key in self._dirty:
+                due = self._dirty[key][2]
+                self.coalesced += 1
+            else:
+                due = time.monotonic() + (self.delay if delay is None else delay)
+            self._dirty[key] = (write, value, due, batch)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def pending(self, key: Hashable) -> Any:
+        """Return the latest value not yet persisted for ``key``, if any."""
+        with self._cond:
+            if key in self._dirty:
+                return self._dirty[key][1]
+            return self._in_flight.get(key)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Write everything that is dirty now and wait for it to land."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._dirty and not self._in_flight:
+                return True
+            self._flush_requested += 1
+            self._cond.notify_all()
+            try:
+                while self._dirty or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flush_requested -= 1
+
+    def _take_due(self) -> List[Tuple]:
+        """Pop every write that is due (lock held)."""
+        now = time.monotonic()
+        due = []
+        for key, (write, value, due_at, batch) in list(self._dirty.items()):
+            if due_at > now and not self._flush_requested:
+                continue
+            del self._dirty[key]
+            self._in_flight[key] = value
+            due.append((key, write, batch))
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._dirty:
+                        due = self._take_due()
+                        if due:
+                            break
+                        first_due = min(entry[2] for entry in self._dirty.values())
+                        self._cond.wait(max(first_due - time.monotonic(), 0))
+                    else:
+                        self._cond.wait()
+
+            # Group writes sharing a batch context so they commit together
+            groups: Dict[Any, List[Tuple]] = {}
+            for item in due:
+                groups.setdefault(item[2], []).append(item)
+
+            for batch, items in groups.items():
+                try:
+                    with ExitStack() as stack:
+                        if batch is not None:
+                            stack.enter_context(batch())
+                        for key, write, _ in items:
+                            try:
+                                write()
+                                self.writes += 1
+                            except Exception as e:
+                                self.errors += 1
+                                print(f"Error in write-behind for {key}: {e}")
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error committing write-behind batch: {e}")
+
+            with self._cond:
+                for key, _, _ in due:
+                    self._in_flight.pop(key, None)
+                self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        """Return write and coalescing counters."""
+        with self._cond:
+            return {
+                "dirty": len(self._dirty),
+                "in_flight": len(self._in_flight),
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "delay": self.delay
+            }
+
+
+_default_writer: Optional[WriteBehind] = None
+_default_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteBehind:
+    """Return the process-wide write-behind queue shared by all managers."""
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = WriteBehind()
+        return _default_writer
@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.pagination import NUMBER, decode_cursor, encode_cursor, iter_sorted, paginate
+
+
+def keyed(count):
+    return [((index, f"id{index}"), f"item{index}") for index in range(count)]
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        key = (0.5, 1712345678.25, "conversation-1")
+        self.assertEqual(decode_cursor(encode_cursor(key), (NUMBER, NUMBER, str)), key)
+
+    def test_empty_cursor_is_no_cursor(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor("", (str, str)))
+
+    def test_malformed_cursor(self):
+        for cursor in ("not base64!", encode_cursor(("a",))[:-2] + "!!", "eyJhIjoxfQ"):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_wrong_arity(self):
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor(("videos",)), (str, str))
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor(("videos", "a", "b")), (str, str))
+
+    def test_wrong_types(self):
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor((1, "a")), (str, str))
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor(("1", "a")), (NUMBER, str))
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor((True, "a")), (NUMBER, str))
+
+    def test_unchecked_shape(self):
+        self.assertEqual(decode_cursor(encode_cursor((1, "a", None))), (1, "a", None))
+
+
+class PaginateTest(unittest.TestCase):
+    def test_pages_cover_every_result_once(self):
+        results = keyed(7)
+        seen = []
+        after = None
+        while True:
+            page, cursor = paginate(iter_sorted(results, decode_cursor(after), descending=False), 3)
+            seen.extend(page)
+            if cursor is None:
+                break
+            after = cursor
+        self.assertEqual(seen, [item for _, item in results])
+
+    def test_last_page_has_no_cursor(self):
+        page, cursor = paginate(iter(keyed(3)), 3)
+        self.assertEqual(len(page), 3)
+        self.assertIsNone(cursor)
+
+    def test_cursor_is_last_key_of_page(self):
+        _, cursor = paginate(iter(keyed(5)), 2)
+        self.assertEqual(decode_cursor(cursor), (1, "id1"))
+
+    def test_limit_below_one(self):
+        for limit in (0, -1):
+            with self.assertRaises(ValueError):
+                paginate(iter(keyed(3)), limit)
+
+    def test_descending_resume(self):
+        results = keyed(5)
+        page, cursor = paginate(iter_sorted(results), 2)
+        self.assertEqual(page, ["item4", "item3"])
+        page, _ = paginate(iter_sorted(results, decode_cursor(cursor)), 2)
+        self.assertEqual(page, ["item2", "item1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
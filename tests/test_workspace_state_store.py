@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workspace.state_store import WorkspaceStateStore
+from workspace.workspace_manager import WorkspaceManager
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace_dir, ignore_errors=True)
+
+    def store(self, write_delay=0.2):
+        # A separate instance per worker process; get_state_store would share one
+        return WorkspaceStateStore(self.workspace_dir, write_delay=write_delay)
+
+    def test_queued_write_is_visible_to_another_store(self):
+        first, second = self.store(write_delay=60), self.store()
+        first.put_state("ws", {"step": 1})
+        first.put_state("ws", {"step": 2})
+
+        with second.locked("ws"):
+            record = second.get("ws")
+        self.assertEqual(record["revision"], 2)
+        self.assertEqual(record["state"], {"step": 2})
+        first.flush()
+
+    def test_conflicting_expected_revision_across_stores(self):
+        first = WorkspaceManager(self.workspace_dir)
+        second = WorkspaceManager(self.workspace_dir)
+        second.state_store = self.store()
+        revision = first.create_workspace("ws")["workspace"]["revision"]
+
+        operations = [{"op": "add", "path": "/state/step", "value": 1}]
+        result = first.patch_workspace("ws", operations, expected_revision=revision)
+        self.assertEqual(result["status"], "success")
+
+        # The second worker still holds the old revision
+        result = second.patch_workspace("ws", [{"op": "add", "path": "/state/step", "value": 2}],
+                                        expected_revision=revision)
+        self.assertEqual(result["error"], "conflict")
+        self.assertEqual(result["revision"], revision + 1)
+        first.flush()
+
+    def test_burst_is_coalesced(self):
+        store = self.store()
+        store.put("ws", {"template": "default", "state": {}})
+        store.flush()
+
+        writes = store.writer.writes
+        for step in range(50):
+            store.put_state("ws", {"step": step})
+        self.assertTrue(store.flush(timeout=10))
+        self.assertLessEqual(store.writer.writes - writes, 2)
+
+        with open(os.path.join(store.records_dir, "ws", "state.json")) as f:
+            self.assertEqual(json.load(f), {"state": {"step": 49}, "revision": 51})
+
+    def test_manager_updates_are_written_behind(self):
+        manager = WorkspaceManager(self.workspace_dir)
+        manager.create_workspace("ws")
+        manager.flush()
+
+        writes = manager.state_store.writer.writes
+        for step in range(20):
+            manager.update_workspace("ws", {"state": {"step": step}})
+        self.assertEqual(manager.get_workspace("ws")["state"], {"step": 19})
+        self.assertTrue(manager.flush(timeout=10))
+        self.assertLessEqual(manager.state_store.writer.writes - writes, 2)
+
+    def test_durable_files_are_read_without_pending(self):
+        store = self.store()
+        store.put("ws", {"template": "default", "state": {"step": 1}})
+        store.flush()
+        os.remove(os.path.join(store.records_dir, "ws", "pending.json"))
+
+        record = self.store().get("ws")
+        self.assertEqual((record["template"], record["state"], record["revision"]), ("default", {"step": 1}, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
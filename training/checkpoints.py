@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from storage.file_utils import atomic_open
+from training.models import TextClassifier
+
+CHECKPOINT_PATTERN = re.compile(r"^ckpt-(\d+)\.npz$")
+
+
+class Checkpoint:
+    """A model, its optimizer state and the metadata needed to continue training."""
+
+    def __init__(self, model: TextClassifier, meta: Dict):
+        self.model = model
+        self.meta = meta
+
+
+class CheckpointStore:
+    """Rolling training checkpoints for one job, written atomically.
+
+    Each checkpoint is an ``.npz`` holding the weights, the SGD velocity and
+    a JSON metadata entry (stage, epoch, batch cursor, RNG state, ...). Only
+    the newest ``keep`` rolling checkpoints are kept. ``good.npz`` holds the
+    last checkpoint marked good, for warm starts.
+    """
+
+    def __init__(self, checkpoint_dir: str, keep: int = 2):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+
+    def _paths(self) -> List[str]:
+        if not os.path.isdir(self.checkpoint_dir):
+            return []
+        numbered = []
+        for name in os.listdir(self.checkpoint_dir):
+            match = CHECKPOINT_PATTERN.match(name)
+            if match:
+                numbered.append((int(match.group(1)), os.path.join(self.checkpoint_dir, name)))
+        return [path for _, path in sorted(numbered, reverse=True)]
+
+    @staticmethod
+    def _write(path: str, model: TextClassifier, meta: Dict):
+        arrays = {f"param/{name}": value for name, value in model.params.items()}
+        arrays.update({f"velocity/{name}": value for name, value in model.optimizer_state().items()})
+        meta = dict(meta, model=model.config())
+        with atomic_open(path, 'wb') as f:
+            np.savez(f, __meta__=np.array(json.dumps(meta)), **arrays)
+
+    @staticmethod
+    def _read(path: str) -> Checkpoint:
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(str(archive["__meta__"]))
+            params = {name[len("param/"):]: archive[name] for name in archive.files if name.startswith("param/")}
+            velocity = {name[len("velocity/"):]: archive[name] for name in archive.files
+                        if name.startswith("velocity/")}
+
+        model = TextClassifier.from_config(meta["model"])
+        model.params = params
+        model.set_optimizer_state(velocity)
+        return Checkpoint(model, meta)
+
+    def save(self, model: TextClassifier, meta: Dict, good: bool = False):
+        """Write a new rolling checkpoint, and the good one if ``good``."""
+        paths = self._paths()
+        number = int(CHECKPOINT_PATTERN.match(os.path.basename(paths[0])).group(1)) + 1 if paths else 1
+        self._write(os.path.join(self.checkpoint_dir, f"ckpt-{number:06d}.npz"), model, meta)
+        if good:
+            self._write(os.path.join(self.checkpoint_dir, "good.npz"), model, meta)
+
+        for path in self._paths()[self.keep:]:
+            os.remove(path)
+
+    def latest(self) -> Optional[Checkpoint]:
+        """Load the newest readable rolling checkpoint."""
+        for path in self._paths():
+            try:
+                return self._read(path)
+            except Exception as e:
+                print(f"Skipping unreadable checkpoint {path}: {e}")
+        return None
+
+    def good(self) -> Optional[Checkpoint]:
+        """Load the last checkpoint marked good."""
+        path = os.path.join(self.checkpoint_dir, "good.npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            return self._read(path)
+        except Exception as e:
+            print(f"Skipping unreadable checkpoint {path}: {e}")
+            return None
+
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
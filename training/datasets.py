@@ -0,0 +1,320 @@
+import os
+import csv
+import json
+import time
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from storage.file_utils import atomic_write_json
+from training.features import HashingVectorizer, SparseRows
+
+DATA_EXTENSIONS = ('.jsonl', '.json', '.csv', '.tsv')
+
+# Featurised caches live in this directory next to the dataset
+CACHE_DIR = ".featurized"
+# Bump when the cache layout changes so old caches are not reused
+CACHE_FORMAT = 1
+
+
+def _example(record: Dict, source: str) -> Tuple[str, str]:
+    text = record.get("text", record.get("content"))
+    label = record.get("label", record.get("category"))
+    if text is None or label is None:
+        raise ValueError(f"Record in {source} needs 'text' and 'label' fields")
+    return str(text), str(label)
+
+
+def _iter_file(path: str) -> Iterator[Tuple[str, str]]:
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield _example(json.loads(line), path)
+    elif ext == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if isinstance(records, dict):
+            records = records.get("examples", records.get("data", []))
+        for record in records:
+            yield _example(record, path)
+    elif ext in ('.csv', '.tsv'):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for record in csv.DictReader(f, delimiter='\t' if ext == '.tsv' else ','):
+                yield _example(record, path)
+
+
+def iter_examples(dataset_path: str) -> Iterator[Tuple[str, str]]:
+    """Yield ``(text, label)`` pairs from a dataset file or directory, streaming.
+
+    A dataset is a JSONL/JSON/CSV/TSV file of records with ``text`` and
+    ``label`` fields, or a directory of such files. Inside a directory, each
+    subdirectory of ``.txt`` files is also read as one class named after it.
+    JSONL and CSV are read line by line; a JSON file is parsed whole.
+    """
+    for path in dataset_files(dataset_path):
+        if path.endswith('.txt'):
+            with open(path, 'r', encoding='utf-8') as f:
+                yield f.read(), os.path.basename(os.path.dirname(path))
+        else:
+            yield from _iter_file(path)
+
+
+def dataset_files(dataset_path: str) -> List[str]:
+    """List the files that make up a dataset, in the order they are read."""
+    if os.path.isfile(dataset_path):
+        return [dataset_path]
+    if not os.path.isdir(dataset_path):
+        raise FileNotFoundError(f"Dataset not found: {dataset_path}")
+
+    files = []
+    for name in sorted(os.listdir(dataset_path)):
+        path = os.path.join(dataset_path, name)
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                         if file_name.endswith('.txt'))
+        elif name.lower().endswith(DATA_EXTENSIONS):
+            files.append(path)
+    return files
+
+
+def content_hash(dataset_path: str, extra: Dict = None) -> str:
+    """SHA-256 over the dataset's file names and contents, plus ``extra`` settings."""
+    digest = hashlib.sha256(json.dumps([CACHE_FORMAT, extra or {}], sort_keys=True).encode("utf-8"))
+    root = dataset_path if os.path.isdir(dataset_path) else os.path.dirname(dataset_path)
+    for path in dataset_files(dataset_path):
+        digest.update(os.path.relpath(path, root).encode("utf-8") + b"\0")
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def iter_chunks(examples: Iterable[Tuple[str, str]], chunk_size: int) -> Iterator[List[Tuple[str, str]]]:
+    chunk = []
+    for example in examples:
+        chunk.append(example)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prefetch(iterable: Iterable, depth: int = 2) -> Iterator:
+    """Produce items from ``iterable`` on a background thread, ``depth`` ahead.
+
+    Lets the next mini-batch be read and densified while the current one
+    trains. Errors in the producer are re-raised in the consumer, and
+    abandoning the iterator stops the producer.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((None, item)):
+                    return
+            put((None, done))
+        except BaseException as e:
+            put((e, None))
+
+    thread = threading.Thread(target=produce, name="dataset-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            error, item = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+class FeaturizedDataset:
+    """A dataset featurised once and memory-mapped for training.
+
+    The first time a dataset is opened with given vectorizer settings, its
+    examples are streamed in chunks through the vectorizer and the sparse
+    features and labels are written as flat binary arrays under
+    ``.featurized/<content hash>/`` next to the dataset. Later runs over the
+    same content reuse them; nothing but the batch being trained on and
+    one row index per example is held in memory.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+
+        rows, values = self.meta["rows"], self.meta["values"]
+        self.classes: List[str] = self.meta["classes"]
+        self.labels = self._map("labels", np.int32, rows)
+        self.features = SparseRows(
+            self._map("indptr", np.int64, rows + 1),
+            self._map("indices", np.int32, values),
+            self._map("data", np.float32, values),
+            self.meta["vectorizer"]["n_features"]
+        )
+
+    def _map(self, name: str, dtype, length: int) -> np.ndarray:
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.cache_dir, f"{name}.bin"), dtype=dtype, mode='r', shape=(length,))
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    @classmethod
+    def open(cls, dataset_path: str, vectorizer: HashingVectorizer, chunk_size: int = 10000,
+             on_progress: Callable[[int], None] = None) -> "FeaturizedDataset":
+        """Open the featurised cache for a dataset, building it if needed."""
+        key = content_hash(dataset_path, vectorizer.config())
+        cache_root = os.path.join(os.path.dirname(os.path.abspath(dataset_path)), CACHE_DIR)
+        cache_dir = os.path.join(cache_root, key)
+
+        if not os.path.exists(os.path.join(cache_dir, "meta.json")):
+            cls._build(dataset_path, vectorizer, cache_root, key, chunk_size, on_progress)
+        return cls(cache_dir)
+
+    @staticmethod
+    def _build(dataset_path: str, vectorizer: HashingVectorizer, cache_root: str, key: str,
+               chunk_size: int, on_progress: Callable[[int], None] = None):
+        os.makedirs(cache_root, exist_ok=True)
+        # Build in a scratch directory so readers never see a half-written cache
+        build_dir = tempfile.mkdtemp(dir=cache_root, prefix=".tmp-")
+        try:
+            class_ids: Dict[str, int] = {}
+            rows = values = 0
+
+            with open(os.path.join(build_dir, "indptr.bin"), 'wb') as indptr_file, \
+                    open(os.path.join(build_dir, "indices.bin"), 'wb') as indices_file, \
+                    open(os.path.join(build_dir, "data.bin"), 'wb') as data_file, \
+                    open(os.path.join(build_dir, "labels.bin"), 'wb') as labels_file:
+                indptr_file.write(np.zeros(1, dtype=np.int64).tobytes())
+
+                for chunk in iter_chunks(iter_examples(dataset_path), chunk_size):
+                    features = vectorizer.transform(text for text, _ in chunk)
+                    labels = np.array([class_ids.setdefault(label, len(class_ids)) for _, label in chunk],
+                                      dtype=np.int32)
+
+                    indptr_file.write((features.indptr[1:] + values).astype(np.int64).tobytes())
+                    indices_file.write(features.indices.astype(np.int32).tobytes())
+                    data_file.write(features.data.astype(np.float32).tobytes())
+                    labels_file.write(labels.tobytes())
+
+                    rows += len(chunk)
+                    values += len(features.indices)
+                    if on_progress:
+                        on_progress(rows)
+
+            if rows == 0:
+                raise ValueError(f"Dataset is empty: {dataset_path}")
+
+            # Renumber labels so class IDs follow sorted class names
+            classes = sorted(class_ids)
+            remap = np.empty(len(classes), dtype=np.int32)
+            for new_id, label in enumerate(classes):
+                remap[class_ids[label]] = new_id
+            labels = np.memmap(os.path.join(build_dir, "labels.bin"), dtype=np.int32, mode='r+', shape=(rows,))
+            for start in range(0, rows, chunk_size):
+                labels[start:start + chunk_size] = remap[labels[start:start + chunk_size]]
+            labels.flush()
+            del labels
+
+            atomic_write_json(os.path.join(build_dir, "meta.json"), {
+                "dataset_path": os.path.abspath(dataset_path),
+                "content_hash": key,
+                "rows": rows,
+                "values": values,
+                "classes": classes,
+                "vectorizer": vectorizer.config(),
+                "created": time.time()
+            })
+
+            # mkdtemp creates directories owner-only; match what makedirs would have made
+            os.chmod(build_dir, 0o755)
+            try:
+                os.rename(build_dir, os.path.join(cache_root, key))
+            except OSError:
+                # Another run finished building the same cache first
+                shutil.rmtree(build_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+        FeaturizedDataset._remove_stale(cache_root, dataset_path, vectorizer.config(), key)
+
+    @staticmethod
+    def _remove_stale(cache_root: str, dataset_path: str, vectorizer_config: Dict, key: str):
+        """Drop caches of earlier contents of this dataset built with the same vectorizer.
+
+        Caches with other vectorizer settings may be in use by jobs running
+        in parallel, so they are left alone.
+        """
+        dataset_path = os.path.abspath(dataset_path)
+        for name in os.listdir(cache_root):
+            if name == key or name.startswith(".tmp-"):
+                continue
+            try:
+                with open(os.path.join(cache_root, name, "meta.json"), 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (meta.get("dataset_path") == dataset_path and meta.get("vectorizer") == vectorizer_config
+                    and meta.get("content_hash") != key):
+                shutil.rmtree(os.path.join(cache_root, name), ignore_errors=True)
+
+    def split(self, validation_split: float, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """Randomly split row indices into sorted training and held-out sets."""
+        order = rng.permutation(len(self))
+        holdout_size = int(len(self) * validation_split)
+        return np.sort(order[holdout_size:]), np.sort(order[:holdout_size])
+
+    def _batches(self, rows: np.ndarray, batch_size: int, rng: np.random.Generator = None,
+                 start_batch: int = 0, block_batches: int = 64) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        if rng is not None:
+            # Shuffle contiguous blocks, then rows within a block, so reads stay
+            # mostly sequential on disk while batches still mix the whole dataset
+            block_size = batch_size * block_batches
+            blocks = [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+            rows = np.concatenate([rng.permutation(blocks[i]) for i in rng.permutation(len(blocks))]) \
+                if blocks else rows
+
+        for start in range(start_batch * batch_size, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            yield self.features.take(batch), np.asarray(self.labels[batch], dtype=np.int64)
+
+    def iter_batches(self, rows: np.ndarray, batch_size: int, rng: np.random.Generator = None,
+                     start_batch: int = 0, prefetch_depth: int = 2) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield dense ``(X, y)`` mini-batches over ``rows``, prefetched in the background.
+
+        With ``rng`` the order is shuffled; without it rows are read in order.
+        ``start_batch`` skips that many batches of the order, which is how an
+        interrupted epoch resumes with the same RNG state.
+        """
+        batches = self._batches(rows, batch_size, rng, start_batch)
+        if prefetch_depth <= 0:
+            return batches
+        return prefetch(batches, prefetch_depth)
@@ -0,0 +1,62 @@
+import json
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# (event id, event type, JSON payload)
+Event = Tuple[int, str, str]
+
+
+class EventBus:
+    """Publishes events to any number of watchers through one shared buffer.
+
+    Events get increasing IDs and are serialised once when published. The
+    last ``replay_size`` events are kept so a watcher that reconnects with
+    the ID it saw last receives exactly what it missed. Watchers share one
+    condition variable instead of owning a queue each, so an idle watcher
+    costs a sleeping thread and an integer.
+    """
+
+    def __init__(self, replay_size: int = 1000):
+        self._events: deque = deque(maxlen=replay_size)
+        self._last_id = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event: str, data: Dict) -> int:
+        payload = json.dumps(data, separators=(",", ":"))
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, event, payload))
+            self._cond.notify_all()
+            return self._last_id
+
+    def last_id(self) -> int:
+        with self._cond:
+            return self._last_id
+
+    def _since(self, last_id: int) -> Optional[List[Event]]:
+        if last_id > self._last_id:
+            # An ID from before a restart
+            return None
+        if last_id == self._last_id:
+            return []
+        oldest = self._events[0][0] if self._events else self._last_id + 1
+        if last_id + 1 < oldest:
+            # The watcher missed events that are no longer buffered
+            return None
+        return [event for event in self._events if event[0] > last_id]
+
+    def since(self, last_id: int) -> Optional[List[Event]]:
+        """Events after ``last_id``; None if some have already been dropped."""
+        with self._cond:
+            return self._since(last_id)
+
+    def wait(self, last_id: int, timeout: float = None) -> Optional[List[Event]]:
+        """Like ``since``, but blocks up to ``timeout`` seconds for a new event."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._last_id != last_id, timeout)
+            return self._since(last_id)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {"last_id": self._last_id, "buffered": len(self._events), "replay_size": self._events.maxlen}
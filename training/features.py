@@ -0,0 +1,100 @@
+import zlib
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from storage.text import tokenize
+
+
+class SparseRows:
+    """Feature rows in CSR form, densified one mini-batch at a time.
+
+    Hashed text features are mostly zeros, so keeping the whole dataset
+    dense would cost ``rows * n_features`` floats; only the batch being
+    trained on is expanded.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, n_features: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_features = n_features
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def _positions(self, rows: np.ndarray):
+        """Per-row value counts and the positions of every stored value of ``rows``."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return lengths, offsets + np.arange(int(lengths.sum()))
+
+    def take(self, rows: Sequence[int]) -> np.ndarray:
+        """Return the given rows as a dense float32 matrix."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths, positions = self._positions(rows)
+
+        dense = np.zeros((len(rows), self.n_features), dtype=np.float32)
+        dense[np.repeat(np.arange(len(rows)), lengths), self.indices[positions]] = self.data[positions]
+        return dense
+
+
+class HashingVectorizer:
+    """Turns text into L2-normalised, log-scaled hashed n-gram counts.
+
+    Hashing needs no fitted vocabulary, so the same settings always map a
+    text to the same features; they are saved with the model weights.
+    CRC32 is used instead of ``hash()``, which is salted per process.
+    """
+
+    def __init__(self, n_features: int = 2 ** 14, ngram_range: Sequence[int] = (1, 2)):
+        self.n_features = int(n_features)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self._buckets: Dict[str, int] = {}
+
+    def config(self) -> Dict:
+        return {"n_features": self.n_features, "ngram_range": list(self.ngram_range)}
+
+    def _bucket(self, term: str) -> int:
+        bucket = self._buckets.get(term)
+        if bucket is None:
+            bucket = zlib.crc32(term.encode("utf-8")) % self.n_features
+            if len(self._buckets) < 1_000_000:
+                self._buckets[term] = bucket
+        return bucket
+
+    def _terms(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        low, high = self.ngram_range
+        terms = []
+        for n in range(low, high + 1):
+            if n == 1:
+                terms.extend(tokens)
+            else:
+                terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def transform(self, texts: Iterable[str]) -> SparseRows:
+        indptr = [0]
+        indices: List[np.ndarray] = []
+        data: List[np.ndarray] = []
+
+        for text in texts:
+            buckets = np.fromiter((self._bucket(term) for term in self._terms(text)), dtype=np.int64)
+            columns, counts = np.unique(buckets, return_counts=True)
+            values = np.log1p(counts).astype(np.float32)
+            norm = np.linalg.norm(values)
+            if norm > 0:
+                values /= norm
+
+            indices.append(columns.astype(np.int32))
+            data.append(values)
+            indptr.append(indptr[-1] + len(columns))
+
+        return SparseRows(
+            np.asarray(indptr, dtype=np.int64),
+            np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+            np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+            self.n_features
+        )
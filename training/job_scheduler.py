@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import queue
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional
+
+from storage.file_utils import atomic_write_json, file_lock
+from storage.write_behind import get_writer
+
+# Jobs in these states will not change again
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it notices it has been cancelled."""
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _worker_main(target: Callable, job_id: str, payload: Dict, events, cancel_event):
+    """Entry point of a worker process: run one job and report back."""
+    def report(update: Dict):
+        events.put(("progress", job_id, update))
+
+    try:
+        result = target(payload, report, cancel_event.is_set)
+        events.put(("finished", job_id, {"status": "completed", "result": result}))
+    except JobCancelled:
+        events.put(("finished", job_id, {"status": "cancelled"}))
+    except Exception as e:
+        events.put(("finished", job_id, {"status": "failed", "error": str(e)}))
+
+
+class JobScheduler:
+    """Persistent priority queue of jobs, run in up to ``max_workers`` processes.
+
+    Each job runs ``target(payload, report, should_stop)`` in its own worker
+    process, so several jobs train in parallel without sharing the GIL; the
+    payload passed in also carries the ``job_id``.
+    ``report`` sends progress updates back to this process and
+    ``should_stop`` turns true once the job is cancelled; a worker that does
+    not stop within ``cancel_grace`` seconds is terminated.
+
+    Every job is saved as ``<jobs_dir>/<id>.json`` through the write-behind
+    queue, so frequent progress updates coalesce. After a restart, jobs that
+    were queued or running and whose owning process is gone are queued
+    again, highest priority first.
+    """
+
+    def __init__(self, jobs_dir: str, target: Callable[[Dict, Callable, Callable], Any],
+                 max_workers: int = 1, start_method: str = "spawn",
+                 on_update: Callable[[Dict], None] = None,
+                 cancel_grace: float = 10.0, keep_finished: int = 200):
+        self.jobs_dir = jobs_dir
+        self.target = target
+        self.max_workers = max(1, int(max_workers))
+        self.on_update = on_update
+        self.cancel_grace = cancel_grace
+        self.keep_finished = keep_finished
+
+        self.jobs: Dict[str, Dict] = {}
+        # Heap of (-priority, submission order, job id); cancelled entries are skipped
+        self._queue: List = []
+        self._order = 0
+        # job id -> (process, cancel event, time cancellation was requested)
+        self._running: Dict[str, List] = {}
+        # (process, time to terminate it) for workers whose job has finished
+        # but which may not have exited yet; reaped by the monitor thread
+        self._exiting: List = []
+
+        self._lock = threading.RLock()
+        self._context = multiprocessing.get_context(start_method)
+        self._events = None
+        self._thread: Optional[threading.Thread] = None
+        self.writer = get_writer()
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._recover()
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Dict):
+        snapshot = json.loads(json.dumps(job))
+        path = self._job_path(job["id"])
+        self.writer.submit((self.jobs_dir, job["id"]), lambda: atomic_write_json(path, snapshot, indent=2), snapshot)
+
+    def _recover(self):
+        """Load saved jobs and requeue unfinished ones whose owner has exited."""
+        # Worker processes importing the app must never pick up jobs themselves
+        if multiprocessing.parent_process() is not None:
+            return
+
+        with file_lock(os.path.join(self.jobs_dir, ".lock")):
+            jobs = []
+            for name in os.listdir(self.jobs_dir):
+                if not name.endswith('.json') or name.startswith('.tmp-'):
+                    continue
+                try:
+                    with open(os.path.join(self.jobs_dir, name), 'r') as f:
+                        jobs.append(json.load(f))
+                except Exception as e:
+                    print(f"Error loading training job {name}: {e}")
+
+            jobs.sort(key=lambda job: job["created"])
+            finished = [job for job in jobs if job["status"] in FINISHED_STATES]
+            cut = max(0, len(finished) - self.keep_finished)
+            for job in finished[:cut]:
+                os.remove(self._job_path(job["id"]))
+            jobs = finished[cut:] + [job for job in jobs if job["status"] not in FINISHED_STATES]
+
+            with self._lock:
+                for job in jobs:
+                    if job["status"] not in FINISHED_STATES:
+                        if job.get("owner") != os.getpid() and _pid_alive(job.get("owner")):
+                            # Another live worker process owns this job
+                            continue
+                        job.update(status="queued", owner=os.getpid(), recovered=True)
+                        self._push(job)
+                        atomic_write_json(self._job_path(job["id"]), job, indent=2)
+                    self.jobs[job["id"]] = job
+
+                if self._queue:
+                    self._dispatch()
+
+    def _push(self, job: Dict):
+        self._order += 1
+        heapq.heappush(self._queue, (-job["priority"], self._order, job["id"]))
+
+    def submit(self, payload: Dict, priority: int = 0) -> Dict:
+        """Queue a job and start it as soon as a worker is free."""
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "status": "queued",
+            "priority": int(priority),
+            "payload": payload,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "progress": {},
+            "owner": os.getpid()
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+            self._push(job)
+            self._save(job)
+            self._dispatch()
+            return dict(job)
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued job at once, or ask a running job to stop."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                self._finish(job, {"status": "cancelled"})
+            elif job["status"] == "running" and job_id in self._running:
+                entry = self._running[job_id]
+                entry[1].set()
+                entry[2] = entry[2] or time.monotonic()
+                job["cancel_requested"] = True
+                self._save(job)
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, status: str = None) -> List[Dict]:
+        """Return jobs, newest first, optionally only those in one state."""
+        with self._lock:
+            jobs = [dict(job) for job in self.jobs.values() if status is None or job["status"] == status]
+        return sorted(jobs, key=lambda job: job["created"], reverse=True)
+
+    def running(self) -> List[str]:
+        with self._lock:
+            return list(self._running)
+
+    def _dispatch(self):
+        """Start queued jobs while worker slots are free (lock held)."""
+        while self._queue and len(self._running) < self.max_workers:
+            _, _, job_id = heapq.heappop(self._queue)
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                continue
+
+            if self._events is None:
+                self._events = self._context.Queue()
+            cancel_event = self._context.Event()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self.target, job_id, dict(job["payload"], job_id=job_id), self._events, cancel_event),
+                name=f"training-job-{job_id}",
+                daemon=True
+            )
+            process.start()
+
+            self._running[job_id] = [process, cancel_event, None]
+            job.update(status="running", started=time.time(), pid=process.pid)
+            self._save(job)
+            self._notify(job)
+
+        if (self._running or self._exiting) and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._monitor, name="job-scheduler", daemon=True)
+            self._thread.start()
+
+    def _finish(self, job: Dict, outcome: Dict):
+        """Record a job's final state (lock held)."""
+        job.update(outcome)
+        job["finished"] = time.time()
+        entry = self._running.pop(job["id"], None)
+        if entry is not None:
+            # It exits right after its final report; the monitor reaps it
+            # without holding the lock
+            self._exiting.append((entry[0], time.monotonic() + self.cancel_grace))
+        self._save(job)
+        self._notify(job)
+
+        # Forget the oldest finished jobs beyond the retention limit
+        finished = [j for j in self.jobs.values() if j["status"] in FINISHED_STATES]
+        for old in sorted(finished, key=lambda j: j["created"])[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[old["id"]]
+            try:
+                os.remove(self._job_path(old["id"]))
+            except OSError:
+                pass
+
+    def _notify(self, job: Dict):
+        if self.on_update:
+            try:
+                self.on_update(dict(job))
+            except Exception as e:
+                print(f"Error in job update callback: {e}")
+
+    def _handle(self, kind: str, job_id: str, data: Dict):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] in FINISHED_STATES:
+                return
+            if kind == "progress":
+                job["progress"] = data
+                self._save(job)
+                self._notify(job)
+            elif kind == "finished":
+                self._finish(job, data)
+
+    def _monitor(self):
+        """Collect worker reports, reap exited workers and enforce cancellation."""
+        while True:
+            # Wait briefly for a report, then take whatever else has arrived;
+            # reaping and dispatching below must run on every pass, however
+            # busy the workers keep the queue
+            events = []
+            try:
+                events.append(self._events.get(timeout=0.2))
+                while True:
+                    events.append(self._events.get_nowait())
+            except queue.Empty:
+                pass
+            for kind, job_id, data in events:
+                self._handle(kind, job_id, data)
+            self._reap()
+
+            with self._lock:
+                for job_id, (process, _, cancel_requested) in list(self._running.items()):
+                    if not process.is_alive():
+                        process.join()
+                        self._running.pop(job_id)
+                        # A worker that exits without reporting has crashed
+                        self._pending_exit(job_id, process.exitcode)
+                    elif cancel_requested and time.monotonic() - cancel_requested > self.cancel_grace:
+                        process.terminate()
+
+                self._dispatch()
+                if not self._running and not self._queue and not self._exiting:
+                    self._thread = None
+                    return
+
+    def _reap(self):
+        """Join finished jobs' workers, terminating any still alive after ``cancel_grace``."""
+        with self._lock:
+            exiting, self._exiting = self._exiting, []
+
+        lingering = []
+        for process, terminate_at in exiting:
+            if process.is_alive() and time.monotonic() > terminate_at:
+                process.terminate()
+            process.join(timeout=0)
+            if process.is_alive():
+                lingering.append((process, terminate_at))
+
+        with self._lock:
+            self._exiting.extend(lingering)
+
+    def _pending_exit(self, job_id: str, exitcode: int):
+        # Its final report may still be in the queue; drain before judging
+        try:
+            while True:
+                self._handle(*self._events.get_nowait())
+        except queue.Empty:
+            pass
+
+        job = self.jobs.get(job_id)
+        if job is not None and job["status"] not in FINISHED_STATES:
+            if job.get("cancel_requested"):
+                self._finish(job, {"status": "cancelled"})
+            else:
+                self._finish(job, {"status": "failed", "error": f"Worker exited with code {exitcode}"})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"max_workers": self.max_workers, "running": len(self._running), "jobs": counts}
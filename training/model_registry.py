@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from storage.cache import BoundedCache
+from storage.file_utils import atomic_write_json, file_lock, file_stamp
+from training.models import TextClassifier
+
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+
+
+def model_bytes(model: TextClassifier) -> int:
+    return sum(param.nbytes for param in model.params.values())
+
+
+class ModelRegistry:
+    """Versioned models with metadata, loaded lazily and kept in an LRU.
+
+    Each version lives in ``<registry_dir>/<name>/v<n>/`` as ``meta.json``
+    plus one ``.npy`` per weight array, so loading maps the arrays into
+    memory instead of reading them; pages are only read when inference
+    touches them. Loaded models are kept in a BoundedCache limited to
+    ``memory_budget`` bytes of weights.
+
+    ``in_use.json`` maps each model name to the version serving requests.
+    Promotion rewrites it atomically and only swaps which object ``get``
+    returns, so requests already holding the previous model finish with it.
+    Other processes notice a promotion within ``refresh_interval`` seconds,
+    and callbacks added with ``add_listener`` are called with the model name
+    and new version whenever one is noticed.
+    """
+
+    def __init__(self, registry_dir: str, memory_budget: int = 512 * 1024 * 1024,
+                 keep_versions: int = 10, refresh_interval: float = 1.0):
+        self.registry_dir = registry_dir
+        self.in_use_path = os.path.join(registry_dir, "in_use.json")
+        self.lock_path = os.path.join(registry_dir, ".lock")
+        self.keep_versions = keep_versions
+        self.refresh_interval = refresh_interval
+
+        self.models = BoundedCache("models", max_entries=64, max_bytes=memory_budget, sizeof=model_bytes)
+        # Weights updated in this process (by continuous learning) and not yet registered
+        self._live: Dict[str, TextClassifier] = {}
+        self._in_use: Dict[str, Dict] = {}
+        self._in_use_stamp = None
+        self._checked = 0.0
+        self._listeners: List[Callable[[str, int], None]] = []
+        self._lock = threading.RLock()
+
+        os.makedirs(registry_dir, exist_ok=True)
+        self.refresh()
+
+    def model_dir(self, model_name: str) -> str:
+        return os.path.join(self.registry_dir, model_name)
+
+    def _version_dir(self, model_name: str, version: int) -> str:
+        return os.path.join(self.model_dir(model_name), f"v{version:06d}")
+
+    def _version_numbers(self, model_name: str) -> List[int]:
+        directory = self.model_dir(model_name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(VERSION_PATTERN.match, os.listdir(directory)) if match)
+
+    def refresh(self, force: bool = True):
+        """Pick up promotions made by other processes."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+
+        stamp = file_stamp(self.in_use_path)
+        if stamp == self._in_use_stamp:
+            return
+        try:
+            with open(self.in_use_path, 'r') as f:
+                in_use = json.load(f)
+        except FileNotFoundError:
+            in_use = {}
+        except Exception as e:
+            print(f"Error loading model registry: {e}")
+            return
+
+        with self._lock:
+            changed = [(name, entry["version"]) for name, entry in in_use.items()
+                       if self._in_use.get(name, {}).get("version") != entry["version"]]
+            for name, _ in changed:
+                self._live.pop(name, None)
+            self._in_use = in_use
+            self._in_use_stamp = stamp
+
+        for name, version in changed:
+            for listener in self._listeners:
+                try:
+                    listener(name, version)
+                except Exception as e:
+                    print(f"Error in model promotion listener: {e}")
+
+    def add_listener(self, callback: Callable[[str, int], None]):
+        """Call ``callback(model_name, version)`` whenever a promotion is noticed."""
+        self._listeners.append(callback)
+
+    def register(self, model_name: str, model: TextClassifier, metadata: Dict = None,
+                 promote: bool = False) -> int:
+        """Store a new version of a model and return its number."""
+        directory = self.model_dir(model_name)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write everything to a temporary directory and rename it into place
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+        try:
+            for name, value in model.params.items():
+                np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(value))
+
+            with file_lock(self.lock_path):
+                versions = self._version_numbers(model_name)
+                version = versions[-1] + 1 if versions else 1
+                atomic_write_json(os.path.join(staging, "meta.json"), {
+                    "name": model_name,
+                    "version": version,
+                    "created": time.time(),
+                    "model": model.config(),
+                    "params": sorted(model.params),
+                    "bytes": model_bytes(model),
+                    "metadata": metadata or {}
+                }, indent=2)
+                os.chmod(staging, 0o755)
+                os.rename(staging, self._version_dir(model_name, version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        if promote:
+            self.promote(model_name, version)
+        self._prune(model_name)
+        return version
+
+    def promote(self, model_name: str, version: int):
+        """Make ``version`` the one ``get(model_name)`` serves."""
+        if not os.path.exists(os.path.join(self._version_dir(model_name, version), "meta.json")):
+            raise ValueError(f"Unknown version {version} of model {model_name}")
+
+        with file_lock(self.lock_path):
+            self.refresh()
+            in_use = dict(self._in_use)
+            in_use[model_name] = {"version": version, "promoted": time.time()}
+            atomic_write_json(self.in_use_path, in_use, indent=2)
+            self.refresh()
+
+    def _prune(self, model_name: str):
+        """Delete old versions beyond ``keep_versions``, never the one in use."""
+        in_use = self.in_use_version(model_name)
+        for version in self._version_numbers(model_name)[:-self.keep_versions]:
+            if version != in_use:
+                # Processes that mapped its arrays keep reading them until they let go
+                shutil.rmtree(self._version_dir(model_name, version), ignore_errors=True)
+                self.models.invalidate((model_name, version))
+
+    def in_use_version(self, model_name: str) -> Optional[int]:
+        self.refresh(force=False)
+        entry = self._in_use.get(model_name)
+        return entry["version"] if entry else None
+
+    def default_model(self) -> Optional[str]:
+        """The most recently promoted model."""
+        self.refresh(force=False)
+        if not self._in_use:
+            return None
+        return max(self._in_use, key=lambda name: self._in_use[name]["promoted"])
+
+    def version_tag(self) -> str:
+        """``name:version`` of the default model in use, or "" if none is."""
+        model_name = self.default_model()
+        if model_name is None:
+            return ""
+        return f"{model_name}:{self.in_use_version(model_name)}"
+
+    def get(self, model_name: str = None, version: int = None) -> Optional[TextClassifier]:
+        """Return a model, loading it on first use; by default the version in use."""
+        model_name = model_name or self.default_model()
+        if model_name is None:
+            return None
+
+        if version is None:
+            version = self.in_use_version(model_name)
+            if version is None:
+                return None
+            live = self._live.get(model_name)
+            if live is not None:
+                return live
+
+        key = (model_name, version)
+        model = self.models.get(key)
+        if model is None:
+            with self._lock:
+                model = self.models.get(key)
+                if model is None:
+                    model = self._load(model_name, version)
+                    self.models.set(key, model)
+        return model
+
+    def _load(self, model_name: str, version: int) -> TextClassifier:
+        directory = self._version_dir(model_name, version)
+        with open(os.path.join(directory, "meta.json"), 'r') as f:
+            meta = json.load(f)
+
+        model = TextClassifier.from_config(meta["model"])
+        model.params = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+                        for name in meta["params"]}
+        return model
+
+    def set_live(self, model_name: str, model: TextClassifier):
+        """Serve updated weights for the in-use version of a model in this process."""
+        with self._lock:
+            self._live[model_name] = model
+
+    def predict_labels(self, texts: List[str], model_name: str = None) -> Optional[List[str]]:
+        model = self.get(model_name)
+        return model.predict_labels(texts) if model is not None else None
+
+    def versions(self, model_name: str) -> List[Dict]:
+        """Metadata of every stored version, newest first."""
+        versions = []
+        for version in reversed(self._version_numbers(model_name)):
+            try:
+                with open(os.path.join(self._version_dir(model_name, version), "meta.json"), 'r') as f:
+                    versions.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return versions
+
+    def list_models(self) -> List[Dict]:
+        self.refresh()
+        models = []
+        for name in sorted(os.listdir(self.registry_dir)):
+            if os.path.isdir(self.model_dir(name)) and not name.startswith('.'):
+                versions = self._version_numbers(name)
+                models.append({
+                    "name": name,
+                    "versions": versions,
+                    "in_use": self.in_use_version(name),
+                    "updated_in_memory": name in self._live
+                })
+        return models
+
+    def stats(self) -> Dict:
+        return self.models.stats()
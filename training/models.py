@@ -0,0 +1,224 @@
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from storage.file_utils import atomic_open
+from training.features import HashingVectorizer
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class TextClassifier:
+    """Base class for NumPy text classifiers trained with mini-batch SGD.
+
+    Subclasses define their parameters and ``_forward``/``_backward``; this
+    class supplies momentum SGD with L2 decay, evaluation, and ``.npz``
+    persistence that stores the weights next to the label names and the
+    vectorizer settings needed to featurise new text the same way.
+    """
+
+    kind = "base"
+
+    def __init__(self, classes: List[str], vectorizer: HashingVectorizer,
+                 l2: float = 1e-4, momentum: float = 0.9, seed: int = 0):
+        self.classes = list(classes)
+        self.vectorizer = vectorizer
+        self.l2 = l2
+        self.momentum = momentum
+        self.rng = np.random.default_rng(seed)
+        self.params: Dict[str, np.ndarray] = {}
+        self._velocity: Dict[str, np.ndarray] = {}
+
+    @property
+    def n_features(self) -> int:
+        return self.vectorizer.n_features
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.classes)
+
+    def hyperparameters(self) -> Dict:
+        return {"l2": self.l2, "momentum": self.momentum}
+
+    def _forward(self, X: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        """Return logits and whatever ``_backward`` needs."""
+        raise NotImplementedError
+
+    def _backward(self, cache: Dict, grad_logits: np.ndarray) -> Dict[str, np.ndarray]:
+        """Return gradients for every parameter given d(loss)/d(logits)."""
+        raise NotImplementedError
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        logits, _ = self._forward(X)
+        return softmax(logits)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        logits, _ = self._forward(X)
+        return logits.argmax(axis=1)
+
+    def predict_labels(self, texts: List[str]) -> List[str]:
+        X = self.vectorizer.transform(texts)
+        return [self.classes[i] for i in self.predict(X.take(np.arange(len(X))))]
+
+    def train_batch(self, X: np.ndarray, y: np.ndarray, learning_rate: float) -> Tuple[float, float]:
+        """Take one SGD step on a mini-batch; returns its loss and accuracy."""
+        logits, cache = self._forward(X)
+        probs = softmax(logits)
+        batch = np.arange(len(y))
+
+        loss = float(-np.log(probs[batch, y] + 1e-12).mean())
+        accuracy = float((probs.argmax(axis=1) == y).mean())
+
+        grad_logits = probs
+        grad_logits[batch, y] -= 1.0
+        grad_logits /= len(y)
+
+        for name, grad in self._backward(cache, grad_logits).items():
+            param = self.params[name]
+            if param.ndim > 1:
+                grad = grad + self.l2 * param
+            velocity = self._velocity.setdefault(name, np.zeros_like(param))
+            velocity *= self.momentum
+            velocity -= learning_rate * grad
+            param += velocity
+
+        return loss, accuracy
+
+    def evaluate(self, X: np.ndarray, y: np.ndarray) -> Tuple[float, np.ndarray]:
+        """Return mean loss and predictions for a batch."""
+        probs = self.predict_proba(X)
+        loss = float(-np.log(probs[np.arange(len(y)), y] + 1e-12).mean())
+        return loss, probs.argmax(axis=1)
+
+    def config(self) -> Dict:
+        """Everything besides the weights needed to rebuild this model."""
+        return {
+            "kind": self.kind,
+            "classes": self.classes,
+            "vectorizer": self.vectorizer.config(),
+            "hyperparameters": self.hyperparameters()
+        }
+
+    @staticmethod
+    def from_config(config: Dict) -> "TextClassifier":
+        return create_model(config["kind"], config["classes"],
+                            HashingVectorizer(**config["vectorizer"]), **config["hyperparameters"])
+
+    def optimizer_state(self) -> Dict[str, np.ndarray]:
+        return dict(self._velocity)
+
+    def set_optimizer_state(self, velocity: Dict[str, np.ndarray]):
+        self._velocity = {name: np.array(value, dtype=self.params[name].dtype) for name, value in velocity.items()}
+
+    def save(self, path: str):
+        """Write weights and metadata to an ``.npz`` file atomically."""
+        with atomic_open(path, 'wb') as f:
+            np.savez(f, __meta__=np.array(json.dumps(self.config())), **self.params)
+
+    @staticmethod
+    def load(path: str) -> "TextClassifier":
+        """Rebuild a classifier saved with ``save``."""
+        with np.load(path, allow_pickle=False) as archive:
+            config = json.loads(str(archive["__meta__"]))
+            params = {name: archive[name] for name in archive.files if name != "__meta__"}
+
+        model = TextClassifier.from_config(config)
+        model.params = params
+        return model
+
+
+class LogisticRegression(TextClassifier):
+    """Multinomial logistic regression (a single softmax layer)."""
+
+    kind = "logistic"
+
+    def __init__(self, classes: List[str], vectorizer: HashingVectorizer, **kwargs):
+        super().__init__(classes, vectorizer, **kwargs)
+        self.params = {
+            "W": np.zeros((self.n_features, self.n_classes), dtype=np.float32),
+            "b": np.zeros(self.n_classes, dtype=np.float32)
+        }
+
+    def _forward(self, X: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        return X @ self.params["W"] + self.params["b"], {"X": X}
+
+    def _backward(self, cache: Dict, grad_logits: np.ndarray) -> Dict[str, np.ndarray]:
+        return {"W": cache["X"].T @ grad_logits, "b": grad_logits.sum(axis=0)}
+
+
+class MLPClassifier(TextClassifier):
+    """Two-layer perceptron with a ReLU hidden layer."""
+
+    kind = "mlp"
+
+    def __init__(self, classes: List[str], vectorizer: HashingVectorizer, hidden_units: int = 64, **kwargs):
+        super().__init__(classes, vectorizer, **kwargs)
+        self.hidden_units = int(hidden_units)
+        # He initialisation keeps ReLU activations from dying or exploding
+        self.params = {
+            "W1": (self.rng.standard_normal((self.n_features, self.hidden_units)) *
+                   np.sqrt(2.0 / self.n_features)).astype(np.float32),
+            "b1": np.zeros(self.hidden_units, dtype=np.float32),
+            "W2": (self.rng.standard_normal((self.hidden_units, self.n_classes)) *
+                   np.sqrt(2.0 / self.hidden_units)).astype(np.float32),
+            "b2": np.zeros(self.n_classes, dtype=np.float32)
+        }
+
+    def hyperparameters(self) -> Dict:
+        return {**super().hyperparameters(), "hidden_units": self.hidden_units}
+
+    def _forward(self, X: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        hidden = np.maximum(X @ self.params["W1"] + self.params["b1"], 0)
+        return hidden @ self.params["W2"] + self.params["b2"], {"X": X, "hidden": hidden}
+
+    def _backward(self, cache: Dict, grad_logits: np.ndarray) -> Dict[str, np.ndarray]:
+        hidden = cache["hidden"]
+        grad_hidden = (grad_logits @ self.params["W2"].T) * (hidden > 0)
+        return {
+            "W2": hidden.T @ grad_logits,
+            "b2": grad_logits.sum(axis=0),
+            "W1": cache["X"].T @ grad_hidden,
+            "b1": grad_hidden.sum(axis=0)
+        }
+
+
+MODEL_TYPES = {
+    LogisticRegression.kind: LogisticRegression,
+    MLPClassifier.kind: MLPClassifier
+}
+
+
+def create_model(kind: str, classes: List[str], vectorizer: HashingVectorizer, **kwargs) -> TextClassifier:
+    """Build an untrained classifier of the given kind ("logistic" or "mlp")."""
+    if kind not in MODEL_TYPES:
+        raise ValueError(f"Unknown model type: {kind}")
+    return MODEL_TYPES[kind](classes, vectorizer, **kwargs)
+
+
+def classification_metrics(y_true: np.ndarray, y_pred: np.ndarray, n_classes: int) -> Dict:
+    """Accuracy plus macro-averaged precision, recall and F1."""
+    confusion = np.bincount(y_true * n_classes + y_pred, minlength=n_classes * n_classes)
+    confusion = confusion.reshape(n_classes, n_classes).astype(np.float64)
+
+    true_positives = np.diag(confusion)
+    predicted = confusion.sum(axis=0)
+    actual = confusion.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(actual > 0, true_positives / actual, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    # Average only over classes present in the evaluation set
+    present = actual > 0
+    return {
+        "accuracy": float(true_positives.sum() / max(len(y_true), 1)),
+        "precision": float(precision[present].mean()) if present.any() else 0.0,
+        "recall": float(recall[present].mean()) if present.any() else 0.0,
+        "f1_score": float(f1[present].mean()) if present.any() else 0.0
+    }
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from storage.file_utils import atomic_write_json
+from training.model_registry import ModelRegistry
+from training.models import TextClassifier
+
+
+def _labelled(message: Dict) -> Optional[Tuple[str, str]]:
+    """A message's text and label, using the same fields as dataset records."""
+    text = message.get("text", message.get("content"))
+    label = message.get("label", message.get("category"))
+    if not text or label is None:
+        return None
+    return str(text), str(label)
+
+
+class ContinuousLearner:
+    """Keeps fine-tuning the in-use version of a model on labelled conversation turns.
+
+    New messages are followed through ``MemoryManager.read_new_messages``;
+    those carrying a label (``label`` or ``category``, as in datasets) that
+    the model knows are collected into micro-batches of ``batch_size``, or
+    fewer once the oldest has waited ``max_wait`` seconds. Each micro-batch
+    is one SGD step on a copy of the model, which the registry then serves
+    in place of the previous one, so inference never sees half-updated
+    weights.
+
+    Work is paced so it uses at most ``cpu_share`` of a core: after each
+    poll or update the learner sleeps long enough for its busy time to stay
+    under that fraction. At most every ``save_interval`` seconds the
+    updated model is registered and promoted as a new version, then the feed
+    cursor is saved; after a crash at most the turns since the last save
+    are learned again. If another version is promoted meanwhile, learning
+    continues from that one.
+    """
+
+    def __init__(self, registry: ModelRegistry, model_name: str, memory_manager, batch_size: int = 32,
+                 max_wait: float = 30.0, learning_rate: float = 0.05, cpu_share: float = 0.1,
+                 poll_interval: float = 2.0, save_interval: float = 60.0):
+        self.registry = registry
+        self.model_name = model_name
+        self.state_path = os.path.join(registry.model_dir(model_name), "online.json")
+        self.memory_manager = memory_manager
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.learning_rate = learning_rate
+        self.cpu_share = min(1.0, max(0.01, cpu_share))
+        self.poll_interval = poll_interval
+        self.save_interval = save_interval
+
+        self._version = registry.in_use_version(model_name)
+        if self._version is None:
+            raise ValueError(f"Model {model_name} has no version in use")
+        self._model = registry.get(model_name, self._version)
+        self._stop = threading.Event()
+
+        self.state = {"cursor": None, "updates": 0, "examples": 0, "skipped": 0, "last_loss": None}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    self.state.update(json.load(f))
+            except Exception as e:
+                print(f"Error loading continuous learning state: {e}")
+
+        # Examples read past the saved cursor but not learned yet are saved with
+        # it, as (text, label); labels are mapped to classes when learned, since
+        # the model may be replaced by one with other classes in between
+        self._pending: List[Tuple[str, str]] = [
+            (text, self._model.classes[label] if isinstance(label, int) else label)
+            for text, label in self.state.pop("pending", [])
+        ]
+        self._pending_since: Optional[float] = time.monotonic() if self._pending else None
+        self._last_save = time.monotonic()
+        self._unsaved = False
+        # The loaded version already includes every update counted so far
+        self._registered_updates = self.state["updates"]
+
+    @property
+    def model(self) -> TextClassifier:
+        """The current model; hold on to it for a whole request for consistent results."""
+        return self._model
+
+    def predict_labels(self, texts: List[str]) -> List[str]:
+        return self.model.predict_labels(texts)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, should_stop: Callable[[], bool] = None, on_update: Callable[[Dict], None] = None):
+        """Learn until ``stop`` is called or ``should_stop`` returns true."""
+        try:
+            while not self._stop.is_set() and not (should_stop and should_stop()):
+                started = time.perf_counter()
+                received = self._poll()
+                updated = self._batch_ready()
+                if updated:
+                    self._update()
+                if on_update and (received or updated):
+                    on_update(self.stats())
+                if self._unsaved and time.monotonic() - self._last_save >= self.save_interval:
+                    self._save()
+
+                busy = time.perf_counter() - started
+                # Sleep so busy time stays within cpu_share of the wall clock
+                pause = busy * (1 - self.cpu_share) / self.cpu_share
+                if not received and not self._batch_ready():
+                    pause = max(pause, self.poll_interval)
+                self._stop.wait(pause)
+        finally:
+            if self._unsaved:
+                self._save()
+
+    def _poll(self) -> int:
+        """Collect labelled messages from the feed; returns how many messages were read."""
+        messages, cursor = self.memory_manager.read_new_messages(self.state["cursor"], limit=self.batch_size * 4)
+        self.state["cursor"] = cursor
+        if messages:
+            self._unsaved = True
+
+        classes = set(self.model.classes)
+        for message in messages:
+            example = _labelled(message)
+            if example is None or example[1] not in classes:
+                self.state["skipped"] += 1
+                continue
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(example)
+        return len(messages)
+
+    def _batch_ready(self) -> bool:
+        if len(self._pending) >= self.batch_size:
+            return True
+        return bool(self._pending) and time.monotonic() - self._pending_since >= self.max_wait
+
+    def _update(self):
+        """Take one SGD step on a copy of the model and swap it in."""
+        batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        self._pending_since = time.monotonic() if self._pending else None
+
+        if self.registry.in_use_version(self.model_name) != self._version:
+            # A newly trained version was promoted; learn on top of it instead
+            self._version = self.registry.in_use_version(self.model_name)
+            self._model = self.registry.get(self.model_name, self._version)
+
+        current = self._model
+        classes = {label: index for index, label in enumerate(current.classes)}
+        known = [(text, classes[label]) for text, label in batch if label in classes]
+        self.state["skipped"] += len(batch) - len(known)
+        if not known:
+            return
+        batch = known
+
+        model = TextClassifier.from_config(current.config())
+        model.params = {name: value.copy() for name, value in current.params.items()}
+        model.set_optimizer_state(current.optimizer_state())
+
+        texts = [text for text, _ in batch]
+        X = model.vectorizer.transform(texts)
+        y = np.array([label for _, label in batch], dtype=np.int64)
+        loss, _ = model.train_batch(X.take(np.arange(len(X))), y, self.learning_rate)
+
+        if not all(np.all(np.isfinite(value)) for value in model.params.values()):
+            print("Discarding continuous learning update with non-finite weights")
+            return
+
+        # Readers hold the old model until they are done; one assignment swaps it
+        self._model = model
+        self.registry.set_live(self.model_name, model)
+        self.state["updates"] += 1
+        self.state["examples"] += len(batch)
+        self.state["last_loss"] = round(loss, 4)
+        self._unsaved = True
+
+    def _save(self):
+        """Register the model, then save the cursor, so a crash never skips unsaved turns."""
+        try:
+            if self.registry.in_use_version(self.model_name) != self._version:
+                # Never replace a version promoted since these updates started
+                self._version = self.registry.in_use_version(self.model_name)
+                self._model = self.registry.get(self.model_name, self._version)
+                self._registered_updates = self.state["updates"]
+            elif self.state["updates"] > self._registered_updates:
+                self._version = self.registry.register(self.model_name, self._model, {
+                    "source": "continuous_learning",
+                    "updates": self.state["updates"],
+                    "examples": self.state["examples"]
+                }, promote=True)
+                self._registered_updates = self.state["updates"]
+            atomic_write_json(self.state_path, dict(self.state, pending=self._pending))
+            self._unsaved = False
+        except Exception as e:
+            print(f"Error saving continuous learning state: {e}")
+        self._last_save = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {
+            "updates": self.state["updates"],
+            "examples": self.state["examples"],
+            "skipped": self.state["skipped"],
+            "pending": len(self._pending),
+            "batch_size": self.batch_size,
+            "last_loss": self.state["last_loss"],
+            "cpu_share": self.cpu_share
+        }
@@ -0,0 +1,402 @@
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from training.checkpoints import Checkpoint, CheckpointStore
+from training.datasets import FeaturizedDataset
+from training.features import HashingVectorizer
+from training.job_scheduler import JobCancelled
+from training.model_registry import ModelRegistry
+from training.models import TextClassifier, classification_metrics, create_model
+
+# Models testing below this accuracy go through the fix stage
+ACCURACY_THRESHOLD = 0.85
+
+
+class TrainingPipeline:
+    """Runs the train, test, fix, retest and prepare stages for one model.
+
+    Progress is kept in ``self.progress`` in the shape the training page
+    expects, and sent to ``report`` as ``{"stage", "progress"}`` snapshots at
+    most every ``report_interval`` seconds plus on every stage change.
+    ``should_stop`` is polled between mini-batches; once it returns true the
+    pipeline raises JobCancelled.
+    """
+
+    def __init__(self, model_dir: str, report: Callable[[Dict], None] = None,
+                 should_stop: Callable[[], bool] = None, report_interval: float = 0.25):
+        self.model_dir = model_dir
+        self.report = report
+        self.should_stop = should_stop
+        self.report_interval = report_interval
+        self.progress = {
+            "training_model": 0,
+            "testing_model": 0,
+            "fixing_model": 0,
+            "retesting_model": 0,
+            "getting_ready": 0,
+            "in_use": False,
+            "continuous_learning": 0,
+            "metrics": {}
+        }
+        self.current_stage = "idle"
+        self._last_report = 0.0
+
+        # Held-out examples from the latest training run, for testing
+        self._holdout: Dict[str, Tuple[FeaturizedDataset, np.ndarray]] = {}
+        self._dataset = None
+
+        # Set up by run(): where checkpoints go and what they record
+        self.checkpoints: Optional[CheckpointStore] = None
+        self._base_params: Dict = {}
+        self._record: Dict = {}
+        self._job_id: Optional[str] = None
+
+        os.makedirs(model_dir, exist_ok=True)
+
+    def _report(self, force: bool = False):
+        now = time.monotonic()
+        if self.report and (force or now - self._last_report >= self.report_interval):
+            self._last_report = now
+            self.report({"stage": self.current_stage, "progress": self.progress})
+
+    def _set_stage(self, stage: str):
+        self.current_stage = stage
+        self._report(force=True)
+
+    def _check_cancelled(self):
+        if self.should_stop and self.should_stop():
+            raise JobCancelled()
+
+    def run(self, model_name: str, dataset_path: str, params: Dict = None, job_id: str = None) -> Dict:
+        """Execute the full pipeline and return its training record.
+
+        Checkpoints go under ``<model_dir>/checkpoints/<job_id>``. If a
+        compatible checkpoint is found there (same parameters and dataset
+        contents) the run picks up where it stopped instead of starting over.
+        """
+        start_time = time.time()
+        self.checkpoints = CheckpointStore(os.path.join(self.model_dir, "checkpoints", job_id or model_name))
+
+        base_params = self._resolve_params(params)
+        dataset = self._open_dataset(dataset_path, base_params)
+
+        resume = self.checkpoints.latest()
+        if resume and (resume.meta["base_params"] != base_params or
+                       resume.meta["content_hash"] != dataset.meta["content_hash"]):
+            # The job or its data changed since the checkpoint was written
+            self.checkpoints.clear()
+            resume = None
+
+        self._base_params = base_params
+        self._job_id = job_id
+        if resume:
+            training_record = resume.meta["record"]
+            training_record["resumed"] = training_record.get("resumed", 0) + 1
+        else:
+            training_record = {
+                "model_name": model_name,
+                "start_time": datetime.now().isoformat(),
+                "stages": {}
+            }
+        self._record = training_record
+
+        if resume is None or resume.meta["stage"] == "training_model":
+            # 1. Training model
+            self._set_stage("training_model")
+            training_record["stages"]["training"] = self._train_model(model_name, dataset_path, params,
+                                                                      resume=resume)
+
+            # 2. Testing model
+            self._set_stage("testing_model")
+            test_results = self._test_model(model_name)
+            training_record["stages"]["testing"] = test_results
+        else:
+            test_results = training_record["stages"]["testing"]
+
+        # 3. Fixing model if needed
+        if test_results["accuracy"] < ACCURACY_THRESHOLD:
+            self._set_stage("fixing_model")
+            fix_resume = resume if resume and resume.meta["stage"] == "fixing_model" else None
+            training_record["stages"]["fixing"] = self._fix_model(model_name, dataset_path, test_results, params,
+                                                                  resume=fix_resume)
+
+            # 4. Retesting after fixes
+            self._set_stage("retesting_model")
+            retest_results = self._test_model(model_name, progress_key="retesting_model")
+            training_record["stages"]["retesting"] = retest_results
+
+        # 5. Getting model ready
+        self._set_stage("getting_ready")
+        training_record["version"] = self._prepare_model_for_use(model_name)
+
+        # 6. Model is in use
+        self.progress["in_use"] = True
+        self._set_stage("in_use")
+
+        # Record end time
+        training_record["end_time"] = datetime.now().isoformat()
+        training_record["duration"] = training_record.get("duration", 0) + time.time() - start_time
+        training_record["success"] = True
+
+        self.checkpoints.clear()
+        return training_record
+
+    def _model_path(self, model_name: str) -> str:
+        return os.path.join(self.model_dir, f"{model_name}.npz")
+
+    def _resolve_params(self, params: Dict = None) -> Dict:
+        """Fill in defaults for the training parameters."""
+        params = dict(params or {})
+        params.setdefault("model_type", "logistic")
+        params.setdefault("epochs", 10)
+        params.setdefault("batch_size", 32)
+        params.setdefault("learning_rate", 0.5 if params["model_type"] == "logistic" else 0.1)
+        params.setdefault("hidden_units", 64)
+        params.setdefault("n_features", 2 ** 14)
+        params.setdefault("l2", 1e-4)
+        params.setdefault("validation_split", 0.2)
+        params.setdefault("seed", 0)
+        params.setdefault("checkpoint_interval", 30.0)
+        return params
+
+    def _open_dataset(self, dataset_path: str, params: Dict) -> FeaturizedDataset:
+        """Featurise the dataset once; later runs over the same content reuse the cache."""
+        vectorizer = HashingVectorizer(n_features=int(params["n_features"]))
+        key = (dataset_path, vectorizer.n_features)
+        if self._dataset is not None and self._dataset[0] == key:
+            return self._dataset[1]
+
+        metrics = self.progress["metrics"]
+        metrics.update({"model_type": params["model_type"], "featurized_rows": 0})
+        dataset = FeaturizedDataset.open(dataset_path, vectorizer,
+                                         on_progress=lambda rows: metrics.update(featurized_rows=rows))
+        metrics["featurized_rows"] = len(dataset)
+        if len(dataset.classes) < 2:
+            raise ValueError(f"Dataset needs at least two labels: {dataset_path}")
+
+        self._dataset = (key, dataset)
+        self._check_cancelled()
+        return dataset
+
+    def _save_checkpoint(self, model: TextClassifier, progress_key: str, params: Dict, epoch: int, batch: int,
+                         epoch_loss: float, epoch_correct: float, rng_state: Dict, results: Dict,
+                         dataset: FeaturizedDataset, good: bool = False):
+        if self.checkpoints is None:
+            return
+        self.checkpoints.save(model, {
+            "stage": progress_key,
+            "base_params": self._base_params,
+            "params": params,
+            "content_hash": dataset.meta["content_hash"],
+            "epoch": epoch,
+            "batch": batch,
+            "epoch_loss": epoch_loss,
+            "epoch_correct": epoch_correct,
+            "rng_state": rng_state,
+            "results": results,
+            "record": self._record,
+            "time": time.time()
+        }, good=good)
+
+    def _train_model(self, model_name: str, dataset_path: str, params: Dict = None,
+                     progress_key: str = "training_model", resume: Checkpoint = None,
+                     warm_start: Checkpoint = None) -> Dict:
+        """Train a text classifier on the dataset and save its weights as ``.npz``.
+
+        ``params`` may set ``model_type`` ("logistic" or "mlp"), ``epochs``,
+        ``batch_size``, ``learning_rate``, ``hidden_units``, ``n_features``,
+        ``l2``, ``validation_split``, ``seed`` and ``checkpoint_interval``.
+        Part of the data is held out for ``_test_model``. Loss and accuracy
+        of every mini-batch and epoch are reported in
+        ``self.progress["metrics"]``.
+
+        A checkpoint is written every ``checkpoint_interval`` seconds and at
+        the end, where it is marked good. ``resume`` continues from a
+        checkpoint at the exact batch it was taken; ``warm_start`` starts
+        from a checkpoint's weights and optimizer state.
+        """
+        if resume:
+            params = resume.meta["params"]
+        params = self._resolve_params(params)
+        total_epochs = int(params["epochs"])
+        batch_size = max(1, int(params["batch_size"]))
+        learning_rate = float(params["learning_rate"])
+        checkpoint_interval = float(params["checkpoint_interval"])
+
+        dataset = self._open_dataset(dataset_path, params)
+        classes = dataset.classes
+        metrics = self.progress["metrics"]
+
+        # Hold out part of the data for testing; tiny datasets test on what they trained on
+        rng = np.random.default_rng(int(params["seed"]))
+        train, holdout = dataset.split(float(params["validation_split"]), rng)
+        if len(holdout) == 0:
+            holdout = train
+        self._holdout[model_name] = (dataset, holdout)
+
+        start_epoch = start_batch = 0
+        epoch_loss = epoch_correct = 0.0
+        results = {"accuracy": 0, "loss": 0}
+        if resume:
+            model = resume.model
+            start_epoch, start_batch = resume.meta["epoch"], resume.meta["batch"]
+            epoch_loss, epoch_correct = resume.meta["epoch_loss"], resume.meta["epoch_correct"]
+            results = resume.meta["results"]
+            rng.bit_generator.state = resume.meta["rng_state"]
+            metrics["resumed_from"] = {"epoch": start_epoch + 1, "batch": start_batch}
+        elif warm_start:
+            model = warm_start.model
+            metrics["warm_start"] = True
+        else:
+            model_kwargs = {"l2": float(params["l2"]), "seed": int(params["seed"])}
+            if params["model_type"] == "mlp":
+                model_kwargs["hidden_units"] = int(params["hidden_units"])
+            model = create_model(params["model_type"], classes, HashingVectorizer(**dataset.meta["vectorizer"]),
+                                 **model_kwargs)
+
+        batches_per_epoch = -(-len(train) // batch_size)
+        metrics.update({"total_epochs": total_epochs, "batches_per_epoch": batches_per_epoch})
+        last_checkpoint = time.monotonic()
+
+        for epoch in range(start_epoch, total_epochs):
+            # The shuffle order of an epoch is rebuilt from this state on resume
+            epoch_rng_state = rng.bit_generator.state
+            first_batch = start_batch if epoch == start_epoch else 0
+            if first_batch == 0:
+                epoch_loss = 0.0
+                epoch_correct = 0.0
+
+            # The next batch is read and densified while this one trains
+            batches = dataset.iter_batches(train, batch_size, rng, start_batch=first_batch)
+            for batch_index, (X, y) in enumerate(batches, first_batch):
+                loss, accuracy = model.train_batch(X, y, learning_rate)
+                epoch_loss += loss * len(y)
+                epoch_correct += accuracy * len(y)
+
+                # Update progress
+                metrics.update({
+                    "epoch": epoch + 1,
+                    "batch": batch_index + 1,
+                    "batch_loss": round(loss, 4),
+                    "batch_accuracy": round(accuracy, 4)
+                })
+                done = epoch * batches_per_epoch + batch_index + 1
+                self.progress[progress_key] = int(done / (total_epochs * batches_per_epoch) * 100)
+                self._report()
+
+                if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                    self._save_checkpoint(model, progress_key, params, epoch, batch_index + 1, epoch_loss,
+                                          epoch_correct, epoch_rng_state, results, dataset)
+                    last_checkpoint = time.monotonic()
+                self._check_cancelled()
+
+            results = {
+                "accuracy": round(epoch_correct / len(train), 4),
+                "loss": round(epoch_loss / len(train), 4)
+            }
+            metrics.update({"epoch_loss": results["loss"], "epoch_accuracy": results["accuracy"]})
+
+        # Save model
+        model.save(self._model_path(model_name))
+        self._save_checkpoint(model, progress_key, params, total_epochs, 0, 0.0, 0.0,
+                              rng.bit_generator.state, results, dataset, good=True)
+
+        results = dict(results)
+        results.update({
+            "model_type": params["model_type"],
+            "epochs": total_epochs,
+            "classes": classes,
+            "train_examples": int(len(train)),
+            "test_examples": int(len(holdout))
+        })
+        return results
+
+    def _test_model(self, model_name: str, progress_key: str = "testing_model") -> Dict:
+        """Evaluate the saved model on the held-out data and update progress."""
+        if model_name not in self._holdout:
+            raise ValueError(f"No held-out data for model {model_name}; train it first")
+
+        model = TextClassifier.load(self._model_path(model_name))
+        dataset, holdout = self._holdout[model_name]
+
+        total_loss = 0.0
+        seen = 0
+        labels = []
+        predictions = []
+        for X, y in dataset.iter_batches(holdout, 256):
+            loss, batch_predictions = model.evaluate(X, y)
+            total_loss += loss * len(y)
+            seen += len(y)
+            labels.append(y)
+            predictions.append(batch_predictions)
+            self.progress[progress_key] = int(seen / len(holdout) * 100)
+            self._report()
+            self._check_cancelled()
+
+        results = classification_metrics(np.concatenate(labels), np.concatenate(predictions), model.n_classes)
+        results = {name: round(value, 4) for name, value in results.items()}
+        results["loss"] = round(total_loss / len(holdout), 4)
+        self.progress["metrics"]["test_accuracy"] = results["accuracy"]
+        return results
+
+    def _fix_model(self, model_name: str, dataset_path: str, test_results: Dict, params: Dict = None,
+                   resume: Checkpoint = None) -> Dict:
+        """Continue training from the last good checkpoint with adjusted parameters."""
+        if resume:
+            return self._train_model(model_name, dataset_path, progress_key="fixing_model", resume=resume)
+
+        params = self._resolve_params(params)
+        warm_start = self.checkpoints.good() if self.checkpoints else None
+
+        # Determine what needs fixing based on test results
+        if warm_start is None:
+            # No trained weights to build on - retrain from scratch for longer
+            params["epochs"] = max(15, int(params["epochs"]) * 2)
+        elif test_results["accuracy"] < 0.7:
+            # Major issues - another full round of training
+            params["epochs"] = int(params["epochs"])
+        else:
+            # Minor issues - fine-tune with smaller steps
+            params["epochs"] = max(2, int(params["epochs"]) // 2)
+            params["learning_rate"] = float(params["learning_rate"]) / 2
+
+        return self._train_model(model_name, dataset_path, params, progress_key="fixing_model",
+                                 warm_start=warm_start)
+
+    def _prepare_model_for_use(self, model_name: str) -> int:
+        """Register the trained weights as a new version, check it serves and promote it."""
+        model = TextClassifier.load(self._model_path(model_name))
+        if not all(np.isfinite(param).all() for param in model.params.values()):
+            raise ValueError(f"Model {model_name} has non-finite weights")
+        self.progress["getting_ready"] = 30
+
+        stages = self._record.get("stages", {})
+        results = stages.get("retesting") or stages.get("testing") or {}
+        registry = ModelRegistry(os.path.join(self.model_dir, "registry"))
+        version = registry.register(model_name, model, {
+            "source": "training",
+            "job_id": self._job_id,
+            "accuracy": results.get("accuracy"),
+            "f1_score": results.get("f1_score"),
+            "params": self._base_params,
+            "dataset_hash": self._dataset[1].meta["content_hash"] if self._dataset else None
+        })
+        self.progress["getting_ready"] = 60
+
+        # Load it the way it will be served before anything depends on it
+        served = registry.get(model_name, version)
+        served.predict(np.zeros((1, served.n_features), dtype=np.float32))
+        registry.promote(model_name, version)
+        self.progress["getting_ready"] = 100
+        return version
+
+
+def run_training_job(payload: Dict, report: Callable[[Dict], None], should_stop: Callable[[], bool]) -> Dict:
+    """Job scheduler target: run one training pipeline in a worker process."""
+    pipeline = TrainingPipeline(payload["model_dir"], report=report, should_stop=should_stop)
+    return pipeline.run(payload["model_name"], payload["dataset_path"], payload.get("params"),
+                        job_id=payload.get("job_id"))
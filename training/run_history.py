@@ -0,0 +1,281 @@
+import os
+import json
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage.file_utils import append_jsonl, atomic_write_json, file_lock, file_stamp
+
+# Reference to one run record: (segment number, byte offset, time logged)
+Ref = Tuple[int, int, float]
+
+
+def run_accuracy(record: Dict) -> Optional[float]:
+    """The accuracy a run finished with: its retest if it was fixed, else its test."""
+    stages = record.get("stages") or {}
+    for stage in ("retesting", "testing"):
+        if stage in stages and "accuracy" in stages[stage]:
+            return stages[stage]["accuracy"]
+    return None
+
+
+def run_time(record: Dict) -> float:
+    """UNIX time a run was logged; runs imported from the old history use their end time."""
+    if "logged" in record:
+        return record["logged"]
+    for key in ("end_time", "start_time"):
+        try:
+            return datetime.fromisoformat(record[key]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            pass
+    return 0.0
+
+
+class RunHistory:
+    """Append-only log of training runs, rotated into segments, with a small index.
+
+    Runs are appended to ``runs-<n>.jsonl`` segments under ``history_dir``;
+    a new segment starts once the current one reaches ``rotate_bytes`` and
+    only the newest ``max_segments`` are kept. ``index.json`` holds, per
+    model, the run count, references to its ``keep_recent`` latest runs and
+    its best accuracy, plus the time range and models of every segment. It
+    is rewritten on each append, so opening the history reads the index and
+    at most the records appended after it was last written, however long
+    the history is. Queries read only the records they return.
+    """
+
+    def __init__(self, history_dir: str, rotate_bytes: int = 4 * 1024 * 1024,
+                 max_segments: int = 50, keep_recent: int = 50):
+        self.history_dir = history_dir
+        self.index_path = os.path.join(history_dir, "index.json")
+        self.lock_path = os.path.join(history_dir, ".lock")
+        self.rotate_bytes = rotate_bytes
+        self.max_segments = max_segments
+        self.keep_recent = keep_recent
+
+        self.index: Dict = self._empty_index()
+        self._index_stamp = None
+
+        os.makedirs(history_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            self._refresh_locked()
+
+    @staticmethod
+    def _empty_index() -> Dict:
+        return {"version": 1, "active": 1, "offset": 0, "segments": {}, "models": {}}
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.history_dir, f"runs-{segment:06d}.jsonl")
+
+    def _refresh_locked(self):
+        """Reload the index if another process rewrote it, then index any unindexed tail."""
+        stamp = file_stamp(self.index_path)
+        changed = False
+        if stamp != self._index_stamp:
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.index = json.load(f)
+            except FileNotFoundError:
+                changed = bool(self._rebuild_index()["segments"])
+            except Exception as e:
+                print(f"Error loading training history index: {e}")
+                changed = bool(self._rebuild_index()["segments"])
+            self._index_stamp = stamp
+
+        # Records written by a process that died before updating the index
+        if self._catch_up() or changed:
+            self._write_index()
+
+    def _catch_up(self) -> bool:
+        path = self._segment_path(self.index["active"])
+        if not os.path.exists(path) or os.path.getsize(path) <= self.index["offset"]:
+            return False
+        for offset, end, record in self._scan(self.index["active"], self.index["offset"]):
+            self._index_record(self.index["active"], offset, record)
+            self.index["offset"] = end
+        return True
+
+    def _scan(self, segment: int, offset: int = 0) -> Iterator[Tuple[int, int, Dict]]:
+        """Yield (offset, end offset, record) for complete records of a segment."""
+        if not os.path.exists(self._segment_path(segment)):
+            # Removed by another process rotating the log
+            return
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A torn write; it is skipped until completed
+                    break
+                position = offset
+                offset += len(line)
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        print(f"Skipping corrupt training history record: {e}")
+                        continue
+                    yield position, offset, record
+
+    def _rebuild_index(self) -> Dict:
+        """Rebuild the index by scanning every segment (only after corruption)."""
+        self.index = self._empty_index()
+        segments = sorted(int(name[5:11]) for name in os.listdir(self.history_dir)
+                          if name.startswith("runs-") and name.endswith(".jsonl"))
+        for segment in segments:
+            self.index["active"] = segment
+            self.index["offset"] = 0
+            for offset, end, record in self._scan(segment):
+                self._index_record(segment, offset, record)
+                self.index["offset"] = end
+        return self.index
+
+    def _index_record(self, segment: int, offset: int, record: Dict):
+        logged = run_time(record)
+        ref = [segment, offset, logged]
+
+        info = self.index["segments"].setdefault(str(segment), {"count": 0, "first": logged, "last": logged,
+                                                               "models": []})
+        info["count"] += 1
+        info["first"] = min(info["first"], logged)
+        info["last"] = max(info["last"], logged)
+        model_name = record.get("model_name", "unknown")
+        if model_name not in info["models"]:
+            info["models"].append(model_name)
+
+        model = self.index["models"].setdefault(model_name, {"count": 0, "recent": [], "best": None})
+        model["count"] += 1
+        model["recent"] = (model["recent"] + [ref])[-self.keep_recent:]
+
+        accuracy = run_accuracy(record)
+        if record.get("success") and accuracy is not None and \
+                (model["best"] is None or accuracy > model["best"]["accuracy"]):
+            model["best"] = {
+                "accuracy": accuracy,
+                "job_id": record.get("job_id"),
+                "end_time": record.get("end_time"),
+                "ref": ref
+            }
+
+    def _write_index(self):
+        atomic_write_json(self.index_path, self.index)
+        self._index_stamp = file_stamp(self.index_path)
+
+    def append(self, record: Dict):
+        """Append one run and update the index."""
+        record = dict(record, logged=record.get("logged", time.time()))
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+
+        with file_lock(self.lock_path):
+            self._refresh_locked()
+
+            segment = self.index["active"]
+            path = self._segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.rotate_bytes:
+                segment = self._rotate()
+                path = self._segment_path(segment)
+
+            append_jsonl(path, [record], sync=True)
+            end = os.path.getsize(path)
+            self._index_record(segment, end - len(line.encode("utf-8")), record)
+            self.index["offset"] = end
+            self._write_index()
+
+    def _rotate(self) -> int:
+        """Start a new segment and drop the oldest beyond ``max_segments`` (lock held)."""
+        self.index["active"] += 1
+        self.index["offset"] = 0
+
+        segments = sorted(int(number) for number in self.index["segments"])
+        for segment in segments[:max(0, len(segments) + 1 - self.max_segments)]:
+            del self.index["segments"][str(segment)]
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError:
+                pass
+            for model in self.index["models"].values():
+                model["recent"] = [ref for ref in model["recent"] if ref[0] != segment]
+        return self.index["active"]
+
+    def _read(self, ref: Ref) -> Optional[Dict]:
+        try:
+            with open(self._segment_path(ref[0]), 'rb') as f:
+                f.seek(ref[1])
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+
+    def _refresh(self):
+        if file_stamp(self.index_path) != self._index_stamp:
+            with file_lock(self.lock_path):
+                self._refresh_locked()
+
+    def _iter_model(self, model_name: Optional[str]) -> Iterator[Dict]:
+        """Yield runs newest first, reading only segments that contain the model."""
+        for segment in sorted((int(number) for number in self.index["segments"]), reverse=True):
+            info = self.index["segments"][str(segment)]
+            if model_name is not None and model_name not in info["models"]:
+                continue
+            records = [record for _, _, record in self._scan(segment)
+                       if model_name is None or record.get("model_name") == model_name]
+            yield from reversed(records)
+
+    def last_runs(self, model_name: str = None, n: int = 10) -> List[Dict]:
+        """The ``n`` most recent runs of a model (or of any model), newest first."""
+        self._refresh()
+        if n <= 0:
+            return []
+
+        model = self.index["models"].get(model_name) if model_name is not None else None
+        if model is not None and n <= len(model["recent"]):
+            records = (self._read(ref) for ref in reversed(model["recent"][-n:]))
+            return [record for record in records if record is not None]
+
+        runs = []
+        for record in self._iter_model(model_name):
+            runs.append(record)
+            if len(runs) >= n:
+                break
+        return runs
+
+    def runs_between(self, start: float, end: float, model_name: str = None) -> List[Dict]:
+        """Runs logged between two UNIX times, oldest first."""
+        self._refresh()
+        runs = []
+        for segment in sorted(int(number) for number in self.index["segments"]):
+            info = self.index["segments"][str(segment)]
+            if info["last"] < start or info["first"] > end:
+                continue
+            if model_name is not None and model_name not in info["models"]:
+                continue
+            runs.extend(record for _, _, record in self._scan(segment)
+                        if start <= run_time(record) <= end and
+                        (model_name is None or record.get("model_name") == model_name))
+        return runs
+
+    def best_accuracy(self) -> Dict[str, Dict]:
+        """Best accuracy reached by each model, straight from the index."""
+        self._refresh()
+        best = {}
+        for name, model in self.index["models"].items():
+            if model["best"]:
+                best[name] = {key: value for key, value in model["best"].items() if key != "ref"}
+                best[name]["runs"] = model["count"]
+        return best
+
+    def models(self) -> Dict[str, int]:
+        """Run count per model."""
+        self._refresh()
+        return {name: model["count"] for name, model in self.index["models"].items()}
+
+    def import_legacy(self, legacy_path: str):
+        """Move runs from the old single-file ``training_history.json`` into the log."""
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+        except Exception as e:
+            print(f"Error loading training history: {e}")
+            return
+
+        for record in records:
+            self.append(dict(record, logged=run_time(record) or time.time()))
+        os.replace(legacy_path, legacy_path + ".migrated")
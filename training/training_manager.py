@@ -1,16 +1,30 @@
 import os
-import json
 import time
 import threading
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from inference.batcher import MicroBatcher
+from training.checkpoints import CheckpointStore
+from training.event_bus import EventBus
+from training.job_scheduler import JobScheduler
+from training.model_registry import ModelRegistry
+from training.online_learning import ContinuousLearner
+from training.pipeline import run_training_job
+from training.run_history import RunHistory
+
+_UNSET = object()
 
 class TrainingManager:
     """Manages the training, testing, and improvement of AI models."""
     
-    def __init__(self, model_dir: str = "models", logs_dir: str = "logs"):
+    def __init__(self, model_dir: str = "models", logs_dir: str = "logs",
+                 max_workers: int = None, start_method: str = None, memory_manager: Any = None):
         self.model_dir = model_dir
         self.logs_dir = logs_dir
+        # Source of conversation turns for continuous learning
+        self.memory_manager = memory_manager
+        self.learner: Optional[ContinuousLearner] = None
         self.progress = {
             "training_model": 0,
             "testing_model": 0,
@@ -18,211 +32,338 @@ class TrainingManager:
             "retesting_model": 0,
             "getting_ready": 0,
             "in_use": False,
-            "continuous_learning": 0
+            "continuous_learning": 0,
+            "metrics": {}
         }
         self.current_stage = "idle"
-        self.training_thread = None
-        self.is_training = False
-        self.training_history = []
+        
+        # The job whose progress is mirrored in self.progress and current_stage
+        self.active_job_id = None
+        self._lock = threading.RLock()
+        
+        # Progress changes are pushed to watchers; see /api/training/events
+        self.events = EventBus()
+        self._published: Dict = {}
+        self._job_status: Dict[str, str] = {}
         
         # Create directories if they don't exist
         os.makedirs(model_dir, exist_ok=True)
         os.makedirs(logs_dir, exist_ok=True)
         
-        # Load training history if it exists
+        # Trained versions; models are loaded on first use and shared by all requests
+        self.registry = ModelRegistry(os.path.join(model_dir, "registry"),
+                                      memory_budget=int(os.environ.get("MODEL_MEMORY_BUDGET", 512 * 1024 * 1024)))
+        self.progress["in_use"] = self.registry.default_model() is not None
+        # Concurrent predictions are classified together in one forward pass
+        self.predictions = MicroBatcher(
+            "predict", self._predict_batch,
+            max_batch_size=int(os.environ.get("PREDICT_BATCH_SIZE", 64)),
+            max_wait=float(os.environ.get("PREDICT_BATCH_WAIT_MS", 2)) / 1000,
+            max_queue=int(os.environ.get("PREDICT_QUEUE_DEPTH", 1024))
+        )
+        
+        # Finished runs are appended to a rotated log; only its index is read here
+        self.history = RunHistory(os.path.join(logs_dir, "history"))
         self._load_training_history()
+        
+        # Jobs train in worker processes, several at once; queued and
+        # interrupted jobs are picked up again after a restart
+        if max_workers is None:
+            max_workers = int(os.environ.get("TRAINING_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+        self.scheduler = JobScheduler(
+            os.path.join(logs_dir, "jobs"),
+            run_training_job,
+            max_workers=max_workers,
+            start_method=start_method or os.environ.get("TRAINING_START_METHOD", "spawn"),
+            on_update=self._on_job_update
+        )
     
     def _load_training_history(self):
-        """Load training history from logs."""
+        """Move runs from the old single-file history into the run log, once."""
         history_path = os.path.join(self.logs_dir, "training_history.json")
         if os.path.exists(history_path):
-            try:
-                with open(history_path, 'r') as f:
-                    self.training_history = json.load(f)
-            except Exception as e:
-                print(f"Error loading training history: {e}")
-                self.training_history = []
+            self.history.import_legacy(history_path)
     
-    def _save_training_history(self):
-        """Save training history to logs."""
-        history_path = os.path.join(self.logs_dir, "training_history.json")
-        try:
-            with open(history_path, 'w') as f:
-                json.dump(self.training_history, f)
-        except Exception as e:
-            print(f"Error saving training history: {e}")
+    @property
+    def training_history(self) -> List[Dict]:
+        """The most recent runs, oldest first; use ``history`` for older ones."""
+        return self.history.last_runs(n=100)[::-1]
     
-    def start_training(self, model_name: str, dataset_path: str, params: Dict = None):
-        """Start the training pipeline in a separate thread."""
-        if self.is_training:
-            return {"status": "error", "message": "Training already in progress"}
-        
-        self.is_training = True
-        self.current_stage = "training_model"
-        self.progress = {key: 0 for key in self.progress}
-        self.progress["in_use"] = False
+    def get_training_history(self, model_name: str = None, limit: int = 10) -> List[Dict]:
+        """The ``limit`` most recent runs, newest first, optionally for one model."""
+        return self.history.last_runs(model_name, limit)
+    
+    def get_best_runs(self) -> Dict[str, Dict]:
+        """Best accuracy reached by each model."""
+        return self.history.best_accuracy()
+    
+    @property
+    def is_training(self) -> bool:
+        # Tracked from job updates rather than asked of the scheduler, whose
+        # lock is held while it calls back into this manager
+        return "running" in self._job_status.values()
+    
+    def start_training(self, model_name: str, dataset_path: str, params: Dict = None, priority: int = 0):
+        """Queue a training job; it starts as soon as a worker process is free.
         
-        # Start training in a separate thread
-        self.training_thread = threading.Thread(
-            target=self._training_pipeline,
-            args=(model_name, dataset_path, params)
-        )
-        self.training_thread.start()
+        Jobs with a higher ``priority`` start first. The returned ``job_id``
+        can be passed to ``get_progress`` and ``cancel_training``.
+        """
+        job = self.scheduler.submit({
+            "model_name": model_name,
+            "dataset_path": dataset_path,
+            "params": params or {},
+            "model_dir": self.model_dir
+        }, priority=priority)
         
-        return {"status": "success", "message": "Training started"}
+        message = "Training started" if job["status"] == "running" else "Training queued"
+        return {"status": "success", "message": message, "job_id": job["id"]}
     
-    def _training_pipeline(self, model_name: str, dataset_path: str, params: Dict = None):
-        """Execute the full training pipeline."""
-        try:
-            # Record start time
-            start_time = time.time()
-            training_record = {
-                "model_name": model_name,
-                "start_time": datetime.now().isoformat(),
-                "stages": {}
-            }
-            
-            # 1. Training model
-            self.current_stage = "training_model"
-            training_record["stages"]["training"] = self._train_model(model_name, dataset_path, params)
-            
-            # 2. Testing model
-            self.current_stage = "testing_model"
-            test_results = self._test_model(model_name)
-            training_record["stages"]["testing"] = test_results
-            
-            # 3. Fixing model if needed
-            if test_results["accuracy"] < 0.85:  # Threshold for acceptable accuracy
-                self.current_stage = "fixing_model"
-                training_record["stages"]["fixing"] = self._fix_model(model_name, dataset_path, test_results)
-                
-                # 4. Retesting after fixes
-                self.current_stage = "retesting_model"
-                retest_results = self._test_model(model_name)
-                training_record["stages"]["retesting"] = retest_results
-            
-            # 5. Getting model ready
-            self.current_stage = "getting_ready"
-            self._prepare_model_for_use(model_name)
+    def cancel_training(self, job_id: str) -> Dict:
+        """Cancel a queued job, or stop a running one after its current batch."""
+        job = self.scheduler.cancel(job_id)
+        if job is None:
+            return {"status": "error", "message": f"Unknown training job: {job_id}"}
+        if job["status"] not in ("cancelled", "running"):
+            return {"status": "error", "message": f"Training job already {job['status']}"}
+        return {"status": "success", "message": "Training cancelled" if job["status"] == "cancelled"
+                else "Cancellation requested", "job_id": job_id}
+    
+    def list_jobs(self, status: str = None) -> List[Dict]:
+        """List training jobs, newest first."""
+        return [self._job_summary(job) for job in self.scheduler.list(status)]
+    
+    def _job_summary(self, job: Dict) -> Dict:
+        progress = job.get("progress") or {}
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "priority": job["priority"],
+            "model_name": job["payload"]["model_name"],
+            "dataset_path": job["payload"]["dataset_path"],
+            "created": job["created"],
+            "started": job["started"],
+            "finished": job["finished"],
+            "stage": progress.get("stage", job["status"]),
+            "progress": progress.get("progress", {}),
+            "is_training": job["status"] == "running",
+            "error": job.get("error")
+        }
+    
+    def _on_job_update(self, job: Dict):
+        """Mirror the latest job's progress, publish what changed and record finished jobs."""
+        progress = job.get("progress") or {}
+        with self._lock:
+            switched = job["status"] == "running" and job["id"] != self.active_job_id
+            if switched:
+                # A new job took over the legacy progress view
+                self.active_job_id = job["id"]
+                self.progress = {key: 0 for key in self.progress}
+                self.progress["in_use"] = False
+                self.progress["metrics"] = {}
+                self.current_stage = "training_model"
             
-            # 6. Model is in use
-            self.current_stage = "in_use"
-            self.progress["in_use"] = True
+            if job["id"] == self.active_job_id:
+                if progress:
+                    self.current_stage = progress["stage"]
+                    self.progress.update(progress["progress"])
+                if job["finished"]:
+                    self.current_stage = "idle"
             
-            # Record end time and save history
-            training_record["end_time"] = datetime.now().isoformat()
-            training_record["duration"] = time.time() - start_time
-            training_record["success"] = True
+            if self._job_status.get(job["id"]) != job["status"]:
+                self.events.publish("job", {
+                    "job_id": job["id"],
+                    "model_name": job["payload"]["model_name"],
+                    "status": job["status"],
+                    "error": job.get("error")
+                })
+                self._job_status[job["id"]] = job["status"]
             
-            self.training_history.append(training_record)
-            self._save_training_history()
+            if switched:
+                self._publish_snapshot()
+            else:
+                self._publish_changes()
             
-        except Exception as e:
-            print(f"Error in training pipeline: {e}")
+            if job["finished"]:
+                self._job_status.pop(job["id"], None)
+                # The worker may have promoted a new version
+                self.registry.refresh()
+                self._record_finished_job(job)
+    
+    def _progress_view(self) -> Dict:
+        """Flatten the legacy progress view into comparable fields."""
+        view = {
+            ("stage",): self.current_stage,
+            ("is_training",): self.is_training,
+            ("job_id",): self.active_job_id
+        }
+        for key, value in self.progress.items():
+            if key == "metrics":
+                for name, metric in value.items():
+                    view[("progress", "metrics", name)] = metric
+            else:
+                view[("progress", key)] = value
+        return view
+    
+    def _publish_snapshot(self):
+        """Publish the whole progress view, for watchers that must start over (lock held)."""
+        self._published = self._progress_view()
+        self.events.publish("snapshot", self.get_progress())
+    
+    def _publish_changes(self):
+        """Publish only the progress fields that changed since the last event (lock held)."""
+        view = self._progress_view()
+        changes: Dict = {}
+        for path, value in view.items():
+            if self._published.get(path, _UNSET) != value:
+                target = changes
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+        self._published = view
+        
+        if not changes:
+            return
+        if "stage" in changes:
+            self.events.publish("stage", {"stage": self.current_stage, "job_id": self.active_job_id})
+        self.events.publish("progress", changes)
+    
+    def _record_finished_job(self, job: Dict):
+        """Add a finished job to the training history (lock held)."""
+        # Checkpoints only matter while a job can still resume
+        CheckpointStore(os.path.join(self.model_dir, "checkpoints", job["id"])).clear()
+        
+        if job["status"] == "completed":
+            training_record = dict(job["result"], job_id=job["id"])
+        else:
             training_record = {
-                "model_name": model_name,
-                "start_time": datetime.now().isoformat(),
-                "end_time": datetime.now().isoformat(),
-                "error": str(e),
+                "model_name": job["payload"]["model_name"],
+                "job_id": job["id"],
+                "start_time": datetime.fromtimestamp(job["started"] or job["created"]).isoformat(),
+                "end_time": datetime.fromtimestamp(job["finished"]).isoformat(),
+                "error": job.get("error") or job["status"],
                 "success": False
             }
-            self.training_history.append(training_record)
-            self._save_training_history()
-        
-        finally:
-            self.is_training = False
-            self.current_stage = "idle"
+        try:
+            self.history.append(training_record)
+        except Exception as e:
+            print(f"Error saving training history: {e}")
     
-    def _train_model(self, model_name: str, dataset_path: str, params: Dict = None) -> Dict:
-        """Train the model and update progress."""
-        # Simulate training or implement actual training logic
-        total_epochs = params.get("epochs", 10) if params else 10
-        
-        results = {"accuracy": 0, "loss": 0}
+    def get_progress(self, job_id: str = None) -> Optional[Dict]:
+        """Get training progress for one job, or for the most recent job."""
+        if job_id is not None:
+            job = self.scheduler.get(job_id)
+            return self._job_summary(job) if job else None
         
-        for epoch in range(total_epochs):
-            # Update progress
-            self.progress["training_model"] = int((epoch + 1) / total_epochs * 100)
-            
-            # Simulate or implement actual epoch training
-            time.sleep(0.5)  # Simulate training time
-            
-            # Update results
-            results["accuracy"] = (epoch + 1) / total_epochs * 0.9  # Simulated accuracy
-            results["loss"] = 1 - results["accuracy"]
-        
-        # Save model
-        model_path = os.path.join(self.model_dir, f"{model_name}.model")
-        with open(model_path, 'w') as f:
-            json.dump({"trained": True, "params": params}, f)
+        return {
+            "stage": self.current_stage,
+            "progress": self.progress,
+            "is_training": self.is_training,
+            "job_id": self.active_job_id,
+            "jobs": self.scheduler.stats()
+        }
+    
+    def predict(self, texts: List[str], model_name: str = None) -> Optional[List[str]]:
+        """Classify texts with the in-use version of a model (by default the latest promoted).
         
-        return results
+        Raises QueueFull when too many predictions are already waiting.
+        """
+        return self.predictions.submit((model_name, list(texts)))
     
-    def _test_model(self, model_name: str) -> Dict:
-        """Test the model and update progress."""
-        # Simulate testing or implement actual testing logic
-        for i in range(10):
-            self.progress["testing_model"] = (i + 1) * 10
-            time.sleep(0.2)  # Simulate testing time
+    def _predict_batch(self, requests: List[Tuple[Optional[str], List[str]]]) -> List[Optional[List[str]]]:
+        """Classify the texts of several requests with one forward pass per model."""
+        groups: Dict[Optional[str], List[int]] = {}
+        for index, (model_name, _) in enumerate(requests):
+            groups.setdefault(model_name or self.registry.default_model(), []).append(index)
         
-        # Simulated test results
-        return {
-            "accuracy": 0.82,
-            "precision": 0.85,
-            "recall": 0.80,
-            "f1_score": 0.82
-        }
+        results: List[Optional[List[str]]] = [None] * len(requests)
+        for model_name, indexes in groups.items():
+            model = self.registry.get(model_name) if model_name else None
+            if model is None:
+                continue
+            texts = [text for index in indexes for text in requests[index][1]]
+            labels = model.predict_labels(texts) if texts else []
+            start = 0
+            for index in indexes:
+                count = len(requests[index][1])
+                results[index] = labels[start:start + count]
+                start += count
+        return results
     
-    def _fix_model(self, model_name: str, dataset_path: str, test_results: Dict) -> Dict:
-        """Fix model issues and update progress."""
-        # Determine what needs fixing based on test results
-        if test_results["accuracy"] < 0.7:
-            # Major issues - retrain from scratch with more data
-            for i in range(20):
-                self.progress["fixing_model"] = (i + 1) * 5
-                time.sleep(0.3)  # Simulate fixing time
-            
-            # Retrain with adjusted parameters
-            return self._train_model(model_name, dataset_path, {"epochs": 15})
-        else:
-            # Minor issues - fine-tune
-            for i in range(10):
-                self.progress["fixing_model"] = (i + 1) * 10
-                time.sleep(0.2)  # Simulate fixing time
-            
-            return {"accuracy": 0.88, "loss": 0.12}
+    def list_models(self) -> List[Dict]:
+        """Registered models with their versions and the version in use."""
+        return self.registry.list_models()
     
-    def _prepare_model_for_use(self, model_name: str):
-        """Prepare the model for production use."""
-        for i in range(10):
-            self.progress["getting_ready"] = (i + 1) * 10
-            time.sleep(0.1)  # Simulate preparation time
+    def get_model_versions(self, model_name: str) -> List[Dict]:
+        """Metadata of every stored version of a model, newest first."""
+        return self.registry.versions(model_name)
     
-    def get_progress(self) -> Dict:
-        """Get the current training progress."""
-        return {
-            "stage": self.current_stage,
-            "progress": self.progress,
-            "is_training": self.is_training
-        }
+    def promote_model(self, model_name: str, version: int) -> Dict:
+        """Serve another stored version of a model; requests in flight finish on the old one."""
+        try:
+            self.registry.promote(model_name, int(version))
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        with self._lock:
+            self.progress["in_use"] = True
+            self._publish_changes()
+        return {"status": "success", "message": f"Model {model_name} version {version} is in use"}
     
-    def start_continuous_learning(self, model_name: str):
-        """Start continuous learning from user interactions."""
-        if not self.progress["in_use"]:
+    def start_continuous_learning(self, model_name: str, params: Dict = None):
+        """Start continuous learning from user interactions.
+        
+        Labelled turns saved to conversation memory fine-tune the in-use
+        model in micro-batches. ``params`` may set ``batch_size``,
+        ``max_wait``, ``learning_rate`` and ``cpu_share`` (the fraction of a
+        core learning may use, by default CONTINUOUS_LEARNING_CPU_SHARE or 0.1).
+        """
+        if self.registry.in_use_version(model_name) is None:
             return {"status": "error", "message": "Model must be in use to start continuous learning"}
+        if self.memory_manager is None:
+            return {"status": "error", "message": "Continuous learning needs conversation memory"}
+        
+        params = dict(params or {})
+        params.setdefault("cpu_share", float(os.environ.get("CONTINUOUS_LEARNING_CPU_SHARE", 0.1)))
+        with self._lock:
+            if self.learner is not None:
+                return {"status": "error", "message": "Continuous learning is already running"}
+            try:
+                self.learner = ContinuousLearner(self.registry, model_name, self.memory_manager, **params)
+            except Exception as e:
+                print(f"Error starting continuous learning: {e}")
+                return {"status": "error", "message": f"Cannot start continuous learning for {model_name}: {e}"}
         
         # Start continuous learning thread
         threading.Thread(
             target=self._continuous_learning_loop,
-            args=(model_name,),
+            args=(self.learner,),
+            name="continuous-learning",
             daemon=True
         ).start()
         
         return {"status": "success", "message": "Continuous learning started"}
     
-    def _continuous_learning_loop(self, model_name: str):
-        """Continuously learn from new data."""
-        while self.progress["in_use"]:
-            # Simulate learning from recent interactions
-            self.progress["continuous_learning"] = (self.progress["continuous_learning"] + 1) % 100
-            time.sleep(5)  # Check for new data every 5 seconds
+    def stop_continuous_learning(self):
+        """Stop continuous learning after its current micro-batch."""
+        learner = self.learner
+        if learner is None:
+            return {"status": "error", "message": "Continuous learning is not running"}
+        learner.stop()
+        return {"status": "success", "message": "Continuous learning stopping"}
+    
+    def _continuous_learning_loop(self, learner: ContinuousLearner):
+        """Learn from new conversation turns until stopped."""
+        def on_update(stats: Dict):
+            with self._lock:
+                # Share of the next micro-batch collected so far
+                self.progress["continuous_learning"] = min(100, stats["pending"] * 100 // stats["batch_size"])
+                self.progress["metrics"]["continuous_learning"] = stats
+                self._publish_changes()
+        
+        try:
+            learner.run(on_update=on_update)
+        except Exception as e:
+            print(f"Error in continuous learning: {e}")
+        finally:
+            with self._lock:
+                self.learner = None
@@ -0,0 +1,149 @@
+import copy
+from typing import Any, Dict, List
+
+
+class PatchError(ValueError):
+    """Raised when a patch is malformed or does not apply to the document."""
+
+
+def parse_pointer(path: str) -> List[str]:
+    """Split a JSON Pointer (RFC 6901) into its unescaped reference tokens."""
+    if path == "":
+        return []
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _index(container: List, token: str, append: bool = False) -> int:
+    if append and token == "-":
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise PatchError(f"Array index out of range: {index}")
+    return index
+
+
+class _Patcher:
+    """Applies operations to a document, copying only the containers on each path.
+
+    The original document is never modified: every dict or list an
+    operation changes is shallow-copied once per patch, and everything off
+    the changed paths is shared with the original. Unchanged subtrees of the
+    result are therefore the same objects as in the input, which callers
+    can use to see what a patch touched.
+    """
+
+    def __init__(self, document: Any):
+        self.root = document
+        # Copies made by this patch, kept alive so their ids stay unique
+        self._copied: Dict[int, Any] = {}
+
+    def _own(self, value: Any) -> Any:
+        if isinstance(value, (dict, list)) and id(value) not in self._copied:
+            value = dict(value) if isinstance(value, dict) else list(value)
+            self._copied[id(value)] = value
+        return value
+
+    def _parent(self, tokens: List[str]) -> Any:
+        """The container holding the pointer's target, made writable."""
+        self.root = node = self._own(self.root)
+        for token in tokens[:-1]:
+            if isinstance(node, dict):
+                if token not in node:
+                    raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+                child = node[token] = self._own(node[token])
+            elif isinstance(node, list):
+                index = _index(node, token)
+                child = node[index] = self._own(node[index])
+            else:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            node = child
+        if not isinstance(node, (dict, list)):
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        return node
+
+    def get(self, tokens: List[str]) -> Any:
+        node = self.root
+        for token in tokens:
+            if isinstance(node, dict) and token in node:
+                node = node[token]
+            elif isinstance(node, list):
+                node = node[_index(node, token)]
+            else:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        return node
+
+    def add(self, tokens: List[str], value: Any):
+        if not tokens:
+            self.root = value
+            return
+        parent = self._parent(tokens)
+        if isinstance(parent, dict):
+            parent[tokens[-1]] = value
+        else:
+            parent.insert(_index(parent, tokens[-1], append=True), value)
+
+    def remove(self, tokens: List[str]) -> Any:
+        if not tokens:
+            raise PatchError("Cannot remove the whole document")
+        parent = self._parent(tokens)
+        if isinstance(parent, dict):
+            if tokens[-1] not in parent:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            return parent.pop(tokens[-1])
+        return parent.pop(_index(parent, tokens[-1]))
+
+    def replace(self, tokens: List[str], value: Any):
+        self.get(tokens)
+        if not tokens:
+            self.root = value
+            return
+        parent = self._parent(tokens)
+        if isinstance(parent, dict):
+            parent[tokens[-1]] = value
+        else:
+            parent[_index(parent, tokens[-1])] = value
+
+
+def apply_patch(document: Any, operations: List[Dict]) -> Any:
+    """Apply a JSON Patch (RFC 6902) and return the patched document.
+
+    Supports add, remove, replace, move, copy and test. The input is left
+    untouched (see _Patcher); any failing operation raises PatchError and
+    none of the patch takes effect.
+    """
+    if not isinstance(operations, list):
+        raise PatchError("A patch must be a list of operations")
+
+    patcher = _Patcher(document)
+    for operation in operations:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise PatchError(f"Invalid patch operation: {operation!r}")
+        op = operation["op"]
+        tokens = parse_pointer(operation["path"])
+
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"'{op}' needs a value")
+        if op == "add":
+            patcher.add(tokens, operation["value"])
+        elif op == "remove":
+            patcher.remove(tokens)
+        elif op == "replace":
+            patcher.replace(tokens, operation["value"])
+        elif op in ("move", "copy"):
+            source = parse_pointer(operation.get("from", ""))
+            if op == "move" and tokens[:len(source)] == source and tokens != source:
+                raise PatchError("Cannot move a value into itself")
+            # A copy must not share containers with its source, which may
+            # already be a writable copy that later operations modify in place
+            value = patcher.remove(source) if op == "move" else copy.deepcopy(patcher.get(source))
+            patcher.add(tokens, value)
+        elif op == "test":
+            if patcher.get(tokens) != operation["value"]:
+                raise PatchError(f"Test failed at {operation['path']}")
+        else:
+            raise PatchError(f"Unknown patch operation: {op!r}")
+    return patcher.root
@@ -0,0 +1,258 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from storage.cache import BoundedCache
+from storage.file_utils import atomic_write_json, file_lock
+from storage.write_behind import get_writer
+
+# Record fields kept in layout.json; state.json holds ``state``
+LAYOUT_FIELDS = ("id", "template", "template_version", "overrides")
+
+
+def _stamp(*paths: str) -> Tuple:
+    """Like file_stamp, plus the inode, which every atomic rewrite changes even
+    when mtime granularity and size would hide it."""
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+class WorkspaceStateStore:
+    """The one place workspace layout and state are persisted.
+
+    Each workspace is stored as ``<workspace_dir>/workspaces/<id>/layout.json``
+    (template reference and overrides, which rarely change) and
+    ``state.json`` (panel sizes, tool states and whatever else callers
+    keep there, which changes constantly). Both files carry the revision at
+    which they were last written; a workspace's revision is the larger of
+    the two.
+
+    Read-modify-write sequences run inside ``locked(id)``, which holds a
+    per-workspace file lock and reads the record from disk, so revision
+    checks hold across worker processes. ``put`` publishes the new record
+    to ``pending.json`` before the lock is released, without fsync, and
+    leaves the durable write of each part that changed to the shared
+    write-behind writer: a burst of updates within ``write_delay`` seconds
+    costs one fsynced write per part. ``pending.json`` is read in
+    preference to the other two files while it is at least as new.
+
+    Records are cached in memory and revalidated by the files' stamps, so
+    reads are memory hits unless another process wrote since. Workspace
+    files from before this layout (``<workspace_dir>/<id>.json``) are still
+    read, and removed once the workspace is next saved.
+    """
+
+    def __init__(self, workspace_dir: str, cache_ttl: float = 3600, write_delay: float = None):
+        self.workspace_dir = workspace_dir
+        self.records_dir = os.path.join(workspace_dir, "workspaces")
+        self.write_delay = float(os.environ.get("WORKSPACE_WRITE_DELAY", 0.5)) if write_delay is None else write_delay
+        self.writer = get_writer()
+
+        self.cache = BoundedCache("workspaces", max_entries=512, max_bytes=16 * 1024 * 1024, ttl=cache_ttl)
+        # Serialises threads of this process; the file lock serialises processes
+        self._lock = threading.RLock()
+        # Workspace ids whose file lock this thread holds, with nesting depth
+        self._held = threading.local()
+
+        os.makedirs(self.records_dir, exist_ok=True)
+
+    def _paths(self, workspace_id: str):
+        directory = os.path.join(self.records_dir, workspace_id)
+        return tuple(os.path.join(directory, name) for name in ("layout.json", "state.json", "pending.json"))
+
+    def _legacy_path(self, workspace_id: str) -> str:
+        return os.path.join(self.workspace_dir, f"{workspace_id}.json")
+
+    def _file_stamp(self, workspace_id: str) -> Tuple:
+        return _stamp(*self._paths(workspace_id), self._legacy_path(workspace_id))
+
+    def _holding(self, workspace_id: str) -> bool:
+        return getattr(self._held, "depth", {}).get(workspace_id, 0) > 0
+
+    @contextmanager
+    def locked(self, workspace_id: str):
+        """Hold a workspace exclusively, across threads and worker processes.
+
+        Inside the block ``get`` reads the files rather than the cache, so a
+        revision check sees every write another worker has made. Nested use
+        in the same thread is allowed.
+        """
+        depth = getattr(self._held, "depth", None)
+        if depth is None:
+            depth = self._held.depth = {}
+        if depth.get(workspace_id, 0):
+            depth[workspace_id] += 1
+            try:
+                yield
+            finally:
+                depth[workspace_id] -= 1
+            return
+
+        with self._lock, file_lock(os.path.join(self.records_dir, f"{workspace_id}.lock")):
+            depth[workspace_id] = 1
+            try:
+                yield
+            finally:
+                del depth[workspace_id]
+
+    def get(self, workspace_id: str) -> Optional[Dict]:
+        """A workspace's stored record: layout fields, ``state`` and ``revision``. Do not modify it."""
+        stamp = self._file_stamp(workspace_id)
+        if not self._holding(workspace_id):
+            record = self.cache.get(workspace_id, stamp=stamp)
+            if record is not None:
+                return record
+
+        try:
+            record = self._read(workspace_id)
+        except Exception as e:
+            print(f"Error loading workspace {workspace_id}: {e}")
+            return None
+        if record is not None:
+            self.cache.set(workspace_id, record, stamp=stamp)
+        return record
+
+    def _read(self, workspace_id: str) -> Optional[Dict]:
+        record = self._read_durable(workspace_id)
+        pending_path = self._paths(workspace_id)[2]
+        try:
+            with open(pending_path, 'r') as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            return record
+        except ValueError as e:
+            # Not fsynced, so a machine crash can leave it empty
+            print(f"Error loading pending workspace {workspace_id}: {e}")
+            return record
+        if record is None or pending.get("revision", 0) >= record.get("revision", 0):
+            return pending
+        return record
+
+    def _read_durable(self, workspace_id: str) -> Optional[Dict]:
+        layout_path, state_path, _ = self._paths(workspace_id)
+        parts = {}
+        for part, path in (("layout", layout_path), ("state", state_path)):
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    parts[part] = json.load(f)
+
+        if not parts:
+            legacy_path = self._legacy_path(workspace_id)
+            if not os.path.exists(legacy_path):
+                return None
+            with open(legacy_path, 'r') as f:
+                return json.load(f)
+
+        layout = parts.get("layout", {})
+        state = parts.get("state", {})
+        record = {field: layout[field] for field in LAYOUT_FIELDS if field in layout}
+        record["id"] = workspace_id
+        record["state"] = state.get("state", {})
+        record["revision"] = max(layout.get("revision", 0), state.get("revision", 0))
+        return record
+
+    def put(self, workspace_id: str, record: Dict) -> Dict:
+        """Store a workspace record and return it with its new revision.
+
+        Only the parts that differ from the stored record are queued for
+        writing; if nothing differs the stored record is returned unchanged.
+        """
+        with self.locked(workspace_id):
+            current = self.get(workspace_id)
+            state = record.get("state") or {}
+            # Workspaces still in a pre-layout file are written out in full
+            rewrite = current is None or os.path.exists(self._legacy_path(workspace_id))
+            layout_changed = rewrite or any(record.get(field) != current.get(field)
+                                            for field in LAYOUT_FIELDS if field != "id")
+            state_changed = rewrite or state != current.get("state", {})
+            if not (layout_changed or state_changed):
+                return current
+
+            stored = {field: record[field] for field in LAYOUT_FIELDS if field in record}
+            stored.update(id=workspace_id, state=state, revision=(current or {}).get("revision", 0) + 1)
+            return self._save(workspace_id, stored, layout_changed, state_changed)
+
+    def _save(self, workspace_id: str, record: Dict, layout_changed: bool, state_changed: bool) -> Dict:
+        """Publish a record and queue the changed parts for writing (file lock held)."""
+        atomic_write_json(self._paths(workspace_id)[2], record, sync=False)
+        self.cache.set(workspace_id, record, stamp=self._file_stamp(workspace_id))
+
+        for part, changed in (("layout", layout_changed), ("state", state_changed)):
+            if changed:
+                self.writer.submit((self.records_dir, workspace_id, part),
+                                   lambda part=part: self._persist(workspace_id, part), record,
+                                   delay=self.write_delay)
+        return record
+
+    def _persist(self, workspace_id: str, part: str):
+        """Durably write one part of the latest record (writer thread)."""
+        with self.locked(workspace_id):
+            record = self.get(workspace_id)
+            if record is None:
+                return
+            layout_path, state_path, _ = self._paths(workspace_id)
+            path = layout_path if part == "layout" else state_path
+            try:
+                with open(path, 'r') as f:
+                    if json.load(f).get("revision", 0) >= record["revision"]:
+                        # Another worker already wrote this revision or a later one
+                        return
+            except (OSError, ValueError):
+                pass
+
+            if part == "state":
+                atomic_write_json(state_path, {"state": record.get("state", {}), "revision": record["revision"]})
+            else:
+                layout = {field: record[field] for field in LAYOUT_FIELDS if field in record}
+                atomic_write_json(layout_path, dict(layout, revision=record["revision"]), indent=2)
+                legacy_path = self._legacy_path(workspace_id)
+                if os.path.exists(legacy_path):
+                    os.remove(legacy_path)
+            self.cache.set(workspace_id, record, stamp=self._file_stamp(workspace_id))
+
+    def get_state(self, workspace_id: str) -> Optional[Dict]:
+        record = self.get(workspace_id)
+        return record.get("state") if record is not None else None
+
+    def put_state(self, workspace_id: str, state: Dict) -> Dict:
+        """Replace a workspace's state, creating a state-only record if it has no layout yet."""
+        with self.locked(workspace_id):
+            record = self.get(workspace_id) or {"id": workspace_id}
+            return self.put(workspace_id, dict(record, state=state))
+
+    def ids(self) -> List[str]:
+        ids = set()
+        if os.path.isdir(self.records_dir):
+            ids.update(name for name in os.listdir(self.records_dir)
+                       if os.path.isdir(os.path.join(self.records_dir, name)))
+        ids.update(name[:-len('.json')] for name in os.listdir(self.workspace_dir)
+                   if name.endswith('.json') and not name.startswith('.'))
+        return sorted(ids)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until queued workspace writes have reached disk."""
+        return self.writer.flush(timeout)
+
+
+_stores: Dict[str, WorkspaceStateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(workspace_dir: str = "workspace", **options) -> WorkspaceStateStore:
+    """Return the process-wide store for a workspace directory, shared by all managers.
+
+    ``options`` are passed to WorkspaceStateStore when the store is first created.
+    """
+    key = os.path.abspath(workspace_dir)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = WorkspaceStateStore(workspace_dir, **options)
+        return _stores[key]
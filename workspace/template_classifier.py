@@ -0,0 +1,122 @@
+import re
+from typing import Dict, List, Tuple
+
+
+def _normalize_keyword(keyword: str) -> Tuple[str, bool]:
+    """Lowercased keyword with single spaces, and whether it ends in the ``*`` wildcard."""
+    keyword = keyword.strip().lower()
+    return " ".join(keyword.rstrip('*').split()), keyword.endswith('*')
+
+
+def _trie_pattern(keywords: List[str]) -> str:
+    """Regex matching any of ``keywords``, shaped as a trie so each position costs one branch."""
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict, root: bool = False) -> str:
+        # The word-start check follows the first character rather than leading the
+        # pattern, so the regex engine can still skip ahead to possible first characters
+        branches = [(r"\s+" if char == " " else re.escape(char)) + (r"(?<!\w.)" if root else "") + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A keyword ends here; still try the longer ones first
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie, root=True)
+
+
+class TemplateClassifier:
+    """Picks a workspace template for a task description in one regex pass.
+
+    Every template may have a ``keywords`` section mapping keywords to
+    weights, e.g. ``{"code": 2, "debug*": 2, "unit test": 1}``. Keywords
+    match whole words case-insensitively; a trailing ``*`` also matches
+    longer words (``develop*`` matches "developer"), and multi-word keywords
+    match across any whitespace. All keywords are compiled into a single
+    trie-shaped pattern that only matches at word starts, so a text is scanned once
+    and the cost barely grows with the number of keywords. Each keyword
+    counts once per text, the template with the highest total weight wins
+    and ties go to the template id that sorts first. Texts matching nothing
+    get ``default``.
+    """
+
+    def __init__(self, templates: Dict[str, Dict], default: str = "default"):
+        self.default = default
+        # Keyword -> [(template_id, weight)], for exact words and for ``*`` stems
+        self._exact: Dict[str, List[Tuple[str, float]]] = {}
+        self._stems: Dict[str, List[Tuple[str, float]]] = {}
+
+        for template_id in sorted(templates):
+            keywords = templates[template_id].get("keywords") or {}
+            for keyword, weight in keywords.items():
+                keyword, stem = _normalize_keyword(keyword)
+                if keyword:
+                    targets = self._stems if stem else self._exact
+                    targets.setdefault(keyword, []).append((template_id, float(weight)))
+
+        # Longest stems first, so "animation*" is preferred over "animat*"
+        self._stem_lengths = sorted({len(stem) for stem in self._stems}, reverse=True)
+        keywords = set(self._exact) | set(self._stems)
+        self._pattern = re.compile(_trie_pattern(sorted(keywords)) + r"\w*") if keywords else None
+
+    @property
+    def keyword_count(self) -> int:
+        return len(self._exact) + len(self._stems)
+
+    def _resolve(self, word: str, matched: Dict[Tuple[str, bool], List[Tuple[str, float]]]):
+        """Record every keyword a matched word stands for in ``matched``."""
+        targets = self._exact.get(word)
+        if targets:
+            matched[(word, False)] = targets
+        for length in self._stem_lengths:
+            targets = self._stems.get(word[:length])
+            if targets:
+                matched[(word[:length], True)] = targets
+                break
+        if " " in word:
+            # A phrase also counts as its first word
+            self._resolve(word.split(" ", 1)[0], matched)
+
+    @staticmethod
+    def _total(matched: Dict) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for targets in matched.values():
+            for template_id, weight in targets:
+                scores[template_id] = scores.get(template_id, 0.0) + weight
+        return scores
+
+    def _best(self, scores: Dict[str, float]) -> str:
+        if len(scores) == 1:
+            template_id, score = next(iter(scores.items()))
+            return template_id if score > 0 else self.default
+        best = max(scores.values(), default=0)
+        if best <= 0:
+            return self.default
+        return min(template_id for template_id, score in scores.items() if score == best)
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Total keyword weight per template for a text."""
+        if self._pattern is None or not text:
+            return {}
+        matched = {}
+        for match in self._pattern.findall(text.lower()):
+            self._resolve(" ".join(match.split()), matched)
+        return self._total(matched)
+
+    def classify(self, text: str) -> str:
+        return self._best(self.scores(text))
+
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        """Classify many task descriptions, scanning each distinct text once."""
+        results: Dict[str, str] = {}
+        classify = self.classify
+        for text in texts:
+            if text not in results:
+                results[text] = classify(text)
+        return [results[text] for text in texts]
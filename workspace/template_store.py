@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from storage.file_utils import atomic_write_json, file_lock
+
+VERSION_FILE_PATTERN = re.compile(r"^v(\d+)\.json$")
+
+
+def template_digest(template: Dict) -> str:
+    return hashlib.sha256(json.dumps(template, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TemplateStore:
+    """Workspace templates that reload when their files change.
+
+    ``<templates_dir>/<id>.json`` files are polled by mtime and size at most
+    every ``poll_interval`` seconds, and only files that changed are read
+    again. Fields a file leaves out are taken from the built-in template of
+    the same id in ``defaults``.
+
+    Each distinct content of a template is kept as a numbered version in
+    ``<templates_dir>/.versions/<id>/v<n>.json``, so workspaces can keep
+    referring to the version they were created from after the file is
+    edited or removed. Templates returned by ``get`` are shared between
+    callers and must not be modified.
+    """
+
+    def __init__(self, templates_dir: str, defaults: Dict[str, Dict] = None, poll_interval: float = 1.0):
+        self.templates_dir = templates_dir
+        self.versions_dir = os.path.join(templates_dir, ".versions")
+        self.lock_path = os.path.join(self.versions_dir, ".lock")
+        self.defaults = defaults or {}
+        self.poll_interval = poll_interval
+
+        # template_id -> current template, its version and its file's (mtime_ns, size)
+        self._current: Dict[str, Dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._stamps: Dict[str, tuple] = {}
+        # (template_id, version) -> template, for versions that are no longer current
+        self._history: Dict[tuple, Dict] = {}
+        self._checked = 0.0
+        self._lock = threading.RLock()
+
+        # Bumped whenever any template changes, so dependants know to rebuild
+        self.generation = 0
+        self.reloads = 0
+
+        os.makedirs(self.versions_dir, exist_ok=True)
+        self.refresh()
+
+    def _version_dir(self, template_id: str) -> str:
+        return os.path.join(self.versions_dir, template_id)
+
+    def _version_path(self, template_id: str, version: int) -> str:
+        return os.path.join(self._version_dir(template_id), f"v{version:06d}.json")
+
+    def _latest_version(self, template_id: str) -> int:
+        directory = self._version_dir(template_id)
+        if not os.path.isdir(directory):
+            return 0
+        versions = [int(match.group(1)) for match in map(VERSION_FILE_PATTERN.match, os.listdir(directory)) if match]
+        return max(versions, default=0)
+
+    def _read_version(self, template_id: str, version: int) -> Optional[Dict]:
+        try:
+            with open(self._version_path(template_id, version), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def refresh(self, force: bool = True):
+        """Reload template files that changed since they were last read."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.poll_interval:
+            return
+        self._checked = now
+
+        stamps = {}
+        try:
+            for entry in os.scandir(self.templates_dir):
+                if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file():
+                    stat = entry.stat()
+                    stamps[entry.name[:-len('.json')]] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            changed = False
+            for template_id in set(self._stamps) - set(stamps):
+                # Removed; workspaces using it still resolve through its versions
+                self._current.pop(template_id, None)
+                self._stamps.pop(template_id, None)
+                changed = True
+
+            for template_id, stamp in stamps.items():
+                if self._stamps.get(template_id) == stamp:
+                    continue
+                try:
+                    self._load(template_id)
+                    self._stamps[template_id] = stamp
+                    changed = True
+                except Exception as e:
+                    print(f"Error loading template {template_id}: {e}")
+
+            if changed:
+                self.generation += 1
+
+    def _load(self, template_id: str):
+        with open(os.path.join(self.templates_dir, f"{template_id}.json"), 'r') as f:
+            template = json.load(f)
+        for field, value in self.defaults.get(template_id, {}).items():
+            template.setdefault(field, value)
+
+        if self._current.get(template_id) == template:
+            return
+        self.reloads += 1
+
+        digest = template_digest(template)
+        with file_lock(self.lock_path):
+            # Another worker may have recorded this content already
+            version = self._latest_version(template_id)
+            latest = self._read_version(template_id, version) if version else None
+            if latest is None or template_digest(latest) != digest:
+                version += 1
+                os.makedirs(self._version_dir(template_id), exist_ok=True)
+                atomic_write_json(self._version_path(template_id, version), template, indent=2)
+
+        previous = self._versions.get(template_id)
+        if previous is not None and previous != version and template_id in self._current:
+            self._history[(template_id, previous)] = self._current[template_id]
+        self._current[template_id] = template
+        self._versions[template_id] = version
+
+    def templates(self) -> Dict[str, Dict]:
+        """The current version of every template, by id."""
+        self.refresh(force=False)
+        return dict(self._current)
+
+    def current_version(self, template_id: str) -> Optional[int]:
+        self.refresh(force=False)
+        return self._versions.get(template_id) if template_id in self._current else None
+
+    def get(self, template_id: str, version: int = None) -> Optional[Dict]:
+        """A template, by default its current version."""
+        self.refresh(force=False)
+        if version is None or (template_id in self._current and self._versions.get(template_id) == version):
+            return self._current.get(template_id)
+
+        template = self._history.get((template_id, version))
+        if template is None:
+            template = self._read_version(template_id, version)
+            if template is not None:
+                with self._lock:
+                    self._history[(template_id, version)] = template
+        return template
+
+    def versions(self, template_id: str) -> List[int]:
+        directory = self._version_dir(template_id)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(VERSION_FILE_PATTERN.match, os.listdir(directory)) if match)
+
+    def stats(self) -> Dict:
+        return {
+            "templates": len(self._current),
+            "versions": dict(self._versions),
+            "generation": self.generation,
+            "reloads": self.reloads
+        }
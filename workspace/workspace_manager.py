@@ -2,30 +2,51 @@ import os
 import json
 from typing import Dict, List, Optional, Any
 
+from workspace.json_patch import PatchError, apply_patch
+from workspace.state_store import get_state_store
+from workspace.template_classifier import TemplateClassifier
+from workspace.template_store import TemplateStore
+
+# Workspace fields that come from its template unless the workspace overrides them
+TEMPLATE_FIELDS = {
+    "name": "Workspace",
+    "tools": [],
+    "layout": "simple",
+    "theme": "light",
+    "panels": []
+}
+
+# Fields of a materialized workspace that updates may not change
+READ_ONLY_FIELDS = ("id", "template", "template_version", "revision")
+
 class WorkspaceManager:
     """Manages adaptive workspace UI and tools based on current task."""
     
-    def __init__(self, workspace_dir: str = "workspace"):
+    def __init__(self, workspace_dir: str = "workspace", cache_ttl: float = 3600):
         self.workspace_dir = workspace_dir
         self.templates_dir = os.path.join(workspace_dir, "templates")
-        self.active_workspaces = {}
+        
+        # Workspace layout and state, cached and shared with MemoryManager
+        self.state_store = get_state_store(workspace_dir, cache_ttl=cache_ttl)
         
         # Create directories if they don't exist
         os.makedirs(self.workspace_dir, exist_ok=True)
         os.makedirs(self.templates_dir, exist_ok=True)
         
-        # Load workspace templates
-        self.templates = self._load_templates()
+        # Load workspace templates; edited files are picked up while running
+        self.template_store = self._load_templates()
+        self._classifier = None
+        self._classifier_generation = None
     
-    def _load_templates(self) -> Dict:
+    def _load_templates(self) -> TemplateStore:
         """Load workspace templates from files."""
-        templates = {}
         
         # Default templates if none exist
         default_templates = {
             "coding": {
                 "name": "Coding Workspace",
                 "description": "Workspace for software development",
+                "keywords": {"code": 2, "coding": 2, "program*": 2, "develop*": 1, "debug*": 2, "script": 1},
                 "tools": ["code_editor", "terminal", "file_explorer", "git_panel"],
                 "layout": "split",
                 "theme": "dark",
@@ -39,6 +60,7 @@ class WorkspaceManager:
             "writing": {
                 "name": "Writing Workspace",
                 "description": "Workspace for content creation",
+                "keywords": {"write": 2, "writing": 2, "blog*": 2, "article*": 2, "story": 2, "stories": 2, "script": 1},
                 "tools": ["text_editor", "research_panel", "outline_tool"],
                 "layout": "focused",
                 "theme": "light",
@@ -51,6 +73,7 @@ class WorkspaceManager:
             "animation": {
                 "name": "Animation Workspace",
                 "description": "Workspace for creating animations",
+                "keywords": {"animate*": 2, "animation*": 2, "motion": 1, "video*": 1},
                 "tools": ["timeline", "canvas", "asset_library", "preview_panel"],
                 "layout": "complex",
                 "theme": "dark",
@@ -64,6 +87,7 @@ class WorkspaceManager:
             "music": {
                 "name": "Music Production",
                 "description": "Workspace for music and audio production",
+                "keywords": {"music*": 2, "song*": 2, "audio": 2, "sound*": 1, "compose*": 1, "composing": 1},
                 "tools": ["track_editor", "mixer", "instrument_panel", "audio_library"],
                 "layout": "complex",
                 "theme": "dark",
@@ -89,7 +113,7 @@ class WorkspaceManager:
         }
         
         # Check if template files exist
-        template_files = os.listdir(self.templates_dir) if os.path.exists(self.templates_dir) else []
+        template_files = [name for name in os.listdir(self.templates_dir) if name.endswith('.json')]
         
         if not template_files:
             # Save default templates
@@ -97,40 +121,40 @@ class WorkspaceManager:
                 template_path = os.path.join(self.templates_dir, f"{template_id}.json")
                 with open(template_path, 'w') as f:
                     json.dump(template, f, indent=2)
-            
-            templates = default_templates
-        else:
-            # Load templates from files
-            for file_name in template_files:
-                if not file_name.endswith('.json'):
-                    continue
-                    
-                template_id = file_name.replace('.json', '')
-                template_path = os.path.join(self.templates_dir, file_name)
-                
-                try:
-                    with open(template_path, 'r') as f:
-                        templates[template_id] = json.load(f)
-                except Exception as e:
-                    print(f"Error loading template {template_id}: {e}")
-        
-        return templates
+        
+        # Fields missing from a file (such as keywords in files saved before
+        # they existed) come from the built-in template of the same id
+        return TemplateStore(self.templates_dir, defaults=default_templates)
+    
+    @property
+    def templates(self) -> Dict[str, Dict]:
+        """Current version of every template, by id."""
+        return self.template_store.templates()
+    
+    @property
+    def template_classifier(self) -> TemplateClassifier:
+        """Keyword classifier, rebuilt when a template changes."""
+        self.template_store.refresh(force=False)
+        if self._classifier_generation != self.template_store.generation:
+            self._classifier = TemplateClassifier(self.template_store.templates())
+            self._classifier_generation = self.template_store.generation
+        return self._classifier
     
     def create_workspace(self, workspace_id: str, template_id: str = "default") -> Dict:
-        """Create a new workspace based on a template."""
-        if template_id not in self.templates:
+        """Create a new workspace based on a template.
+        
+        Only the template id and version are stored with the workspace, not
+        copies of the template's fields; see _materialize.
+        """
+        version = self.template_store.current_version(template_id)
+        if version is None:
             return {"status": "error", "message": f"Template not found: {template_id}"}
         
-        # Create workspace based on template
-        template = self.templates[template_id]
-        workspace = {
+        record = {
             "id": workspace_id,
-            "name": template.get("name", "Workspace"),
             "template": template_id,
-            "tools": template.get("tools", []),
-            "layout": template.get("layout", "simple"),
-            "theme": template.get("theme", "light"),
-            "panels": template.get("panels", []),
+            "template_version": version,
+            "overrides": {},
             "state": {
                 "active_panel": "main",
                 "panel_sizes": {},
@@ -139,101 +163,176 @@ class WorkspaceManager:
         }
         
         # Save workspace
-        workspace_path = os.path.join(self.workspace_dir, f"{workspace_id}.json")
-        with open(workspace_path, 'w') as f:
-            json.dump(workspace, f, indent=2)
+        record = self._save_workspace(workspace_id, record)
         
-        # Add to active workspaces
-        self.active_workspaces[workspace_id] = workspace
+        return {"status": "success", "message": "Workspace created", "workspace": self._materialize(record)}
+    
+    def _materialize(self, record: Dict) -> Dict:
+        """Build the full workspace from its template version and overrides.
+        
+        Fields the workspace has not overridden are the template's own
+        objects, shared with every workspace on that version; change them
+        through update_workspace rather than in place.
+        """
+        template = self.template_store.get(record["template"], record.get("template_version")) or {}
+        overrides = record.get("overrides", {})
+        
+        workspace = {"id": record["id"], "template": record["template"],
+                     "template_version": record.get("template_version"), "revision": record.get("revision", 0)}
+        for field, default in TEMPLATE_FIELDS.items():
+            workspace[field] = overrides[field] if field in overrides else template.get(field, default)
+        workspace["state"] = record.get("state", {})
+        return workspace
+    
+    def _record(self, workspace: Dict) -> Dict:
+        """Convert a workspace file saved in full to a template reference plus overrides."""
+        if "overrides" in workspace:
+            return workspace
+        
+        template_id = workspace.get("template", "default")
+        version = self.template_store.current_version(template_id)
+        template = self.template_store.get(template_id, version) or {}
+        return {
+            "id": workspace.get("id"),
+            "template": template_id,
+            "template_version": version,
+            "revision": workspace.get("revision", 0),
+            "overrides": {field: workspace[field] for field in TEMPLATE_FIELDS
+                          if field in workspace and workspace[field] != template.get(field, TEMPLATE_FIELDS[field])},
+            "state": workspace.get("state", {})
+        }
+    
+    def _save_workspace(self, workspace_id: str, record: Dict) -> Dict:
+        """Store a workspace record; returns it with its new revision.
         
-        return {"status": "success", "message": "Workspace created", "workspace": workspace}
+        The record is visible to other workers at once; the changed part
+        (layout or state) is written behind, coalescing bursts of updates.
+        See WorkspaceStateStore.
+        """
+        return self.state_store.put(workspace_id, record)
+    
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until queued workspace writes have reached disk."""
+        return self.state_store.flush(timeout)
+    
+    def _get_record(self, workspace_id: str) -> Optional[Dict]:
+        """The stored form of a workspace: template reference, overrides and state."""
+        record = self.state_store.get(workspace_id)
+        return self._record(record) if record is not None else None
     
     def get_workspace(self, workspace_id: str) -> Optional[Dict]:
         """Get workspace configuration."""
-        # Check active workspaces first
-        if workspace_id in self.active_workspaces:
-            return self.active_workspaces[workspace_id]
+        record = self._get_record(workspace_id)
+        return self._materialize(record) if record is not None else None
+    
+    def update_workspace(self, workspace_id: str, updates: Dict, expected_revision: int = None) -> Dict:
+        """Update workspace configuration by replacing top-level fields.
+        
+        Same as patch_workspace with an ``add`` of each field; fields other
+        than the template fields and ``state`` are ignored.
+        """
+        operations = [{"op": "add", "path": f"/{key}", "value": value} for key, value in updates.items()
+                      if key in TEMPLATE_FIELDS or key == "state"]
+        return self.patch_workspace(workspace_id, operations, expected_revision)
+    
+    def patch_workspace(self, workspace_id: str, operations: List[Dict], expected_revision: int = None) -> Dict:
+        """Apply a JSON Patch to a workspace and bump its revision.
         
-        # Check file system
-        workspace_path = os.path.join(self.workspace_dir, f"{workspace_id}.json")
-        if os.path.exists(workspace_path):
+        Paths address the workspace as get_workspace returns it, e.g.
+        ``/state/panel_sizes/editor`` or ``/panels/0/position``. Only the
+        containers on each path are copied. A template field the patch
+        changes becomes an override, and removing one reverts it to the
+        template. With ``expected_revision``, the patch is rejected
+        (``"error": "conflict"``) unless the workspace is still at that
+        revision, so a stale tab cannot overwrite newer changes.
+        """
+        with self.state_store.locked(workspace_id):
+            record = self._get_record(workspace_id)
+            if not record:
+                return {"status": "error", "error": "not_found", "message": f"Workspace not found: {workspace_id}"}
+            
+            revision = record.get("revision", 0)
+            if expected_revision is not None and expected_revision != revision:
+                return {"status": "error", "error": "conflict", "revision": revision,
+                        "message": f"Workspace is at revision {revision}, not {expected_revision}"}
+            
+            workspace = self._materialize(record)
             try:
-                with open(workspace_path, 'r') as f:
-                    workspace = json.load(f)
-                    # Add to active workspaces
-                    self.active_workspaces[workspace_id] = workspace
-                    return workspace
-            except Exception as e:
-                print(f"Error loading workspace {workspace_id}: {e}")
+                patched = apply_patch(workspace, operations)
+                record = self._apply_changes(record, workspace, patched)
+            except PatchError as e:
+                return {"status": "error", "error": "invalid_patch", "message": str(e)}
+            
+            if record is not None:
+                workspace = self._materialize(self._save_workspace(workspace_id, record))
         
-        return None
+        return {"status": "success", "message": "Workspace updated", "workspace": workspace,
+                "revision": workspace["revision"]}
     
-    def update_workspace(self, workspace_id: str, updates: Dict) -> Dict:
-        """Update workspace configuration."""
-        workspace = self.get_workspace(workspace_id)
-        if not workspace:
-            return {"status": "error", "message": f"Workspace not found: {workspace_id}"}
+    def _apply_changes(self, record: Dict, workspace: Dict, patched: Any) -> Optional[Dict]:
+        """The record for a patched workspace, or None if nothing changed."""
+        if not isinstance(patched, dict):
+            raise PatchError("A workspace must remain an object")
+        for field in READ_ONLY_FIELDS:
+            if patched.get(field) != workspace[field]:
+                raise PatchError(f"Workspace field is read-only: {field}")
+        unknown = set(patched) - set(workspace)
+        if unknown:
+            raise PatchError(f"Unknown workspace field: {sorted(unknown)[0]}")
         
-        # Update workspace properties
-        for key, value in updates.items():
-            if key in workspace and key != "id":
-                workspace[key] = value
+        template = self.template_store.get(record["template"], record.get("template_version")) or {}
+        overrides = dict(record.get("overrides", {}))
+        changed = False
         
-        # Save updated workspace
-        workspace_path = os.path.join(self.workspace_dir, f"{workspace_id}.json")
-        with open(workspace_path, 'w') as f:
-            json.dump(workspace, f, indent=2)
+        # The patch copies only what it touches, so untouched fields are the same objects
+        for field, default in TEMPLATE_FIELDS.items():
+            if field in patched and patched[field] is workspace[field]:
+                continue
+            changed = True
+            if field not in patched or patched[field] == template.get(field, default):
+                overrides.pop(field, None)
+            else:
+                overrides[field] = patched[field]
         
-        # Update active workspaces
-        self.active_workspaces[workspace_id] = workspace
+        state = patched.get("state", {})
+        if not isinstance(state, dict):
+            raise PatchError("Workspace state must be an object")
+        if state is not workspace["state"]:
+            changed = True
         
-        return {"status": "success", "message": "Workspace updated", "workspace": workspace}
+        if not changed:
+            return None
+        return dict(record, overrides=overrides, state=state)
     
     def switch_workspace_template(self, workspace_id: str, template_id: str) -> Dict:
-        """Switch workspace to a different template."""
-        if template_id not in self.templates:
+        """Switch workspace to a different template, or to the latest version of its own."""
+        version = self.template_store.current_version(template_id)
+        if version is None:
             return {"status": "error", "message": f"Template not found: {template_id}"}
         
-        workspace = self.get_workspace(workspace_id)
-        if not workspace:
-            return {"status": "error", "message": f"Workspace not found: {workspace_id}"}
-        
-        # Get template
-        template = self.templates[template_id]
-        
-        # Update workspace with template properties
-        workspace["template"] = template_id
-        workspace["tools"] = template.get("tools", [])
-        workspace["layout"] = template.get("layout", "simple")
-        workspace["theme"] = template.get("theme", "light")
-        workspace["panels"] = template.get("panels", [])
-        
-        # Preserve workspace ID and name
-        workspace_name = workspace.get("name", "Workspace")
-        
-        # Save updated workspace
-        workspace_path = os.path.join(self.workspace_dir, f"{workspace_id}.json")
-        with open(workspace_path, 'w') as f:
-            json.dump(workspace, f, indent=2)
-        
-        # Update active workspaces
-        self.active_workspaces[workspace_id] = workspace
+        with self.state_store.locked(workspace_id):
+            record = self._get_record(workspace_id)
+            if not record:
+                return {"status": "error", "message": f"Workspace not found: {workspace_id}"}
+            
+            # Preserve workspace ID and name; everything else comes from the template
+            workspace_name = self._materialize(record)["name"]
+            record = dict(record, template=template_id, template_version=version, overrides={})
+            if workspace_name != self.template_store.get(template_id, version).get("name", TEMPLATE_FIELDS["name"]):
+                record["overrides"]["name"] = workspace_name
+            
+            # Save updated workspace
+            record = self._save_workspace(workspace_id, record)
         
-        return {"status": "success", "message": "Workspace template switched", "workspace": workspace}
+        return {"status": "success", "message": "Workspace template switched", "workspace": self._materialize(record)}
     
     def detect_appropriate_template(self, task_description: str) -> str:
-        """Detect the most appropriate workspace template based on task description."""
-        # Simple keyword-based detection
-        task_lower = task_description.lower()
-        
-        if any(keyword in task_lower for keyword in ["code", "program", "develop", "script", "debug"]):
-            return "coding"
-        elif any(keyword in task_lower for keyword in ["write", "blog", "article", "story", "script"]):
-            return "writing"
-        elif any(keyword in task_lower for keyword in ["animate", "animation", "motion", "video"]):
-            return "animation"
-        elif any(keyword in task_lower for keyword in ["music", "song", "audio", "sound", "compose"]):
-            return "music"
-        
-        # Default template if no match
-        return "default"
+        """Detect the most appropriate workspace template based on task description.
+        
+        Scores every template's ``keywords`` in one pass; see TemplateClassifier.
+        """
+        return self.template_classifier.classify(task_description)
+    
+    def detect_appropriate_templates(self, task_descriptions: List[str]) -> List[str]:
+        """Detect templates for many task descriptions at once."""
+        return self.template_classifier.classify_batch(task_descriptions)